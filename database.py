@@ -1,9 +1,29 @@
 import os
 import sys
 import csv
+import io
+import gzip
+import codecs
 import json
-from datetime import datetime
-from typing import List, Dict, Optional, Tuple
+import time
+import atexit
+import weakref
+import functools
+import itertools
+import threading
+from concurrent.futures import Future
+from datetime import date, datetime
+from typing import Iterable, Iterator, List, Dict, Optional, Sequence, Tuple
+
+from database_index import (EVENT_HEADERS, PartitionCatalog, PartitionIndex, ScorePrefixIndex, archive_sources,
+                            is_archive, iter_events_between, iter_events_with_offsets, match_event_names,
+                            merge_daily_rollups, merge_name_grams, merge_partitions_by_time, merge_postings,
+                            partition_name, read_events_at, summarize_daily_rollups, summarize_name_grams,
+                            summarize_postings_by_student)
+from database_binlog import BINLOG_SUFFIX, STRING_TABLE_FILE, is_binlog, read_binlog_columns, write_binlog
+from database_columnar import COLUMNAR_SUFFIX, ColumnarPartition, encode_timestamp
+from database_events import Event, EventBatch
+from database_lock import data_dir_lock, is_network_path, replace_file
 
 # 数据文件路径配置
 DATA_DIR = 'data'
@@ -18,6 +38,13 @@ REWARD_RULES_FILE = 'reward_rules.csv'
 DAILY_TASK_RULES_FILE = 'daily_task_rules.csv'
 DAILY_TASK_EVENTS_FILE = 'daily_task_events.csv'
 SCORE_EVENTS_DIR = 'score_events'  # 积分事件按天存储的目录
+SCORE_EVENTS_INDEX_DIR = '.index'  # 积分事件索引目录（位于积分事件目录下）
+BALANCES_FILE = 'balances.csv'  # 学生当前积分检查点
+BALANCES_JOURNAL_FILE = 'balances.journal'  # 检查点之后的积分变化日志
+TOMBSTONES_FILE = 'tombstones.json'  # 已删除学生的墓碑（位于积分事件目录下）
+EVENT_TYPES = ('score', 'reward', 'daily_task')  # 积分事件类型
+EVENT_TYPE_NAMES = {'score': '积分记录', 'reward': '兑换记录', 'daily_task': '每日任务'}  # 界面和导出文件中显示的类型名称
+EXPORT_HEADERS = ["学号", "学生姓名", "事件名称", "积分变化", "时间", "事件类型"]
 
 def get_data_dir():
     """获取数据目录路径，兼容PyInstaller打包"""
@@ -27,818 +54,2181 @@ def get_data_dir():
     else:
         # 如果是普通Python脚本
         application_path = os.path.dirname(os.path.abspath(__file__))
-    
+
     data_path = os.path.join(application_path, DATA_DIR)
     os.makedirs(data_path, exist_ok=True)
     return data_path
 
 def get_file_path(filename, is_score_event=False):
-    """获取数据文件的完整路径"""
-    if is_score_event:
-        return os.path.join(get_data_dir(), SCORE_EVENTS_DIR, filename)
-    return os.path.join(get_data_dir(), filename)
-def init_db():
-    """初始化数据文件"""
-    data_dir = get_data_dir()
-    
-    # 初始化学生文件
-    students_file = get_file_path(STUDENTS_FILE)
-    if not os.path.exists(students_file):
-        with open(students_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['student_id', 'name', 'current_score'])
-    
-    # 初始化积分事件目录
-    score_events_dir_path = os.path.join(data_dir, SCORE_EVENTS_DIR)
-    os.makedirs(score_events_dir_path, exist_ok=True)
-
-    # 初始化兑换事件文件
-    reward_events_file = get_file_path(REWARD_EVENTS_FILE)
-    if not os.path.exists(reward_events_file):
-        with open(reward_events_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['student_id', 'reward_name', 'score_cost', 'timestamp'])
-
-    # 初始化兑换规则文件
-    reward_rules_file = get_file_path(REWARD_RULES_FILE)
-    if not os.path.exists(reward_rules_file):
-        with open(reward_rules_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['rule_name', 'score_cost'])
-
-    # 初始化每日任务规则文件
-    daily_task_rules_file = get_file_path(DAILY_TASK_RULES_FILE)
-    if not os.path.exists(daily_task_rules_file):
-        with open(daily_task_rules_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['task_name', 'score_value'])
-
-    # 初始化每日任务事件文件
-    daily_task_events_file = get_file_path(DAILY_TASK_EVENTS_FILE)
-    if not os.path.exists(daily_task_events_file):
-        with open(daily_task_events_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['student_id', 'task_name', 'score_change', 'timestamp'])
-    
-    # 初始化设置文件
-    settings_file = get_file_path(SETTINGS_FILE)
-    if not os.path.exists(settings_file):
-        with open(settings_file, 'w', encoding='utf-8') as f:
-            json.dump({}, f, ensure_ascii=False, indent=2)
-    
-    # 初始化积分规则文件
-    rules_file = get_file_path(SCORE_RULES_FILE)
-    if not os.path.exists(rules_file):
-        with open(rules_file, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['rule_name', 'score_value'])
+    """获取默认数据目录下数据文件的完整路径"""
+    return default_store().path(filename, is_score_event)
 
-# 学生相关函数
-def add_student(student_id: str, name: str = "") -> bool:
-    """添加学生"""
+# 文件工具
+def _file_signature(path: str):
+    """文件的 (mtime, 大小)，文件不存在时返回 None，用于判断缓存是否过期"""
     try:
-        # 检查学生是否已存在
-        if get_student_by_id(student_id):
-            return False
-        
-        students_file = get_file_path(STUDENTS_FILE)
-        with open(students_file, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([student_id, name, 0])
-        return True
-    except Exception as e:
-        print(f"添加学生失败: {e}")
-        return False
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
 
-def get_all_students() -> List[Tuple[str, str, int]]:
-    """获取所有学生信息"""
-    try:
-        students_file = get_file_path(STUDENTS_FILE)
-        students = []
-        
-        if not os.path.exists(students_file):
-            return students
-            
-        with open(students_file, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            next(reader)  # 跳过标题行
-            for row in reader:
-                if len(row) >= 3:
-                    student_id, name, current_score = row[0], row[1], int(row[2])
-                    students.append((student_id, name, current_score))
-        
-        return students
-    except Exception as e:
-        print(f"获取学生列表失败: {e}")
-        return []
+def _atomic_write_csv(path: str, header: List[str], rows):
+    """先写临时文件再替换，写入中途崩溃不会留下残缺的文件"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+    replace_file(tmp_path, path)
 
-def get_student_by_id(student_id: str) -> Optional[Tuple[str, str, int]]:
-    """根据学号获取学生信息"""
-    students = get_all_students()
-    for sid, name, score in students:
-        if sid == student_id:
-            return (sid, name, score)
-    return None
+def _detect_csv_encoding(f) -> str:
+    """
+    识别外部CSV文件的编码: 带BOM的UTF-8、UTF-8，否则按 GBK（Excel 中文版“CSV”格式的默认编码，
+    按其超集 GB18030 解码）。f 为以二进制打开、位于开头的文件，识别后回到开头
+    没有BOM时整个文件都按 UTF-8 试解码一遍，开头恰好全是ASCII的GBK文件不会被误判为 UTF-8
+    """
+    try:
+        if f.read(len(codecs.BOM_UTF8)) == codecs.BOM_UTF8:
+            return 'utf-8-sig'
+        f.seek(0)
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        try:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                decoder.decode(chunk)
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            return 'gb18030'
+        return 'utf-8'
+    finally:
+        f.seek(0)
 
-def update_student_name(student_id: str, new_name: str) -> bool:
-    """更新学生姓名"""
+def _open_csv_source(path: str):
+    """以识别出的编码打开外部CSV文件（文本模式，按行流式读取）"""
+    f = open(path, 'rb', buffering=1 << 16)
     try:
-        students = get_all_students()
-        updated = False
-        
-        for i, (sid, name, score) in enumerate(students):
-            if sid == student_id:
-                students[i] = (sid, new_name, score)
-                updated = True
-                break
-        
-        if updated:
-            _save_all_students(students)
-        
-        return updated
-    except Exception as e:
-        print(f"更新学生姓名失败: {e}")
+        encoding = _detect_csv_encoding(f)
+    except BaseException:
+        f.close()
+        raise
+    return io.TextIOWrapper(f, encoding=encoding, newline='')
+
+def _is_event_timestamp(timestamp: str, days: Dict[str, bool]) -> bool:
+    """时间戳是否为 YYYY-MM-DD HH:MM:SS 格式的有效时间，days 缓存已检查过的日期部分"""
+    clock = timestamp[11:13] + timestamp[14:16] + timestamp[17:19]
+    if (len(timestamp) != 19 or timestamp[10] != ' ' or timestamp[13] != ':' or timestamp[16] != ':'
+            or not (clock.isascii() and clock.isdigit())
+            or timestamp[11:13] > '23' or timestamp[14:16] > '59' or timestamp[17:19] > '59'):
         return False
+    day = timestamp[:10]
+    valid = days.get(day)
+    if valid is None:
+        try:
+            valid = day[4] == '-' and day[7] == '-' and date.fromisoformat(day) is not None
+        except ValueError:
+            valid = False
+        days[day] = valid
+    return valid
 
-def delete_student(student_id: str) -> bool:
-    """删除学生"""
-    try:
-        students = get_all_students()
-        original_count = len(students)
-        students = [(sid, name, score) for sid, name, score in students if sid != student_id]
-        
-        if len(students) < original_count:
-            _save_all_students(students)
-            # 同时删除该学生的所有积分记录
-            _delete_student_score_events(student_id)
+def _encode_csv_row(row) -> bytes:
+    """把一行编码为CSV字节串，便于计算每行在文件中的偏移"""
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(row)
+    return buffer.getvalue().encode('utf-8')
+
+# DataStore 方法的装饰器
+def _storage_backend(method):
+    """
+    启用 SQLite 后端时，把 DataStore 的公共方法转发到 SQLiteStore 的同名方法；
+    原CSV实现可通过 __wrapped__ 访问
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        store = self._get_sqlite_store()
+        if store is not None:
+            return getattr(store, method.__name__)(*args, **kwargs)
+        return method(self, *args, **kwargs)
+    return wrapper
+
+def _after_queued_writes(method):
+    """
+    读取积分事件前，先等待后台写入队列写入文件，保证能读到已经提交的事件
+    只等待写入，不等待写入后的磁盘同步
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._score_event_writer.flush(wait_sync=False)
+        return method(self, *args, **kwargs)
+    return wrapper
+
+# 后台写入队列
+class _AppendHandlePool:
+    """
+    长期打开的追加句柄（当前分区文件、兑换记录、每日任务记录），避免每条事件都打开、关闭一次文件
+    每批写入后在数据目录写锁内立即刷新，其他程序实例不会在两次追加之间插入内容；日期变化时关闭全部句柄，
+    没有未刷新数据的句柄在文件被外部改写（大小或mtime与上次刷新后不同）时重新打开。
+    只能在持有 _score_events_lock 时使用；改写或删除这些文件之前先调用 close_all。
+    """
+
+    MAX_HANDLES = 8
+
+    def __init__(self):
+        self._handles: Dict[str, list] = {}  # {路径: [文件, 上次刷新后的文件签名, 是否有未刷新的数据]}
+        self._day = None
+
+    def get(self, path: str):
+        """返回以 'ab' 打开的句柄，调用方写入后由 flush 刷新"""
+        today = date.today()
+        if today != self._day:
+            # 跨过午夜后不再向前一天的分区追加
+            self.close_all()
+            self._day = today
+        entry = self._handles.get(path)
+        if entry is not None and not entry[2] and _file_signature(path) != entry[1]:
+            self.close(path)
+            entry = None
+        if entry is None:
+            if len(self._handles) >= self.MAX_HANDLES:
+                self.close(next(iter(self._handles)))
+            entry = self._handles[path] = [open(path, 'ab'), None, False]
+        entry[2] = True
+        return entry[0]
+
+    def flush(self, path: Optional[str] = None):
+        """刷新全部（或指定文件的）缓冲区"""
+        for entry_path, entry in self._handles.items():
+            if entry[2] and path in (None, entry_path):
+                entry[0].flush()
+                entry[1] = _file_signature(entry_path)
+                entry[2] = False
+
+    def fsync(self, paths):
+        """把数据同步到磁盘，未打开句柄的文件临时打开"""
+        self.flush()
+        for path in paths:
+            entry = self._handles.get(path)
+            if entry is not None:
+                os.fsync(entry[0].fileno())
+            elif os.path.exists(path):
+                with open(path, 'ab') as f:
+                    os.fsync(f.fileno())
+
+    def close(self, path: str):
+        entry = self._handles.pop(path, None)
+        if entry is not None:
+            entry[0].close()
+
+    def close_all(self):
+        for path in list(self._handles):
+            self.close(path)
+
+class _ScoreEventWriter:
+    """
+    积分事件的后台写入线程（组提交）
+    调用方把事件行和积分变化放入队列后立即得到 Future，不在界面线程上等待磁盘；写入线程每隔 BATCH_INTERVAL 秒
+    （攒够 BATCH_SIZE 行或有人等待时立即）把队列中的全部请求合并写入：每个分区文件追加一次，积分日志追加一次。
+    文件通过 DataStore 的长期追加句柄写入，每批写完后在数据目录写锁内刷新。
+    设置 score_events_fsync 决定何时同步到磁盘: batch（默认）每批写入后, second 最多每秒一次, never 交给操作系统。
+    Future 在本批写入（按 batch 策略时还包括同步）完成后给出结果，写入失败时给出异常；
+    写入失败的请求同时记录下来，由 take_failures 取出，界面据此提示哪些记录没有保存。
+    学生积分的读取不等待写入线程：已写入的积分加上队列中尚未写入的积分变化 (balances)。
+    """
+
+    BATCH_INTERVAL = 0.005
+    BATCH_SIZE = 500
+    FSYNC_INTERVAL = 1.0
+
+    def __init__(self, store: 'DataStore'):
+        self._store = store
+        self._cond = threading.Condition()
+        self._queue: List[tuple] = []
+        self._queued_rows = 0
+        self._waiters = 0
+        self._busy = False  # 正在写入一批请求
+        self._syncing = False  # 一批请求已写入，正在同步磁盘并给出结果
+        self._failed = False
+        self._failures: List[Tuple[List[Event], str]] = []
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        self._unsynced = set()  # 已写入但尚未同步到磁盘的文件
+        self._last_sync = 0.0
+        # 已放入队列、尚未计入积分存储的积分变化；与积分存储的更新在同一把锁内进行，读取时不会重复或遗漏
+        self._pending_deltas: Dict[str, int] = {}
+        self._balances_lock = threading.Lock()
+
+    def submit(self, rows: List[list], deltas: Dict[str, int], side_rows: List[Tuple[str, list]] = ()) -> Future:
+        """
+        放入一次写入请求
+        rows: 积分事件行; deltas: {学号: 积分变化}; side_rows: [(CSV文件路径, 行)]，如兑换记录、每日任务记录
+        """
+        future = Future()
+        with self._balances_lock:
+            self._add_pending(deltas, 1)
+        with self._cond:
+            self._queue.append((rows, deltas, side_rows, future))
+            self._queued_rows += len(rows) + len(side_rows)
+            self._closed = False
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="score_event_writer", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+        return future
+
+    def balances(self) -> Dict[str, int]:
+        """{学号: 当前积分}，包括队列中尚未写入的积分变化；调用方不得修改返回的字典"""
+        with self._balances_lock:
+            balances = self._store._balance_store.get()
+            if self._pending_deltas:
+                balances = dict(balances)
+                for student_id, delta in self._pending_deltas.items():
+                    balances[student_id] = balances.get(student_id, 0) + delta
+        return balances
+
+    def _add_pending(self, deltas: Dict[str, int], sign: int):
+        pending = self._pending_deltas
+        for student_id, delta in deltas.items():
+            total = pending.get(student_id, 0) + sign * delta
+            if total:
+                pending[student_id] = total
+            else:
+                pending.pop(student_id, None)
+
+    def flush(self, timeout: Optional[float] = None, wait_sync: bool = True) -> bool:
+        """
+        等待队列中的请求全部写入文件，之后直接读取文件就能看到这些事件
+        wait_sync 为 False 时不等待写入后的磁盘同步（读取数据只需要写入完成）
+        超时或上次 flush 之后有写入失败时返回 False
+        """
+        if threading.current_thread() is self._thread:
             return True
-        
-        return False
-    except Exception as e:
-        print(f"删除学生失败: {e}")
-        return False
+        with self._cond:
+            self._waiters += 1
+            self._cond.notify_all()
+            try:
+                done = self._cond.wait_for(
+                    lambda: not self._queue and not self._busy and not (wait_sync and self._syncing), timeout)
+            finally:
+                self._waiters -= 1
+            failed, self._failed = self._failed, False
+        return done and not failed
 
-def _save_all_students(students: List[Tuple[str, str, int]]):
-    """保存所有学生信息到文件"""
-    students_file = get_file_path(STUDENTS_FILE)
-    with open(students_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['student_id', 'name', 'current_score'])
-        for student_id, name, score in students:
-            writer.writerow([student_id, name, score])
+    def take_failures(self) -> List[Tuple[List[Event], str]]:
+        """取出并清空写入失败的请求: [(未能写入的积分事件, 错误信息), ...]"""
+        with self._cond:
+            failures, self._failures = self._failures, []
+        return failures
 
-def update_student_score(student_id: str, new_score: int) -> bool:
-    """更新学生当前积分"""
-    try:
-        students = get_all_students()
-        updated = False
-        
-        for i, (sid, name, score) in enumerate(students):
-            if sid == student_id:
-                students[i] = (sid, name, new_score)
-                updated = True
-                break
-        
-        if updated:
-            _save_all_students(students)
-        
-        return updated
-    except Exception as e:
-        print(f"更新学生积分失败: {e}")
-        return False
+    def close(self):
+        """写完队列，把所有已写入的文件同步到磁盘并关闭句柄，写入线程随后退出（再次提交时重新启动）"""
+        self.flush()
+        with self._store._score_events_lock:
+            self._sync()
+            self._store._append_handles.close_all()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
 
-# 积分事件相关函数
-def add_score_event(student_id: str, event_name: str, score_change: int, event_type: str = "score") -> bool:
-    """添加积分事件"""
-    try:
-        # 检查学生是否存在
-        student = get_student_by_id(student_id)
-        if not student:
-            return False
-            
-        # 记录积分事件到按天存储的文件
-        timestamp = datetime.now()
-        date_str = timestamp.strftime("%Y-%m-%d")
-        events_file = get_file_path(f"score_events_{date_str}.csv", is_score_event=True)
-        
-        # 检查文件是否存在，如果不存在则写入标题行
-        file_exists = os.path.exists(events_file)
-        with open(events_file, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            if not file_exists:
-                writer.writerow(["student_id", "event_name", "score_change", "timestamp", "event_type"])
-            writer.writerow([student_id, event_name, score_change, timestamp.strftime("%Y-%m-%d %H:%M:%S"), event_type])
-        
-        # 更新学生当前积分
-        sid, name, current_score = student
-        new_score = current_score + score_change
-        update_student_score(student_id, new_score)
-        
-        return True
-    except Exception as e:
-        print(f"添加积分事件失败: {e}")
-        return False
+    def _next_deadline(self) -> Optional[float]:
+        """队列为空时下一次需要醒来同步磁盘的时间"""
+        return self._last_sync + self.FSYNC_INTERVAL if self._unsynced else None
 
-def get_score_events_by_student(student_id: str) -> List[Tuple[str, str, int, str, str]]:
-    """获取指定学生的积分事件"""
-    try:
-        events = []
-        score_events_dir_path = os.path.join(get_data_dir(), SCORE_EVENTS_DIR)
-        
-        if not os.path.exists(score_events_dir_path):
-            return events
-            
-        for filename in os.listdir(score_events_dir_path):
-            if filename.startswith("score_events_") and filename.endswith(".csv"):
-                file_path = os.path.join(score_events_dir_path, filename)
-                with open(file_path, 'r', newline='', encoding='utf-8') as f:
-                    reader = csv.reader(f)
-                    header = next(reader, None) # 读取标题行
-                    if header is None: # 空文件
-                        continue
-                    
-                    # 确保标题行包含所有预期字段，如果缺少则跳过此文件或按默认处理
-                    expected_headers = ["student_id", "event_name", "score_change", "timestamp", "event_type"]
-                    if not all(h in header for h in expected_headers):
-                        print(f"警告: 文件 {filename} 缺少预期的标题行字段，跳过或按旧格式处理")
-                        # 对于旧格式文件，尝试按原索引读取
-                        f.seek(0) # 重置文件指针
-                        next(reader) # 跳过标题行
-                        for row in reader:
-                            if len(row) >= 4 and row[0] == student_id:
-                                sid, event_name, score_change, timestamp = row[0], row[1], int(row[2]), row[3]
-                                events.append((sid, event_name, score_change, timestamp, "score")) # 默认为score类型
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    deadline = self._next_deadline()
+                    if deadline is None:
+                        if self._closed:
+                            return
+                        self._cond.wait()
                         continue
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._queue:
+                    # 组提交窗口：稍等片刻，让连续的点击合并为一次写入
+                    deadline = time.monotonic() + self.BATCH_INTERVAL
+                    while self._queued_rows < self.BATCH_SIZE and not self._waiters:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                batch, self._queue, self._queued_rows = self._queue, [], 0
+                self._busy = True
+            # 写入完成后读取方即可继续，磁盘同步在此之后进行
+            error = None
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f"写入积分事件失败: {e}")
+                error = e
+                with self._cond:
+                    self._failed = True
+                    self._failures.extend(([Event(*row) for row in item_rows], str(e)) for item_rows, *_ in batch)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._syncing = True
+                    self._cond.notify_all()
+            try:
+                if error is None:
+                    try:
+                        self._sync_by_policy()
+                    except Exception as e:
+                        print(f"同步积分事件失败: {e}")
+                        error = e
+                        with self._cond:
+                            self._failed = True
+                for *_, future in batch:
+                    if error is None:
+                        future.set_result(True)
+                    else:
+                        future.set_exception(error)
+            finally:
+                with self._cond:
+                    self._syncing = False
+                    self._cond.notify_all()
+
+    def _write(self, batch: List[tuple]):
+        if not batch:
+            return
+        store = self._store
+        side_rows_by_path: Dict[str, List[list]] = {}
+        rows, deltas = [], {}
+        for item_rows, item_deltas, side_rows, _ in batch:
+            rows.extend(item_rows)
+            for student_id, delta in item_deltas.items():
+                deltas[student_id] = deltas.get(student_id, 0) + delta
+            for path, row in side_rows:
+                side_rows_by_path.setdefault(path, []).append(row)
+
+        settled = False
+        try:
+            with store._data_update(), store._score_events_lock:
+                # 先写积分事件和积分变化，再写兑换、每日任务记录：中途失败时不会留下没有扣分的兑换记录
+                if rows:
+                    self._unsynced.update(store._append_score_event_rows(rows))
+                with self._balances_lock:
+                    if deltas:
+                        store._apply_score_deltas(deltas)
+                        self._unsynced.add(store.path(BALANCES_JOURNAL_FILE))
+                    self._add_pending(deltas, -1)
+                    settled = True
+                for path, side_rows in side_rows_by_path.items():
+                    store._append_handles.get(path).write(b''.join(_encode_csv_row(row) for row in side_rows))
+                    self._unsynced.add(path)
+                store._append_handles.flush()
+        finally:
+            if not settled:
+                # 没有写入的积分变化不再计入读取结果
+                with self._balances_lock:
+                    self._add_pending(deltas, -1)
+
+    def _sync_by_policy(self):
+        store = self._store
+        with store._score_events_lock:
+            policy = store.get_setting("score_events_fsync", "batch")
+            if policy == "never":
+                self._unsynced.clear()
+            elif policy == "batch" or time.monotonic() - self._last_sync >= self.FSYNC_INTERVAL:
+                self._sync()
+
+    def _sync(self):
+        paths, self._unsynced = self._unsynced, set()
+        self._store._append_handles.fsync(paths)
+        self._last_sync = time.monotonic()
+
+# 学生名册与积分
+class _RosterCache:
+    """进程内的学生名册缓存，按学号建立索引，文件mtime/大小变化时自动重新加载"""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._signature = None
+        self._students: Dict[str, str] = {}
+
+    def _load(self, path: str) -> Dict[str, str]:
+        students = {}
+        with open(path, 'r', newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)  # 跳过标题行
+            for row in reader:
+                if row and row[0]:
+                    # 与原先的线性查找保持一致：重复学号以第一条为准
+                    students.setdefault(row[0], row[1] if len(row) > 1 else "")
+        return students
+
+    def get(self) -> Dict[str, str]:
+        """返回 {学号: 姓名}，调用方不得修改返回的字典"""
+        signature = _file_signature(self._path)
+        if signature != self._signature:
+            self._students = self._load(self._path) if signature else {}
+            self._signature = signature
+        return self._students
+
+    def store(self, students: Dict[str, str]):
+        """本进程写入文件后同步缓存，避免下次访问时重新解析"""
+        self._signature = _file_signature(self._path)
+        self._students = students
+
+    def invalidate(self):
+        self._signature = None
+        self._students = {}
+
+class _BalanceStore:
+    """
+    学生当前积分存储: balances.csv 检查点 + balances.journal 追加日志
+    每次积分变化只在日志末尾追加 "学号,新积分" 一行，与学生人数无关；
+    日志超过 CHECKPOINT_INTERVAL 行时合并回检查点并清空日志。
+    日志记录的是积分绝对值，重复回放结果不变，检查点写入后崩溃也不会重复计分。
+    """
+
+    CHECKPOINT_INTERVAL = 1000
+
+    def __init__(self, checkpoint_path: str, journal_path: str):
+        self._checkpoint_path = checkpoint_path
+        self._journal_path = journal_path
+        self._checkpoint_signature = None
+        self._journal_offset = 0
+        self._journal_lines = 0
+        self._balances: Dict[str, int] = {}
+
+    def _paths(self):
+        return self._checkpoint_path, self._journal_path
+
+    @staticmethod
+    def _parse_lines(data: bytes, balances: Dict[str, int]) -> int:
+        """回放日志内容，跳过损坏的行，返回有效行数"""
+        count = 0
+        for row in csv.reader(data.decode('utf-8', errors='replace').splitlines()):
+            if len(row) == 2 and row[0]:
+                try:
+                    balances[row[0]] = int(row[1])
+                except ValueError:
+                    continue
+                count += 1
+        return count
 
-                    # 获取列索引
-                    col_indices = {h: header.index(h) for h in expected_headers}
+    def _sync(self):
+        """加载检查点并回放日志；只有日志增长时仅读取新增部分"""
+        checkpoint_path, journal_path = self._paths()
+        checkpoint_signature = _file_signature(checkpoint_path)
+        journal_size = os.path.getsize(journal_path) if os.path.exists(journal_path) else 0
 
+        if checkpoint_signature != self._checkpoint_signature or journal_size < self._journal_offset:
+            balances = {}
+            if checkpoint_signature:
+                with open(checkpoint_path, 'r', newline='', encoding='utf-8') as f:
+                    reader = csv.reader(f)
+                    next(reader, None)  # 跳过标题行
                     for row in reader:
-                        if len(row) > max(col_indices.values()) and row[col_indices["student_id"]] == student_id:
-                            sid = row[col_indices["student_id"]]
-                            event_name = row[col_indices["event_name"]]
-                            score_change = int(row[col_indices["score_change"]])
-                            timestamp = row[col_indices["timestamp"]]
-                            event_type = row[col_indices["event_type"]] if "event_type" in col_indices else "score" # 兼容旧数据
-                            events.append((sid, event_name, score_change, timestamp, event_type))
-        
-        return events
-    except Exception as e:
-        print(f"获取学生积分事件失败: {e}")
-        return []
-
-def _delete_student_score_events(student_id: str):
-    """删除指定学生的所有积分事件"""
-    try:
-        score_events_dir_path = os.path.join(get_data_dir(), SCORE_EVENTS_DIR)
-        
-        if not os.path.exists(score_events_dir_path):
+                        if len(row) >= 2:
+                            balances[row[0]] = int(row[1])
+            self._balances = balances
+            self._checkpoint_signature = checkpoint_signature
+            self._journal_offset = 0
+            self._journal_lines = 0
+
+        if journal_size > self._journal_offset:
+            with open(journal_path, 'rb') as f:
+                f.seek(self._journal_offset)
+                data = f.read()
+            # 只处理完整的行，末尾未写完的行留到下次
+            end = data.rfind(b'\n') + 1
+            self._journal_lines += self._parse_lines(data[:end], self._balances)
+            self._journal_offset += end
+
+    def get(self) -> Dict[str, int]:
+        """返回 {学号: 当前积分}，调用方不得修改返回的字典"""
+        self._sync()
+        return self._balances
+
+    def set_many(self, balances: Dict[str, int]):
+        """把若干学生的新积分追加到日志"""
+        if not balances:
             return
-            
-        for filename in os.listdir(score_events_dir_path):
-            if filename.startswith("score_events_") and filename.endswith(".csv"):
-                file_path = os.path.join(score_events_dir_path, filename)
-                all_events = []
-                
-                with open(file_path, 'r', newline='', encoding='utf-8') as f:
-                    reader = csv.reader(f)
-                    header = next(reader, None)
-                    if header:
-                        all_events.append(header)
-                        for row in reader:
-                            if len(row) >= 1 and row[0] != student_id:
-                                all_events.append(row)
-                
-                with open(file_path, 'w', newline='', encoding='utf-8') as f:
-                    writer = csv.writer(f)
-                    writer.writerows(all_events)
-    except Exception as e:
-        print(f"删除学生积分事件失败: {e}")
-
-# 积分规则相关函数
-def add_score_rule(rule_name: str, score_value: int) -> bool:
-    """添加积分规则"""
-    try:
-        # 检查规则是否已存在
-        if get_score_rule_by_name(rule_name):
-            return False
-        
-        rules_file = get_file_path(SCORE_RULES_FILE)
-        with open(rules_file, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([rule_name, score_value])
-        return True
-    except Exception as e:
-        print(f"添加积分规则失败: {e}")
-        return False
+        self._sync()
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(balances.items())
+        data = buffer.getvalue().encode('utf-8')
 
-def get_all_score_rules() -> List[Tuple[str, int]]:
-    """获取所有积分规则"""
-    try:
-        rules_file = get_file_path(SCORE_RULES_FILE)
-        rules = []
-        
-        if not os.path.exists(rules_file):
-            return rules
-            
-        with open(rules_file, 'r', newline='', encoding='utf-8') as f:
+        _, journal_path = self._paths()
+        with open(journal_path, 'ab') as f:
+            if f.tell() > self._journal_offset:
+                # 上次崩溃留下了不完整的行，先换行把它隔开
+                data = b'\n' + data
+            f.write(data)
+            self._journal_offset = f.tell()
+        self._balances.update(balances)
+        self._journal_lines += len(balances)
+
+        if self._journal_lines >= self.CHECKPOINT_INTERVAL:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """把当前积分写入检查点并清空日志"""
+        self._sync()
+        checkpoint_path, journal_path = self._paths()
+        # 积分为0与不存在等价，不写入检查点
+        _atomic_write_csv(checkpoint_path, ['student_id', 'current_score'],
+                          [(sid, score) for sid, score in self._balances.items() if score])
+        open(journal_path, 'wb').close()
+        self._checkpoint_signature = _file_signature(checkpoint_path)
+        self._journal_offset = 0
+        self._journal_lines = 0
+
+    def invalidate(self):
+        self._checkpoint_signature = None
+        self._journal_offset = 0
+        self._journal_lines = 0
+        self._balances = {}
+
+class _TombstoneStore:
+    """
+    已删除、但积分事件尚未从分区文件中清除的学号 (score_events/tombstones.json)
+    删除学生时只记录墓碑，读取积分事件时过滤掉这些学号；purge_deleted_students 一次性清除全部墓碑对应的事件，
+    每个受影响的分区只改写一次。文件mtime/大小变化时自动重新加载。
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._signature = None
+        self._student_ids = frozenset()
+
+    def get(self) -> frozenset:
+        signature = _file_signature(self._path)
+        if signature != self._signature:
+            student_ids = frozenset()
+            if signature:
+                with open(self._path, 'r', encoding='utf-8') as f:
+                    student_ids = frozenset(json.load(f))
+            self._student_ids, self._signature = student_ids, signature
+        return self._student_ids
+
+    def store(self, student_ids):
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(sorted(student_ids), f, ensure_ascii=False)
+        replace_file(tmp_path, self._path)
+        self._student_ids = frozenset(student_ids)
+        self._signature = _file_signature(self._path)
+
+    def invalidate(self):
+        self._signature = None
+        self._student_ids = frozenset()
+
+# 规则目录
+class RuleCatalog:
+    """
+    积分规则、兑换规则、每日任务规则的内存目录，每类规则是一个 {名称: 分值} 字典（同名规则以文件中第一条为准）
+    规则文件mtime/大小变化时自动重新加载；增删规则时写入文件后直接更新内存（write-through），
+    界面填充下拉框、按名称查找规则都不需要读取文件。
+    """
+
+    FAMILIES = {
+        'score': (SCORE_RULES_FILE, ['rule_name', 'score_value']),
+        'reward': (REWARD_RULES_FILE, ['rule_name', 'score_cost']),
+        'daily_task': (DAILY_TASK_RULES_FILE, ['task_name', 'score_value']),
+    }
+
+    def __init__(self, store: 'DataStore'):
+        self._store = store
+        self._rules: Dict[str, Dict[str, int]] = {}
+        self._signatures: Dict[str, tuple] = {}  # {规则类别: 文件签名}
+
+    @staticmethod
+    def _load(path: str) -> Dict[str, int]:
+        rules = {}
+        with open(path, 'r', newline='', encoding='utf-8') as f:
             reader = csv.reader(f)
-            next(reader)  # 跳过标题行
+            next(reader, None)  # 跳过标题行
             for row in reader:
                 if len(row) >= 2:
-                    rule_name, score_value = row[0], int(row[1])
-                    rules.append((rule_name, score_value))
-        
+                    rules.setdefault(row[0], int(row[1]))
         return rules
-    except Exception as e:
-        print(f"获取积分规则失败: {e}")
-        return []
 
-def get_score_rule_by_name(rule_name: str) -> Optional[Tuple[str, int]]:
-    """根据规则名称获取积分规则"""
-    rules = get_all_score_rules()
-    for name, value in rules:
-        if name == rule_name:
-            return (name, value)
-    return None
+    def _path(self, family: str) -> str:
+        return self._store.path(self.FAMILIES[family][0])
 
-def delete_score_rule(rule_name: str) -> bool:
-    """删除积分规则"""
-    try:
-        rules = get_all_score_rules()
-        original_count = len(rules)
-        rules = [(name, value) for name, value in rules if name != rule_name]
-        
-        if len(rules) < original_count:
-            _save_all_score_rules(rules)
+    def rules(self, family: str) -> Dict[str, int]:
+        """返回 {名称: 分值}，调用方不得修改返回的字典"""
+        path = self._path(family)
+        signature = _file_signature(path)
+        if family not in self._rules or self._signatures[family] != signature:
+            self._rules[family] = self._load(path) if signature else {}
+            self._signatures[family] = signature
+        return self._rules[family]
+
+    def get(self, family: str, name: str) -> Optional[Tuple[str, int]]:
+        value = self.rules(family).get(name)
+        return None if value is None else (name, value)
+
+    def _store_rules(self, family: str, rules: Dict[str, int]):
+        self._rules[family] = rules
+        self._signatures[family] = _file_signature(self._path(family))
+
+    def add(self, family: str, name: str, value: int) -> bool:
+        """添加规则，同名规则已存在时返回 False"""
+        with self._store._data_update():
+            rules = self.rules(family)
+            if name in rules:
+                return False
+            header = self.FAMILIES[family][1]
+            with open(self._path(family), 'a', newline='', encoding='utf-8') as f:
+                if f.tell() == 0:
+                    csv.writer(f).writerow(header)
+                csv.writer(f).writerow([name, value])
+            rules = dict(rules)
+            rules[name] = value
+            self._store_rules(family, rules)
             return True
-        
-        return False
-    except Exception as e:
-        print(f"删除积分规则失败: {e}")
-        return False
 
-def _save_all_score_rules(rules: List[Tuple[str, int]]):
-    """保存所有积分规则到文件"""
-    rules_file = get_file_path(SCORE_RULES_FILE)
-    with open(rules_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(['rule_name', 'score_value'])
-        for rule_name, score_value in rules:
-            writer.writerow([rule_name, score_value])
+    def delete(self, family: str, name: str) -> bool:
+        """删除规则，规则不存在时返回 False"""
+        with self._store._data_update():
+            rules = dict(self.rules(family))
+            if rules.pop(name, None) is None:
+                return False
+            _atomic_write_csv(self._path(family), self.FAMILIES[family][1], rules.items())
+            self._store_rules(family, rules)
+            return True
 
-# 设置相关函数
-def get_setting(key: str, default_value: str = "") -> str:
-    """获取设置值"""
-    try:
-        settings_file = get_file_path(SETTINGS_FILE)
-        
-        if not os.path.exists(settings_file):
-            return default_value
-            
-        with open(settings_file, 'r', encoding='utf-8') as f:
-            settings = json.load(f)
-        return settings.get(key, default_value)
-    except Exception as e:
-        print(f"获取设置失败: {e}")
-        return default_value
+    def invalidate(self):
+        self._rules.clear()
+        self._signatures.clear()
 
-def set_setting(key: str, value: str) -> bool:
-    """设置值"""
-    try:
-        settings_file = get_file_path(SETTINGS_FILE)
-        
-        # 读取现有设置
+# 设置
+class _SettingsStore:
+    """
+    settings.json 的内存副本
+    读取直接返回内存中的值，文件mtime/大小变化（被外部修改）时重新加载；修改先更新内存，
+    WRITE_DELAY 秒内的多次修改合并为一次写入（先写临时文件再替换），关闭 DataStore 时写入尚未保存的修改。
+    """
+
+    WRITE_DELAY = 0.5
+
+    def __init__(self, store: 'DataStore'):
+        self._store = store
+        self._path = store.path(SETTINGS_FILE)
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._signature = None
+        self._settings: Dict[str, object] = {}
+        self._pending: Dict[str, object] = {}  # 尚未写入文件的修改
+        self._timer: Optional[threading.Timer] = None
+
+    @staticmethod
+    def _read(path: str) -> dict:
         try:
-            with open(settings_file, 'r', encoding='utf-8') as f:
+            with open(path, 'r', encoding='utf-8') as f:
                 settings = json.load(f)
-        except:
-            settings = {}
-        
-        # 更新设置
-        settings[key] = value
-        
-        # 保存设置
-        with open(settings_file, 'w', encoding='utf-8') as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
-        
-        return True
-    except Exception as e:
-        print(f"设置值失败: {e}")
-        return False
+        except FileNotFoundError:
+            return {}
+        return settings if isinstance(settings, dict) else {}
 
-# CSV导入功能
-def import_students_from_csv(csv_file_path: str) -> Tuple[int, int, List[str]]:
+    def _sync(self):
+        signature = _file_signature(self._path)
+        if signature != self._signature:
+            try:
+                settings = self._read(self._path)
+            except ValueError as e:
+                print(f"读取设置失败: {e}")
+                settings = {}
+            settings.update(self._pending)
+            self._settings, self._signature = settings, signature
+
+    def get(self, key: str, default_value=None):
+        with self._lock:
+            self._sync()
+            return self._settings.get(key, default_value)
+
+    def set(self, key: str, value):
+        with self._lock:
+            self._sync()
+            self._settings[key] = value
+            self._pending[key] = value
+            if self._timer is None:
+                self._timer = threading.Timer(self.WRITE_DELAY, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """立即写入尚未保存的修改"""
+        # 写文件时需要数据目录写锁，而持有该锁的写入线程也会读取设置，所以不能在持有 self._lock 时等待它
+        with self._write_lock:
+            with self._lock:
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                if not self._pending:
+                    return
+                pending = dict(self._pending)
+
+            with self._store._data_update():
+                # 合并其他程序实例在此期间写入的设置
+                try:
+                    settings = self._read(self._path)
+                except ValueError:
+                    settings = {}
+                settings.update(pending)
+                tmp_path = self._path + '.tmp'
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(settings, f, ensure_ascii=False, indent=2)
+                replace_file(tmp_path, self._path)
+                signature = _file_signature(self._path)
+
+            with self._lock:
+                for key, value in pending.items():
+                    if key in self._pending and self._pending[key] is value:
+                        del self._pending[key]
+                settings.update(self._pending)
+                self._settings, self._signature = settings, signature
+
+    def invalidate(self):
+        """下次读取时重新加载文件，尚未保存的修改保留"""
+        with self._lock:
+            self._signature = None
+            self._settings = dict(self._pending)
+
+# 数据目录
+class DataStore:
     """
-    从CSV文件导入学生信息
-    返回: (成功导入数量, 跳过数量, 错误信息列表)
+    一个数据目录上的全部数据操作
+    数据目录只在创建时解析一次；名册、积分、墓碑、规则、设置的缓存，分区目录和事件索引，
+    追加句柄和后台写入线程都属于这个对象。模块级函数转发到默认数据目录上的实例 (default_store)，
+    测试和性能测试可以在临时目录上创建互相独立的实例，用完后调用 close。
     """
-    success_count = 0
-    skip_count = 0
-    errors = []
-    
-    try:
-        with open(csv_file_path, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            
-            # 尝试检测是否有标题行
-            first_row = next(reader, None)
-            if not first_row:
-                errors.append("CSV文件为空")
-                return 0, 0, errors
-            
-            # 如果第一行看起来像标题，跳过它
-            if first_row[0].lower() in ['student_id', 'studentid', '学号', 'id']:
-                pass  # 跳过标题行
+
+    # 导入历史积分事件时每批写入的行数
+    IMPORT_BATCH_ROWS = 50000
+
+    def __init__(self, data_dir: str):
+        self.data_dir = os.path.abspath(data_dir)
+        os.makedirs(self.data_dir, exist_ok=True)
+        self._dir_lock = data_dir_lock(self.data_dir)
+
+        # 存储后端：设置中 "storage_backend" 为 "sqlite" 时使用 SQLite 数据库，否则使用CSV文件
+        self._sqlite_store = None
+        self._sqlite_store_checked = False
+
+        # 追加积分事件与后台压缩分区互斥
+        self._score_events_lock = threading.RLock()
+        self._append_handles = _AppendHandlePool()
+        self._score_event_writer = _ScoreEventWriter(self)
+
+        self._roster_cache = _RosterCache(self.path(STUDENTS_FILE))
+        self._balance_store = _BalanceStore(self.path(BALANCES_FILE), self.path(BALANCES_JOURNAL_FILE))
+        self._tombstones = _TombstoneStore(self.path(TOMBSTONES_FILE, is_score_event=True))
+        self._rule_catalog = RuleCatalog(self)
+        self._settings = _SettingsStore(self)
+        self._open_indexes()
+        _open_stores.add(self)
+
+    def path(self, filename: str, is_score_event: bool = False) -> str:
+        """数据文件的完整路径"""
+        if is_score_event:
+            return os.path.join(self.data_dir, SCORE_EVENTS_DIR, filename)
+        return os.path.join(self.data_dir, filename)
+
+    # 存储后端
+    def _get_sqlite_store(self):
+        """返回当前启用的 SQLite 存储，未启用时返回 None"""
+        if not self._sqlite_store_checked:
+            self._sqlite_store_checked = True
+            if self.get_setting("storage_backend", "csv") == "sqlite":
+                from database_sqlite import SQLiteStore, SQLITE_DB_FILE
+                if is_network_path(self.data_dir):
+                    print(f"警告: 数据目录 {self.data_dir} 位于网络共享盘上，SQLite 数据库在共享盘上可能损坏，"
+                          f"请把数据目录移到本机磁盘，或改回CSV存储")
+                self._sqlite_store = SQLiteStore(self.path(SQLITE_DB_FILE))
+        return self._sqlite_store
+
+    def _reset_storage_backend(self):
+        """切换存储后端后调用，下次访问时按设置重新选择"""
+        if self._sqlite_store is not None:
+            self._sqlite_store.close()
+        self._sqlite_store = None
+        self._sqlite_store_checked = False
+
+    # 缓存、写锁与写入队列
+    def _open_indexes(self):
+        """创建积分事件的分区目录、事件索引（{索引名: PartitionIndex}）和积分前缀和索引，首次使用时从文件加载"""
+        events_dir = os.path.join(self.data_dir, SCORE_EVENTS_DIR)
+        index_dir = os.path.join(events_dir, SCORE_EVENTS_INDEX_DIR)
+        self._partition_catalog = PartitionCatalog(events_dir, self._dir_lock)
+        self._event_indexes = {
+            'student': PartitionIndex(index_dir, 'student_postings', summarize_postings_by_student, merge_postings,
+                                      self._dir_lock),
+            'rollup': PartitionIndex(index_dir, 'daily_rollups', summarize_daily_rollups, merge_daily_rollups,
+                                     self._dir_lock),
+            'name': PartitionIndex(index_dir, 'name_grams', summarize_name_grams, merge_name_grams, self._dir_lock),
+        }
+        self._score_prefix_index = ScorePrefixIndex(os.path.join(index_dir, 'score_prefix.bin'), self._dir_lock)
+
+    def _invalidate_caches(self):
+        """其他程序实例修改过数据目录，丢弃内存中的缓存和追加句柄，下次访问时重新读取文件"""
+        self._roster_cache.invalidate()
+        self._balance_store.invalidate()
+        self._open_indexes()
+        self._tombstones.invalidate()
+        self._rule_catalog.invalidate()
+        self._settings.invalidate()
+        with self._score_events_lock:
+            self._append_handles.close_all()
+
+    def _data_update(self):
+        """
+        修改数据文件时使用的数据目录写锁（跨进程），见 database_lock.DataDirLock.update
+        持有写锁时不能等待写入队列（flush），写入线程也需要这个锁
+        """
+        return self._dir_lock.update(self._invalidate_caches)
+
+    def flush_score_events(self, timeout: Optional[float] = None) -> bool:
+        """等待已提交的积分事件全部写入文件，超时或写入失败时返回 False"""
+        return self._score_event_writer.flush(timeout)
+
+    def take_write_failures(self) -> List[Tuple[List[Event], str]]:
+        """
+        取出并清空后台写入失败的请求: [(未能写入的积分事件, 错误信息), ...]
+        add_score_event 等函数在放入写入队列后立即返回，写入线程随后失败时这些记录没有保存，
+        界面定期调用本函数提示用户
+        """
+        return self._score_event_writer.take_failures()
+
+    def close(self):
+        """写完积分事件队列和尚未保存的设置，同步到磁盘并关闭文件句柄和数据库连接"""
+        self._score_event_writer.close()
+        self._settings.flush()
+        self._reset_storage_backend()
+
+    def init_db(self):
+        """初始化数据文件"""
+        # 初始化学生文件
+        students_file = self.path(STUDENTS_FILE)
+        if not os.path.exists(students_file):
+            with open(students_file, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['student_id', 'name'])
+        else:
+            with self._data_update():
+                self._migrate_legacy_roster()
+
+        # 初始化积分事件目录
+        score_events_dir_path = os.path.join(self.data_dir, SCORE_EVENTS_DIR)
+        os.makedirs(score_events_dir_path, exist_ok=True)
+
+        # 初始化兑换事件文件
+        reward_events_file = self.path(REWARD_EVENTS_FILE)
+        if not os.path.exists(reward_events_file):
+            with open(reward_events_file, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['student_id', 'reward_name', 'score_cost', 'timestamp'])
+
+        # 初始化兑换规则文件
+        reward_rules_file = self.path(REWARD_RULES_FILE)
+        if not os.path.exists(reward_rules_file):
+            with open(reward_rules_file, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['rule_name', 'score_cost'])
+
+        # 初始化每日任务规则文件
+        daily_task_rules_file = self.path(DAILY_TASK_RULES_FILE)
+        if not os.path.exists(daily_task_rules_file):
+            with open(daily_task_rules_file, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['task_name', 'score_value'])
+
+        # 初始化每日任务事件文件
+        daily_task_events_file = self.path(DAILY_TASK_EVENTS_FILE)
+        if not os.path.exists(daily_task_events_file):
+            with open(daily_task_events_file, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['student_id', 'task_name', 'score_change', 'timestamp'])
+
+        # 初始化设置文件
+        settings_file = self.path(SETTINGS_FILE)
+        if not os.path.exists(settings_file):
+            with open(settings_file, 'w', encoding='utf-8') as f:
+                json.dump({}, f, ensure_ascii=False, indent=2)
+
+        # 初始化积分规则文件
+        rules_file = self.path(SCORE_RULES_FILE)
+        if not os.path.exists(rules_file):
+            with open(rules_file, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(['rule_name', 'score_value'])
+
+        # 初始化 SQLite 数据库（如已启用）
+        self._get_sqlite_store()
+
+    # 学生相关
+    def _migrate_legacy_roster(self):
+        """旧版 students.csv 带有 current_score 列，把积分移到积分存储，名册只保留学号和姓名"""
+        students_file = self.path(STUDENTS_FILE)
+        if not os.path.exists(students_file):
+            return
+        with open(students_file, 'r', newline='', encoding='utf-8') as f:
+            rows = list(csv.reader(f))
+        if not rows or 'current_score' not in rows[0]:
+            return
+
+        score_col = rows[0].index('current_score')
+        roster, balances = {}, {}
+        for row in rows[1:]:
+            if row and row[0] and row[0] not in roster:
+                roster[row[0]] = row[1] if len(row) > 1 else ""
+                if len(row) > score_col and row[score_col]:
+                    balances[row[0]] = int(row[score_col])
+
+        checkpoint_path, journal_path = self._balance_store._paths()
+        if not os.path.exists(checkpoint_path) and not os.path.exists(journal_path):
+            _atomic_write_csv(checkpoint_path, ['student_id', 'current_score'],
+                              [(sid, score) for sid, score in balances.items() if score])
+        self._save_all_students(roster)
+        self._balance_store.invalidate()
+
+    @_storage_backend
+    def add_student(self, student_id: str, name: str = "") -> bool:
+        """添加学生"""
+        try:
+            with self._data_update():
+                # 检查学生是否已存在
+                if student_id in self._roster_cache.get():
+                    return False
+                self._append_students({student_id: name})
+                return True
+        except Exception as e:
+            self._roster_cache.invalidate()
+            print(f"添加学生失败: {e}")
+            return False
+
+    def _append_students(self, students: Dict[str, str]):
+        """把新学生 {学号: 姓名} 一次性追加到名册，调用方持有数据目录写锁并已确认学号都不在名册中"""
+        # 重新添加已删除的学号前先清除其旧的积分记录，否则墓碑会把新记录一起过滤掉
+        if not self._tombstones.get().isdisjoint(students):
+            self.purge_deleted_students()
+
+        roster = self._roster_cache.get()
+        with open(self.path(STUDENTS_FILE), 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows(students.items())
+
+        roster = dict(roster)
+        roster.update(students)
+        self._roster_cache.store(roster)
+
+    @_storage_backend
+    def get_all_students(self) -> List[Tuple[str, str, int]]:
+        """获取所有学生信息，积分包括写入队列中尚未写入文件的积分变化，不等待写入线程"""
+        try:
+            balances = self._score_event_writer.balances()
+            return [(sid, name, balances.get(sid, 0)) for sid, name in self._roster_cache.get().items()]
+        except Exception as e:
+            print(f"获取学生列表失败: {e}")
+            return []
+
+    @_storage_backend
+    def get_student_by_id(self, student_id: str) -> Optional[Tuple[str, str, int]]:
+        """根据学号获取学生信息，积分与 get_all_students 相同，不等待写入线程"""
+        try:
+            roster = self._roster_cache.get()
+            if student_id not in roster:
+                return None
+            return (student_id, roster[student_id], self._score_event_writer.balances().get(student_id, 0))
+        except Exception as e:
+            print(f"获取学生信息失败: {e}")
+            return None
+
+    @_storage_backend
+    def update_student_name(self, student_id: str, new_name: str) -> bool:
+        """更新学生姓名"""
+        try:
+            with self._data_update():
+                students = dict(self._roster_cache.get())
+                if student_id not in students:
+                    return False
+
+                students[student_id] = new_name
+                self._save_all_students(students)
+                return True
+        except Exception as e:
+            print(f"更新学生姓名失败: {e}")
+            return False
+
+    @_storage_backend
+    @_after_queued_writes
+    def delete_student(self, student_id: str) -> bool:
+        """删除学生"""
+        try:
+            with self._data_update():
+                students = dict(self._roster_cache.get())
+                if students.pop(student_id, None) is None:
+                    return False
+
+                self._save_all_students(students)
+                self._balance_store.set_many({student_id: 0})
+                # 该学生的积分记录先以墓碑标记，由 purge_deleted_students 统一清除
+                self._tombstones.store(self._tombstones.get() | {student_id})
+                return True
+        except Exception as e:
+            print(f"删除学生失败: {e}")
+            return False
+
+    def _save_all_students(self, students: Dict[str, str]):
+        """保存所有学生信息 {学号: 姓名} 到文件"""
+        students_file = self.path(STUDENTS_FILE)
+        try:
+            _atomic_write_csv(students_file, ['student_id', 'name'], students.items())
+        except Exception:
+            self._roster_cache.invalidate()
+            raise
+        self._roster_cache.store(students)
+
+    @_storage_backend
+    @_after_queued_writes
+    def update_student_score(self, student_id: str, new_score: int) -> bool:
+        """更新学生当前积分"""
+        try:
+            with self._data_update():
+                if student_id not in self._roster_cache.get():
+                    return False
+
+                self._balance_store.set_many({student_id: new_score})
+                return True
+        except Exception as e:
+            print(f"更新学生积分失败: {e}")
+            return False
+
+    # 积分事件相关
+    def add_score_event(self, student_id: str, event_name: str, score_change: int, event_type: str = "score") -> bool:
+        """添加积分事件"""
+        results = self.add_score_events_bulk([student_id], event_name, score_change, event_type)
+        return results[0][1]
+
+    @_storage_backend
+    def add_score_events_bulk(self, student_ids: List[str], event_name: str, score_change: int,
+                              event_type: str = "score", timestamp: Optional[datetime] = None) -> List[Tuple[str, bool]]:
+        """
+        为多名学生批量添加同一积分事件
+        名册只校验一次，事件行和学生积分变化放入后台写入队列后立即返回，由写入线程合并写入；
+        需要等待写入完成时调用 flush_score_events
+        返回: [(学号, 是否成功), ...]，顺序与 student_ids 一致
+        """
+        try:
+            if timestamp is None:
+                timestamp = datetime.now()
+            results, _ = self._queue_score_events(student_ids, event_name, score_change, event_type,
+                                                  timestamp.strftime("%Y-%m-%d %H:%M:%S"))
+            return results
+        except Exception as e:
+            print(f"添加积分事件失败: {e}")
+            return [(student_id, False) for student_id in student_ids]
+
+    def _queue_score_events(self, student_ids: List[str], event_name: str, score_change: int, event_type: str,
+                            timestamp: str, side_rows: List[Tuple[str, list]] = ()) -> Tuple[List[Tuple[str, bool]], Future]:
+        """校验学号后把积分事件、积分变化和附带的记录行放入写入队列，返回 (校验结果, Future)"""
+        roster = self._roster_cache.get()
+        results = [(student_id, student_id in roster) for student_id in student_ids]
+        valid_ids = [student_id for student_id, ok in results if ok]
+        deltas = {}
+        for student_id in valid_ids:
+            deltas[student_id] = deltas.get(student_id, 0) + score_change
+        rows = [[student_id, event_name, score_change, timestamp, event_type] for student_id in valid_ids]
+        future = self._score_event_writer.submit(rows, deltas, side_rows) if rows or side_rows else None
+        return results, future
+
+    def _append_score_event_rows(self, rows: List[list]) -> List[str]:
+        """
+        将积分事件行按日期追加到对应的分区文件，每个文件只打开一次，并同步更新分区目录和事件索引
+        返回写入的文件路径
+        """
+        granularity = self.get_setting("score_events_partition", "day")
+        layout = self.get_setting("score_events_layout", "flat")
+        rows_by_partition = {}
+        for row in rows:
+            partition = partition_name(date.fromisoformat(row[3][:10]), granularity, layout)
+            rows_by_partition.setdefault(partition, []).append(row)
+
+        with self._score_events_lock:
+            catalog = self._partition_catalog
+            indexes = self._event_indexes
+            for partition, date_rows in rows_by_partition.items():
+                events_file = catalog.path(partition)
+                os.makedirs(os.path.dirname(events_file), exist_ok=True)
+
+                f = self._append_handles.get(events_file)
+                start_offset = f.tell()
+                # 新文件先写入标题行
+                chunks = [_encode_csv_row(EVENT_HEADERS)] if start_offset == 0 else []
+                offset = start_offset + sum(len(chunk) for chunk in chunks)
+                appended = []
+                for row in date_rows:
+                    data = _encode_csv_row(row)
+                    appended.append((offset, tuple(row)))
+                    chunks.append(data)
+                    offset += len(data)
+                f.write(b''.join(chunks))
+                # 索引按文件签名和末尾内容判断是否同步，更新索引前必须先刷新
+                self._append_handles.flush(events_file)
+
+                catalog.register(partition)
+                rollup_fingerprint = indexes['rollup'].fingerprint()
+                for index in indexes.values():
+                    index.note_append(partition, events_file, start_offset, appended)
+                self._score_prefix_index.note_append(rollup_fingerprint, indexes['rollup'].fingerprint(), appended)
+        return [catalog.path(partition) for partition in rows_by_partition]
+
+    def _apply_score_deltas(self, deltas: Dict[str, int]):
+        """按 {学号: 积分变化} 更新学生当前积分，只追加积分日志，不回写名册"""
+        balances = self._balance_store.get()
+        self._balance_store.set_many({sid: balances.get(sid, 0) + delta for sid, delta in deltas.items()})
+
+    def _score_event_partitions(self, start_date: str = None, end_date: str = None) -> Dict[str, str]:
+        """返回与日期范围有交集的分区 {分区名: 文件路径}，按日期排序"""
+        return self._partition_catalog.partitions(start_date, end_date)
+
+    def _write_archive(self, file_path: str, records: List[Tuple[str, str, int, str, str]], sources: List[list]):
+        """整体改写一个归档分区（列式或二进制）"""
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        if is_binlog(file_path):
+            write_binlog(file_path, records, sources, self.path(STRING_TABLE_FILE, is_score_event=True))
+        else:
+            ColumnarPartition.from_records(records, sources).save(file_path)
+
+    def compact_score_events(self, today: date = None) -> int:
+        """
+        把已经结束的分区（结束日期早于今天）压缩为归档分区，读取函数会透明地读取归档分区，
+        只有今天（按周/月分区时为尚未结束的当前分区）仍保留为CSV。归档格式由设置 score_events_archive_format 决定:
+        - columnar（默认）: 按月的列式文件 score_events_YYYY-MM.col
+        - binary: 按年的定长二进制文件 score_events_YYYY.bin，已有的列式文件也会并入
+        已有的目标归档分区会与新压缩的事件合并后整体改写。
+        返回被压缩的分区数
+        """
+        if self._get_sqlite_store() is not None:
+            return 0
+        self._score_event_writer.flush()
+        today = today or date.today()
+        layout = self.get_setting("score_events_layout", "flat")
+        if self.get_setting("score_events_archive_format", "columnar") == "binary":
+            granularity, suffix = 'year', BINLOG_SUFFIX
+        else:
+            granularity, suffix = 'month', COLUMNAR_SUFFIX
+        try:
+            with self._data_update(), self._score_events_lock:
+                catalog = self._partition_catalog
+                records_by_target: Dict[str, list] = {}
+                sources_by_target: Dict[str, list] = {}
+                compacted = []
+                for partition, file_path in catalog.partitions().items():
+                    if (file_path.endswith(suffix) or (is_archive(file_path) and suffix == COLUMNAR_SUFFIX)
+                            or catalog.bounds(partition)[1] >= today or not os.path.exists(file_path)):
+                        continue
+                    stat = os.stat(file_path)
+                    records = [record for _, record in iter_events_with_offsets(file_path)]
+                    try:
+                        for record in records:
+                            encode_timestamp(record[3])
+                    except ValueError as e:
+                        print(f"跳过无法压缩的分区 {partition}: {e}")
+                        continue
+
+                    # 按事件自身的日期归入归档分区（跨月的周分区会分到两个文件）
+                    targets = set()
+                    for record in records:
+                        target = partition_name(date.fromisoformat(record[3][:10]), granularity, layout, suffix)
+                        records_by_target.setdefault(target, []).append(record)
+                        targets.add(target)
+                    if not targets:
+                        target = partition_name(catalog.bounds(partition)[0], granularity, layout, suffix)
+                        records_by_target.setdefault(target, [])
+                        targets.add(target)
+                    for target in targets:
+                        sources_by_target.setdefault(target, []).append([partition, [stat.st_size, stat.st_mtime_ns]])
+                    compacted.append(partition)
+
+                if not compacted:
+                    return 0
+                for target, records in records_by_target.items():
+                    target_path = catalog.path(target)
+                    sources = sources_by_target[target]
+                    if target in catalog and os.path.exists(target_path):
+                        records = [record for _, record in iter_events_with_offsets(target_path)] + records
+                        # 只保留压缩中断后可能残留的来源分区记录
+                        sources = [source for source in archive_sources(target_path)
+                                   if os.path.exists(catalog.path(source[0]))] + sources
+                    self._write_archive(target_path, records, sources)
+
+                catalog.replace(compacted, list(records_by_target))
+                self._append_handles.close_all()
+                for partition in compacted:
+                    os.remove(catalog.path(partition))
+                return len(compacted)
+        except Exception as e:
+            print(f"压缩积分事件分区失败: {e}")
+            return 0
+
+    def compact_score_events_in_background(self) -> threading.Thread:
+        """在后台线程中清除已删除学生的积分事件并压缩已经结束的分区，不阻塞界面启动"""
+        def run():
+            self.purge_deleted_students()
+            self.compact_score_events()
+
+        thread = threading.Thread(target=run, name="compact_score_events", daemon=True)
+        thread.start()
+        return thread
+
+    @_storage_backend
+    @_after_queued_writes
+    def get_score_events_by_student(self, student_id: str) -> EventBatch:
+        """获取指定学生的积分事件（按分区日期顺序），通过学号索引只读取属于该学生的行"""
+        try:
+            events = EventBatch()
+            if student_id in self._tombstones.get():
+                return events
+            strings = {}
+            partitions = self._score_event_partitions()
+            postings = self._event_indexes['student'].get(partitions, prune=True)
+            for partition, path in partitions.items():
+                offsets = postings.get(partition, {}).get(student_id)
+                if offsets:
+                    events.extend(read_events_at(path, offsets, strings))
+            return events
+        except Exception as e:
+            print(f"获取学生积分事件失败: {e}")
+            return EventBatch()
+
+    def purge_deleted_students(self) -> int:
+        """
+        从分区文件中清除墓碑中所有学号的积分事件，然后清空墓碑
+        通过学号索引只找出包含这些学生的分区，每个分区只改写一次
+        返回改写的分区数
+        """
+        if self._get_sqlite_store() is not None:
+            return 0
+        try:
+            with self._data_update(), self._score_events_lock:
+                deleted = self._tombstones.get()
+                if not deleted:
+                    return 0
+                partitions = self._score_event_partitions()
+                postings = self._event_indexes['student'].get(partitions, prune=True)
+                affected = [partition for partition, by_student in postings.items()
+                            if partition in partitions and not deleted.isdisjoint(by_student)]
+                # 改写分区文件前关闭追加句柄
+                self._append_handles.close_all()
+                for partition in affected:
+                    file_path = partitions[partition]
+                    if not os.path.exists(file_path):
+                        continue
+                    if is_archive(file_path):
+                        records = [record for _, record in iter_events_with_offsets(file_path)]
+                        self._write_archive(file_path, [record for record in records if record[0] not in deleted],
+                                            archive_sources(file_path))
+                        continue
+
+                    with open(file_path, 'r', newline='', encoding='utf-8') as f:
+                        reader = csv.reader(f)
+                        header = next(reader, None) or EVENT_HEADERS
+                        kept = [row for row in reader if row and row[0] not in deleted]
+                    _atomic_write_csv(file_path, header, kept)
+                self._tombstones.store(())
+                return len(affected)
+        except Exception as e:
+            print(f"清除已删除学生的积分事件失败: {e}")
+            return 0
+
+    # 历史积分事件导入
+    def import_score_events(self, rows: Iterable[Sequence], dry_run: bool = False,
+                            start: int = 1) -> Tuple[int, int, List[str]]:
+        """
+        批量导入历史积分事件，每行为 (学号, 事件名称, 积分变化, 时间 YYYY-MM-DD HH:MM:SS, 事件类型)，
+        事件类型可省略（默认 score）。rows 可以是任意可迭代对象，逐行校验，不会整体读入内存。
+        每行按自身的时间写入对应的日期分区，每 IMPORT_BATCH_ROWS 行追加一批（每批每个分区只写一次），
+        学生当前积分在导入结束时统一更新一次。dry_run 为 True 时只校验，不写入任何文件。
+        start 为第一行的行号，用于错误信息
+        返回: (导入（dry_run 时为可以导入）的行数, 跳过的行数, 错误信息列表)
+        """
+        errors = []
+        imported = skipped = 0
+        deltas: Dict[str, int] = {}
+        written = set()  # 写入过的分区文件
+        sqlite_store = self._get_sqlite_store()
+
+        def write(batch: List[list], batch_deltas: Dict[str, int]):
+            nonlocal imported
+            if not dry_run:
+                if sqlite_store is not None:
+                    sqlite_store.append_score_events(batch, batch_deltas)
+                else:
+                    written.update(self._append_score_event_rows(batch))
+                    for student_id, delta in batch_deltas.items():
+                        deltas[student_id] = deltas.get(student_id, 0) + delta
+            imported += len(batch)
+
+        def run():
+            nonlocal skipped
+            if sqlite_store is not None:
+                roster = {student[0] for student in sqlite_store.get_all_students()}
             else:
-                # 第一行是数据，重新处理
-                f.seek(0)
-                reader = csv.reader(f)
-            
-            for row_num, row in enumerate(reader, start=2):
-                if len(row) < 1:
+                roster = self._roster_cache.get()
+            days: Dict[str, bool] = {}
+            batch, batch_deltas = [], {}
+            for row_num, row in enumerate(rows, start=start):
+                if not row or not any(row):
                     continue
-                
-                student_id = row[0].strip()
-                name = row[1].strip() if len(row) > 1 else ""
-                
-                if not student_id:
-                    errors.append(f"第{row_num}行: 学号不能为空")
-                    continue
-                
-                if add_student(student_id, name):
-                    success_count += 1
+                error = None
+                if len(row) < 4:
+                    error = "列数不足"
                 else:
-                    skip_count += 1
-                    errors.append(f"第{row_num}行: 学号 {student_id} 已存在，跳过")
-    
-    except Exception as e:
-        errors.append(f"读取CSV文件失败: {str(e)}")
-    
-    return success_count, skip_count, errors
+                    student_id, event_name, score_change, timestamp = row[0].strip(), row[1], row[2], row[3].strip()
+                    event_type = row[4].strip() if len(row) > 4 and row[4] else "score"
+                    if student_id not in roster:
+                        error = f"学号 {student_id} 不存在"
+                    elif not event_name:
+                        error = "事件名称不能为空"
+                    elif not _is_event_timestamp(timestamp, days):
+                        error = f"时间 {timestamp} 格式不正确，应为 YYYY-MM-DD HH:MM:SS"
+                    elif event_type not in EVENT_TYPES:
+                        error = f"未知的事件类型 {event_type}"
+                    else:
+                        try:
+                            score_change = int(score_change)
+                        except ValueError:
+                            error = f"积分变化 {score_change} 不是整数"
+                if error:
+                    skipped += 1
+                    errors.append(f"第{row_num}行: {error}")
+                    continue
 
+                batch.append([student_id, event_name, score_change, timestamp, event_type])
+                batch_deltas[student_id] = batch_deltas.get(student_id, 0) + score_change
+                if len(batch) >= self.IMPORT_BATCH_ROWS:
+                    write(batch, batch_deltas)
+                    batch, batch_deltas = [], {}
+            if batch:
+                write(batch, batch_deltas)
 
+        try:
+            if dry_run:
+                run()
+            else:
+                # 先写完队列中的事件，导入期间其他写入等待
+                self._score_event_writer.flush()
+                with self._data_update(), self._score_events_lock:
+                    try:
+                        run()
+                    finally:
+                        # 已经写入的批次即使中途出错也要计入学生积分
+                        if deltas:
+                            self._apply_score_deltas(deltas)
+                            written.add(self.path(BALANCES_JOURNAL_FILE))
+                        if sqlite_store is None:
+                            self._append_handles.fsync(written)
+                            # 不为导入涉及的历史分区长期保留句柄
+                            self._append_handles.close_all()
+        except Exception as e:
+            errors.append(f"导入积分事件失败: {str(e)}")
+        return imported, skipped, errors
 
-# 新增数据文件路径配置
-REWARD_EVENTS_FILE = 'reward_events.csv'
-REWARD_RULES_FILE = 'reward_rules.csv'
-DAILY_TASK_RULES_FILE = 'daily_task_rules.csv'
-DAILY_TASK_EVENTS_FILE = 'daily_task_events.csv'
-SCORE_EVENTS_DIR = 'score_events' # 新的积分事件存储目录
+    def import_score_events_from_csv(self, csv_file_path: str, dry_run: bool = False) -> Tuple[int, int, List[str]]:
+        """
+        从CSV文件导入历史积分事件，列为 学号,事件名称,积分变化,时间,事件类型（可省略），可以有标题行；
+        自动识别 UTF-8 和 GBK 编码，按行流式读取。其余见 import_score_events
+        """
+        try:
+            with _open_csv_source(csv_file_path) as f:
+                reader = csv.reader(f)
+                first_row = next(reader, None)
+                if not first_row:
+                    return 0, 0, ["CSV文件为空"]
+                # 如果第一行看起来像标题，跳过它
+                if first_row[0].strip().lower() in ['student_id', 'studentid', '学号', 'id']:
+                    return self.import_score_events(reader, dry_run, start=2)
+                return self.import_score_events(itertools.chain([first_row], reader), dry_run)
+        except Exception as e:
+            return 0, 0, [f"读取CSV文件失败: {str(e)}"]
 
+    # 积分规则相关
+    @_storage_backend
+    def add_score_rule(self, rule_name: str, score_value: int) -> bool:
+        """添加积分规则"""
+        try:
+            return self._rule_catalog.add('score', rule_name, score_value)
+        except Exception as e:
+            print(f"添加积分规则失败: {e}")
+            return False
 
+    @_storage_backend
+    def get_all_score_rules(self) -> List[Tuple[str, int]]:
+        """获取所有积分规则"""
+        try:
+            return list(self._rule_catalog.rules('score').items())
+        except Exception as e:
+            print(f"获取积分规则失败: {e}")
+            return []
 
-# 兑换事件相关函数
-def add_reward_event(student_id: str, reward_name: str, score_cost: int) -> bool:
-    """添加兑换事件"""
-    try:
-        # 检查学生是否存在
-        student = get_student_by_id(student_id)
-        if not student:
+    @_storage_backend
+    def get_score_rule_by_name(self, rule_name: str) -> Optional[Tuple[str, int]]:
+        """根据规则名称获取积分规则"""
+        try:
+            return self._rule_catalog.get('score', rule_name)
+        except Exception as e:
+            print(f"获取积分规则失败: {e}")
+            return None
+
+    @_storage_backend
+    def delete_score_rule(self, rule_name: str) -> bool:
+        """删除积分规则"""
+        try:
+            return self._rule_catalog.delete('score', rule_name)
+        except Exception as e:
+            print(f"删除积分规则失败: {e}")
             return False
-            
-        # 记录兑换事件
-        events_file = get_file_path(REWARD_EVENTS_FILE)
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        with open(events_file, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([student_id, reward_name, score_cost, timestamp])
-        
-        # 更新学生当前积分 (兑换是扣分)
-        sid, name, current_score = student
-        new_score = current_score - score_cost
-        update_student_score(student_id, new_score)
-        
-        # 同时记录到总积分事件中，类型为'reward'
-        add_score_event(student_id, f"兑换: {reward_name}", -score_cost, event_type="reward")
-
-        return True
-    except Exception as e:
-        print(f"添加兑换事件失败: {e}")
-        return False
 
-def get_all_reward_events() -> List[Tuple[str, str, int, str]]:
-    """获取所有兑换事件"""
-    try:
-        events_file = get_file_path(REWARD_EVENTS_FILE)
-        events = []
-        
-        if not os.path.exists(events_file):
-            return events
-            
-        with open(events_file, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            next(reader)  # 跳过标题行
-            for row in reader:
-                if len(row) >= 4:
-                    student_id, reward_name, score_cost, timestamp = row[0], row[1], int(row[2]), row[3]
-                    events.append((student_id, reward_name, score_cost, timestamp))
-        
-        return events
-    except Exception as e:
-        print(f"获取兑换事件失败: {e}")
-        return []
-
-# 兑换规则相关函数
-def add_reward_rule(rule_name: str, score_cost: int) -> bool:
-    """添加兑换规则"""
-    try:
-        if get_reward_rule_by_name(rule_name):
+    # 设置相关
+    def get_setting(self, key: str, default_value: str = "") -> str:
+        """获取设置值（从内存读取）"""
+        try:
+            return self._settings.get(key, default_value)
+        except Exception as e:
+            print(f"获取设置失败: {e}")
+            return default_value
+
+    def set_setting(self, key: str, value: str) -> bool:
+        """设置值，稍后与其他修改一起写入 settings.json"""
+        try:
+            # 队列中的事件按修改前的设置（分区方式、存储后端等）写入
+            self._score_event_writer.flush()
+            self._settings.set(key, value)
+
+            if key == "storage_backend":
+                self._reset_storage_backend()
+
+            return True
+        except Exception as e:
+            print(f"设置值失败: {e}")
             return False
-        
-        rules_file = get_file_path(REWARD_RULES_FILE)
-        with open(rules_file, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([rule_name, score_cost])
-        return True
-    except Exception as e:
-        print(f"添加兑换规则失败: {e}")
-        return False
 
-def get_all_reward_rules() -> List[Tuple[str, int]]:
-    """获取所有兑换规则"""
-    try:
-        rules_file = get_file_path(REWARD_RULES_FILE)
-        rules = []
-        
-        if not os.path.exists(rules_file):
-            return rules
-            
-        with open(rules_file, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            next(reader)  # 跳过标题行
-            for row in reader:
-                if len(row) >= 2:
-                    rule_name, score_cost = row[0], int(row[1])
-                    rules.append((rule_name, score_cost))
-        
-        return rules
-    except Exception as e:
-        print(f"获取兑换规则失败: {e}")
-        return []
+    # CSV导入功能
+    def import_students_from_csv(self, csv_file_path: str) -> Tuple[int, int, List[str]]:
+        """
+        从CSV文件导入学生信息
+        源文件按行流式读取（自动识别 UTF-8、带BOM的UTF-8 和 Excel 导出的 GBK 编码），学号查重使用内存中的名册，
+        所有新学生一次性追加到名册文件
+        返回: (成功导入数量, 跳过数量, 错误信息列表)
+        """
+        errors = []
+        try:
+            source = _open_csv_source(csv_file_path)
+        except Exception as e:
+            errors.append(f"读取CSV文件失败: {str(e)}")
+            return 0, 0, errors
 
-def get_reward_rule_by_name(rule_name: str) -> Optional[Tuple[str, int]]:
-    """根据规则名称获取兑换规则"""
-    rules = get_all_reward_rules()
-    for name, cost in rules:
-        if name == rule_name:
-            return (name, cost)
-    return None
+        with source:
+            return self._import_student_rows(csv.reader(source), errors)
 
-def delete_reward_rule(rule_name: str) -> bool:
-    """删除兑换规则"""
-    try:
-        rules = get_all_reward_rules()
-        original_count = len(rules)
-        rules = [(name, cost) for name, cost in rules if name != rule_name]
-        
-        if len(rules) < original_count:
-            _save_all_reward_rules(rules)
+    def _import_student_rows(self, reader, errors: List[str]) -> Tuple[int, int, List[str]]:
+        """逐行导入 csv.reader 读出的学生信息"""
+        try:
+            first = next(reader, None)
+        except Exception as e:
+            errors.append(f"读取CSV文件失败: {str(e)}")
+            return 0, 0, errors
+
+        # 尝试检测是否有标题行
+        if not first:
+            errors.append("CSV文件为空")
+            return 0, 0, errors
+        has_header = first[0].strip().lower() in ['student_id', 'studentid', '学号', 'id']
+        rows = reader if has_header else itertools.chain([first], reader)
+
+        new_students: Dict[str, str] = {}
+        skip_count = 0
+        try:
+            with self._data_update():
+                sqlite_store = self._get_sqlite_store()
+                if sqlite_store is not None:
+                    existing = {student[0] for student in sqlite_store.get_all_students()}
+                else:
+                    existing = self._roster_cache.get()
+
+                for row_num, row in enumerate(rows, start=2 if has_header else 1):
+                    if len(row) < 1:
+                        continue
+
+                    student_id = row[0].strip()
+                    name = row[1].strip() if len(row) > 1 else ""
+
+                    if not student_id:
+                        errors.append(f"第{row_num}行: 学号不能为空")
+                        continue
+
+                    if student_id in existing or student_id in new_students:
+                        skip_count += 1
+                        errors.append(f"第{row_num}行: 学号 {student_id} 已存在，跳过")
+                    else:
+                        new_students[student_id] = name
+
+                if sqlite_store is not None:
+                    for student_id, name in new_students.items():
+                        sqlite_store.add_student(student_id, name)
+                elif new_students:
+                    self._append_students(new_students)
+        except Exception as e:
+            self._roster_cache.invalidate()
+            errors.append(f"导入学生失败: {str(e)}")
+            return 0, skip_count, errors
+
+        return len(new_students), skip_count, errors
+
+    # 兑换事件相关
+    @_storage_backend
+    def add_reward_event(self, student_id: str, reward_name: str, score_cost: int) -> bool:
+        """添加兑换事件"""
+        try:
+            # 检查学生是否存在
+            if student_id not in self._roster_cache.get():
+                return False
+
+            # 兑换记录和总积分事件（类型为'reward'，学生积分在此一并扣除）一起放入写入队列
+            events_file = self.path(REWARD_EVENTS_FILE)
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self._queue_score_events([student_id], f"兑换: {reward_name}", -score_cost, "reward", timestamp,
+                                     [(events_file, [student_id, reward_name, score_cost, timestamp])])
             return True
-        
-        return False
-    except Exception as e:
-        print(f"删除兑换规则失败: {e}")
-        return False
+        except Exception as e:
+            print(f"添加兑换事件失败: {e}")
+            return False
 
-def _save_all_reward_rules(rules: List[Tuple[str, int]]):
-    """保存所有兑换规则到文件"""
-    rules_file = get_file_path(REWARD_RULES_FILE)
-    with open(rules_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(["rule_name", "score_cost"])
-        for rule_name, score_cost in rules:
-            writer.writerow([rule_name, score_cost])
+    @_storage_backend
+    @_after_queued_writes
+    def get_all_reward_events(self) -> EventBatch:
+        """获取所有兑换事件，score_change 为扣除的积分（负数），event_type 为 'reward'"""
+        try:
+            events_file = self.path(REWARD_EVENTS_FILE)
+            events = EventBatch()
 
+            if not os.path.exists(events_file):
+                return events
 
+            with open(events_file, 'r', newline='', encoding='utf-8') as f:
+                reader = csv.reader(f)
+                next(reader)  # 跳过标题行
+                for row in reader:
+                    if len(row) >= 4:
+                        student_id, reward_name, score_cost, timestamp = row[0], row[1], int(row[2]), row[3]
+                        events.append(Event(student_id, reward_name, -score_cost, timestamp, "reward"))
 
+            return events
+        except Exception as e:
+            print(f"获取兑换事件失败: {e}")
+            return EventBatch()
 
-# 每日任务规则相关函数
-def add_daily_task_rule(task_name: str, score_value: int) -> bool:
-    """添加每日任务规则"""
-    try:
-        if get_daily_task_rule_by_name(task_name):
+    # 兑换规则相关
+    @_storage_backend
+    def add_reward_rule(self, rule_name: str, score_cost: int) -> bool:
+        """添加兑换规则"""
+        try:
+            return self._rule_catalog.add('reward', rule_name, score_cost)
+        except Exception as e:
+            print(f"添加兑换规则失败: {e}")
             return False
-        
-        rules_file = get_file_path(DAILY_TASK_RULES_FILE)
-        with open(rules_file, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([task_name, score_value])
-        return True
-    except Exception as e:
-        print(f"添加每日任务规则失败: {e}")
-        return False
 
-def get_all_daily_task_rules() -> List[Tuple[str, int]]:
-    """获取所有每日任务规则"""
-    try:
-        rules_file = get_file_path(DAILY_TASK_RULES_FILE)
-        rules = []
-        
-        if not os.path.exists(rules_file):
-            return rules
-            
-        with open(rules_file, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            next(reader)  # 跳过标题行
-            for row in reader:
-                if len(row) >= 2:
-                    task_name, score_value = row[0], int(row[1])
-                    rules.append((task_name, score_value))
-        
-        return rules
-    except Exception as e:
-        print(f"获取每日任务规则失败: {e}")
-        return []
+    @_storage_backend
+    def get_all_reward_rules(self) -> List[Tuple[str, int]]:
+        """获取所有兑换规则"""
+        try:
+            return list(self._rule_catalog.rules('reward').items())
+        except Exception as e:
+            print(f"获取兑换规则失败: {e}")
+            return []
 
-def get_daily_task_rule_by_name(task_name: str) -> Optional[Tuple[str, int]]:
-    """根据规则名称获取每日任务规则"""
-    rules = get_all_daily_task_rules()
-    for name, value in rules:
-        if name == task_name:
-            return (name, value)
-    return None
+    @_storage_backend
+    def get_reward_rule_by_name(self, rule_name: str) -> Optional[Tuple[str, int]]:
+        """根据规则名称获取兑换规则"""
+        try:
+            return self._rule_catalog.get('reward', rule_name)
+        except Exception as e:
+            print(f"获取兑换规则失败: {e}")
+            return None
 
-def delete_daily_task_rule(task_name: str) -> bool:
-    """删除每日任务规则"""
-    try:
-        rules = get_all_daily_task_rules()
-        original_count = len(rules)
-        rules = [(name, value) for name, value in rules if name != task_name]
-        
-        if len(rules) < original_count:
-            _save_all_daily_task_rules(rules)
-            return True
-        
-        return False
-    except Exception as e:
-        print(f"删除每日任务规则失败: {e}")
-        return False
+    @_storage_backend
+    def delete_reward_rule(self, rule_name: str) -> bool:
+        """删除兑换规则"""
+        try:
+            return self._rule_catalog.delete('reward', rule_name)
+        except Exception as e:
+            print(f"删除兑换规则失败: {e}")
+            return False
 
-def _save_all_daily_task_rules(rules: List[Tuple[str, int]]):
-    """保存所有每日任务规则到文件"""
-    rules_file = get_file_path(DAILY_TASK_RULES_FILE)
-    with open(rules_file, 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        writer.writerow(["task_name", "score_value"])
-        for task_name, score_value in rules:
-            writer.writerow([task_name, score_value])
+    # 每日任务规则相关
+    @_storage_backend
+    def add_daily_task_rule(self, task_name: str, score_value: int) -> bool:
+        """添加每日任务规则"""
+        try:
+            return self._rule_catalog.add('daily_task', task_name, score_value)
+        except Exception as e:
+            print(f"添加每日任务规则失败: {e}")
+            return False
 
-# 每日任务事件相关函数
-def add_daily_task_event(student_id: str, task_name: str, score_change: int, timestamp: str) -> bool:
-    """添加每日任务事件"""
-    try:
-        # 检查学生是否存在
-        student = get_student_by_id(student_id)
-        if not student:
+    @_storage_backend
+    def get_all_daily_task_rules(self) -> List[Tuple[str, int]]:
+        """获取所有每日任务规则"""
+        try:
+            return list(self._rule_catalog.rules('daily_task').items())
+        except Exception as e:
+            print(f"获取每日任务规则失败: {e}")
+            return []
+
+    @_storage_backend
+    def get_daily_task_rule_by_name(self, task_name: str) -> Optional[Tuple[str, int]]:
+        """根据规则名称获取每日任务规则"""
+        try:
+            return self._rule_catalog.get('daily_task', task_name)
+        except Exception as e:
+            print(f"获取每日任务规则失败: {e}")
+            return None
+
+    @_storage_backend
+    def delete_daily_task_rule(self, task_name: str) -> bool:
+        """删除每日任务规则"""
+        try:
+            return self._rule_catalog.delete('daily_task', task_name)
+        except Exception as e:
+            print(f"删除每日任务规则失败: {e}")
             return False
-            
-        # 记录每日任务事件
-        events_file = get_file_path(DAILY_TASK_EVENTS_FILE)
-        
-        with open(events_file, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow([student_id, task_name, score_change, timestamp])
-        
-        # 同时记录到总积分事件中，类型为'daily_task'
-        add_score_event(student_id, f"每日任务: {task_name}", score_change, event_type="daily_task")
-
-        return True
-    except Exception as e:
-        print(f"添加每日任务事件失败: {e}")
-        return False
 
-def get_all_daily_task_events() -> List[Tuple[str, str, int, str]]:
-    """获取所有每日任务事件"""
-    try:
-        events_file = get_file_path(DAILY_TASK_EVENTS_FILE)
-        events = []
-        
-        if not os.path.exists(events_file):
+    # 每日任务事件相关
+    def add_daily_task_event(self, student_id: str, task_name: str, score_change: int, timestamp: str) -> bool:
+        """添加每日任务事件"""
+        results = self.add_daily_task_events_bulk([student_id], task_name, score_change, timestamp)
+        return results[0][1]
+
+    @_storage_backend
+    def add_daily_task_events_bulk(self, student_ids: List[str], task_name: str, score_change: int,
+                                   timestamp: str) -> List[Tuple[str, bool]]:
+        """
+        为多名学生批量添加每日任务事件
+        返回: [(学号, 是否成功), ...]，顺序与 student_ids 一致
+        """
+        try:
+            roster = self._roster_cache.get()
+            events_file = self.path(DAILY_TASK_EVENTS_FILE)
+            task_rows = [(events_file, [student_id, task_name, score_change, timestamp])
+                         for student_id in student_ids if student_id in roster]
+
+            # 每日任务记录和总积分事件（类型为'daily_task'）一起放入写入队列
+            results, _ = self._queue_score_events(student_ids, f"每日任务: {task_name}", score_change, "daily_task",
+                                                  datetime.now().strftime("%Y-%m-%d %H:%M:%S"), task_rows)
+            return results
+        except Exception as e:
+            print(f"添加每日任务事件失败: {e}")
+            return [(student_id, False) for student_id in student_ids]
+
+    @_storage_backend
+    @_after_queued_writes
+    def get_all_daily_task_events(self) -> EventBatch:
+        """获取所有每日任务事件，event_type 为 'daily_task'"""
+        try:
+            events_file = self.path(DAILY_TASK_EVENTS_FILE)
+            events = EventBatch()
+
+            if not os.path.exists(events_file):
+                return events
+
+            with open(events_file, 'r', newline='', encoding='utf-8') as f:
+                reader = csv.reader(f)
+                next(reader)  # 跳过标题行
+                for row in reader:
+                    if len(row) >= 4:
+                        student_id, task_name, score_change, timestamp = row[0], row[1], int(row[2]), row[3]
+                        events.append(Event(student_id, task_name, score_change, timestamp, "daily_task"))
+
             return events
-            
-        with open(events_file, 'r', newline='', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            next(reader)  # 跳过标题行
-            for row in reader:
-                if len(row) >= 4:
-                    student_id, task_name, score_change, timestamp = row[0], row[1], int(row[2]), row[3]
-                    events.append((student_id, task_name, score_change, timestamp))
-        
-        return events
-    except Exception as e:
-        print(f"获取每日任务事件失败: {e}")
-        return []
+        except Exception as e:
+            print(f"获取每日任务事件失败: {e}")
+            return EventBatch()
 
+    # 历史记录查询相关
+    @_storage_backend
+    @_after_queued_writes
+    def iter_events(self, start_date: str = None, end_date: str = None, student_id: str = None,
+                    event_type: str = None, rule_name: str = None, order: str = 'desc') -> Iterator[Event]:
+        """
+        按时间顺序逐条产出指定时间范围内的事件，可以随时停止迭代
+        参数与 get_all_events_in_date_range 相同，另外:
+        - rule_name: 只返回事件名称包含该文本的事件（不区分大小写）
+        - order: 'desc' 最新的在前，'asc' 最早的在前
+        各分区按需读取并按时间戳做 k 路归并，内存占用只与同时打开的分区有关，与整个范围的事件数无关
+        """
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"未知的排序方式: {order}")
+        descending = order == 'desc'
+        # 已删除学生的事件在清除之前仍在分区文件中，读取时跳过
+        deleted = self._tombstones.get()
+        if student_id in deleted:
+            return
+        partitions = self._event_partitions(start_date, end_date, student_id, event_type, rule_name, descending,
+                                            deleted)
+        for record in merge_partitions_by_time([partition[:3] for partition in partitions], descending):
+            yield Event(*record)
 
+    def _event_partitions(self, start_date: Optional[str], end_date: Optional[str], student_id: Optional[str],
+                          event_type: Optional[str], rule_name: Optional[str], descending: bool,
+                          deleted: frozenset) -> List[tuple]:
+        """
+        iter_events 要读取的分区: [(起始日期, 结束日期, 读取函数, 文件路径), ...]
+        读取函数按条件筛选该分区的事件，并按时间排好序（descending 时从新到旧）
+        """
+        catalog = self._partition_catalog
+        indexes = self._event_indexes
+        # 各分区共用的字符串去重字典，相同的学号、名称和类型只保留一个对象
+        strings: Dict[str, str] = {}
 
-# 历史记录查询相关函数
-def get_all_events_in_date_range(start_date: str = None, end_date: str = None, 
-                                student_id: str = None, event_type: str = None) -> List[Tuple[str, str, int, str, str]]:
-    """
-    获取指定时间范围内的所有事件
-    参数:
-    - start_date: 开始日期 (YYYY-MM-DD)
-    - end_date: 结束日期 (YYYY-MM-DD)
-    - student_id: 学生ID筛选
-    - event_type: 事件类型筛选 ('score', 'reward', 'daily_task')
-    
-    返回: [(student_id, event_name, score_change, timestamp, event_type), ...]
-    """
-    try:
-        all_events = []
-        
-        # 从按天存储的积分事件文件中读取
-        score_events_dir_path = os.path.join(get_data_dir(), SCORE_EVENTS_DIR)
-        if os.path.exists(score_events_dir_path):
-            for filename in os.listdir(score_events_dir_path):
-                if filename.startswith("score_events_") and filename.endswith(".csv"):
-                    # 从文件名提取日期
-                    file_date = filename.replace("score_events_", "").replace(".csv", "")
-                    
-                    # 检查日期范围
-                    if start_date and file_date < start_date:
+        def loader(partition: str, file_path: str):
+            def load() -> List[Tuple[str, str, int, str, str]]:
+                if not os.path.exists(file_path):
+                    return []
+                # 有学号或名称条件时通过索引只读取可能匹配的行
+                offsets = None
+                if student_id:
+                    postings = indexes['student'].get({partition: file_path}).get(partition, {})
+                    offsets = set(postings.get(student_id, ()))
+                if rule_name is not None:
+                    summary = indexes['name'].get({partition: file_path}).get(partition)
+                    matched = {offset for name_offsets in match_event_names(summary, rule_name).values()
+                               for offset in name_offsets} if summary else set()
+                    offsets = matched if offsets is None else offsets & matched
+                if offsets is None:
+                    records = iter_events_between(file_path, start_date, end_date, strings)
+                else:
+                    records = read_events_at(file_path, sorted(offsets), strings)
+
+                # 周/月分区可能只有一部分落在范围内，需要逐行检查日期
+                check_date = not catalog.covers(partition, start_date, end_date)
+                events = []
+                for event in records:
+                    sid, event_name, score_change, timestamp, evt_type = event
+
+                    # 应用筛选条件
+                    if check_date and ((start_date and timestamp[:10] < start_date) or
+                                       (end_date and timestamp[:10] > end_date)):
                         continue
-                    if end_date and file_date > end_date:
+                    if student_id and sid != student_id:
                         continue
-                    
-                    file_path = os.path.join(score_events_dir_path, filename)
-                    with open(file_path, 'r', newline='', encoding='utf-8') as f:
-                        reader = csv.reader(f)
-                        header = next(reader, None)
-                        if header is None:
+                    if sid in deleted:
+                        continue
+                    if event_type and evt_type != event_type:
+                        continue
+
+                    events.append(event)
+                events.sort(key=lambda x: x[3], reverse=descending)
+                return events
+            return load
+
+        partitions = []
+        for partition, file_path in catalog.partitions(start_date, end_date).items():
+            first_day, last_day = catalog.bounds(partition)
+            partitions.append((first_day.isoformat(), last_day.isoformat(), loader(partition, file_path), file_path))
+        return partitions
+
+    @_after_queued_writes
+    def _collect_events(self, start_date: Optional[str], end_date: Optional[str],
+                        event_type: Optional[str]) -> EventBatch:
+        """
+        不按学号筛选时 get_all_events_in_date_range 的实现
+        二进制归档按列直接复制到 EventBatch，不逐行生成记录；各分区实际的时间范围互不重叠时（压缩后的年度归档与
+        当前分区）从新到旧逐个分区拼接，有重叠时按 iter_events 做 k 路归并
+        """
+        deleted = self._tombstones.get()
+        # 各分区读出的事件（从新到旧）: 二进制归档为 EventBatch，其他格式为记录列表
+        loaded = []
+        for first, last, load, file_path in self._event_partitions(start_date, end_date, None, event_type, None,
+                                                                   True, deleted):
+            if is_binlog(file_path) and os.path.exists(file_path):
+                columns = read_binlog_columns(file_path, start_date, end_date, descending=True)
+                keep = None
+                if deleted or event_type:
+                    strings = columns.strings
+                    students = {code for code in set(columns.student_codes) if strings[code] not in deleted}
+                    keep = map(students.__contains__, columns.student_codes)
+                    if event_type:
+                        types = {code for code in set(columns.type_codes) if strings[code] == event_type}
+                        keep = map(bool.__and__, keep, map(types.__contains__, columns.type_codes))
+                events = EventBatch()
+                events.extend_columns(columns, keep)
+            else:
+                events = load()
+            if len(events):
+                loaded.append((first, last, events))
+
+        ordered = sorted(loaded, key=lambda partition: partition[2][0][3], reverse=True)
+        if any(older[2][0][3] >= newer[2][-1][3] for newer, older in zip(ordered, ordered[1:])):
+            return EventBatch(Event(*record) for record in merge_partitions_by_time(
+                [(first, last, lambda events=events: events) for first, last, events in loaded], True))
+        result = EventBatch()
+        for _, _, events in ordered:
+            if isinstance(events, EventBatch):
+                result.extend_columns(events.columns())
+            else:
+                result.extend(events)
+        return result
+
+    @_storage_backend
+    def get_all_events_in_date_range(self, start_date: str = None, end_date: str = None,
+                                     student_id: str = None, event_type: str = None) -> EventBatch:
+        """
+        获取指定时间范围内的所有事件
+        参数:
+        - start_date: 开始日期 (YYYY-MM-DD)
+        - end_date: 结束日期 (YYYY-MM-DD)
+        - student_id: 学生ID筛选
+        - event_type: 事件类型筛选 ('score', 'reward', 'daily_task')
+
+        返回: EventBatch [Event(student_id, event_name, score_change, timestamp, event_type), ...]，最新的在前
+        只需要前若干条时请使用 iter_events
+        """
+        try:
+            if student_id:
+                return EventBatch(self.iter_events(start_date, end_date, student_id, event_type))
+            return self._collect_events(start_date, end_date, event_type)
+        except Exception as e:
+            print(f"获取历史记录失败: {e}")
+            return EventBatch()
+
+    @_storage_backend
+    @_after_queued_writes
+    def get_score_totals(self, start_date: str = None, end_date: str = None,
+                         event_type: str = None) -> Dict[str, int]:
+        """
+        统计时间范围内每个学生的积分变化合计
+        不按类型过滤时使用前缀和索引，每个学生只需两次前缀和查询；
+        按类型过滤时读取按 (日期, 学号, 事件类型) 预先汇总的数据。两种方式都不逐条读取事件
+        返回: {student_id: 积分变化合计}，没有积分变化的学生可能不出现在结果中
+        """
+        try:
+            deleted = self._tombstones.get()
+            if not event_type:
+                rollup = self._event_indexes['rollup']
+                rollups = rollup.get(self._score_event_partitions(), prune=True)
+                totals = self._score_prefix_index.totals(rollups, rollup.fingerprint(), start_date, end_date)
+                return {sid: total for sid, total in totals.items() if sid not in deleted} if deleted else totals
+
+            totals = {}
+            rollups = self._event_indexes['rollup'].get(self._score_event_partitions(start_date, end_date))
+            for days in rollups.values():
+                for day, students in days.items():
+                    if (start_date and day < start_date) or (end_date and day > end_date):
+                        continue
+                    for student_id, types in students.items():
+                        if student_id in deleted:
                             continue
-                        
-                        # 处理新格式和旧格式
-                        expected_headers = ["student_id", "event_name", "score_change", "timestamp", "event_type"]
-                        if all(h in header for h in expected_headers):
-                            col_indices = {h: header.index(h) for h in expected_headers}
-                            for row in reader:
-                                if len(row) > max(col_indices.values()):
-                                    sid = row[col_indices["student_id"]]
-                                    event_name = row[col_indices["event_name"]]
-                                    score_change = int(row[col_indices["score_change"]])
-                                    timestamp = row[col_indices["timestamp"]]
-                                    evt_type = row[col_indices["event_type"]]
-                                    
-                                    # 应用筛选条件
-                                    if student_id and sid != student_id:
-                                        continue
-                                    if event_type and evt_type != event_type:
-                                        continue
-                                    
-                                    all_events.append((sid, event_name, score_change, timestamp, evt_type))
-                        else:
-                            # 旧格式处理
-                            for row in reader:
-                                if len(row) >= 4:
-                                    sid, event_name, score_change, timestamp = row[0], row[1], int(row[2]), row[3]
-                                    evt_type = "score"  # 默认类型
-                                    
-                                    # 应用筛选条件
-                                    if student_id and sid != student_id:
-                                        continue
-                                    if event_type and evt_type != event_type:
-                                        continue
-                                    
-                                    all_events.append((sid, event_name, score_change, timestamp, evt_type))
-        
-        # 按时间戳排序（最新的在前）
-        all_events.sort(key=lambda x: x[3], reverse=True)
-        
-        return all_events
-    except Exception as e:
-        print(f"获取历史记录失败: {e}")
-        return []
+                        for evt_type, (net, _) in types.items():
+                            if event_type and evt_type != event_type:
+                                continue
+                            totals[student_id] = totals.get(student_id, 0) + net
+            return totals
+        except Exception as e:
+            print(f"统计积分失败: {e}")
+            return {}
+
+    def get_all_score_rules_names(self) -> List[str]:
+        """获取所有积分规则名称"""
+        rules = self.get_all_score_rules()
+        return [rule[0] for rule in rules]
+
+    def get_all_reward_rules_names(self) -> List[str]:
+        """获取所有兑换规则名称"""
+        rules = self.get_all_reward_rules()
+        return [rule[0] for rule in rules]
+
+    def get_all_daily_task_rules_names(self) -> List[str]:
+        """获取所有每日任务规则名称"""
+        rules = self.get_all_daily_task_rules()
+        return [rule[0] for rule in rules]
+
+    @_storage_backend
+    @_after_queued_writes
+    def search_events_by_rule_name(self, rule_name: str, start_date: str = None, end_date: str = None,
+                                   student_id: str = None, event_type: str = None) -> EventBatch:
+        """
+        根据规则名称搜索事件（事件名称包含 rule_name，不区分大小写）
+        通过事件名称的二元字符组倒排索引定位匹配的行，只读取这些行；筛选条件与 get_all_events_in_date_range 相同
+        """
+        try:
+            return EventBatch(self.iter_events(start_date, end_date, student_id, event_type, rule_name=rule_name))
+        except Exception as e:
+            print(f"搜索历史记录失败: {e}")
+            return EventBatch()
+
+    EXPORT_CHUNK_ROWS = 5000
+
+    def export_events(self, file_path: str, start_date: str = None, end_date: str = None, student_id: str = None,
+                      event_type: str = None, rule_name: str = None, compress: Optional[bool] = None,
+                      progress=None, cancel: threading.Event = None) -> Optional[int]:
+        """
+        把历史记录查询的结果直接写入CSV文件，可在后台线程中调用
+        筛选条件与 iter_events 相同（最新的在前），事件边读取边分块写出，不在内存中保存整个结果。
+        - compress: 是否写成 gzip 压缩的CSV，默认按文件名是否以 .gz 结尾决定
+        - progress: 每写完一块调用 progress(已写出条数)
+        - cancel: 被设置后在下一块之前停止，删除未完成的文件并返回 None
+        先写入临时文件，完成后再替换目标文件，取消或出错时不会留下不完整的导出文件
+        返回: 导出的条数
+        """
+        if compress is None:
+            compress = file_path.lower().endswith('.gz')
+        student_names = {sid: name for sid, name, _ in self.get_all_students()}
+        temp_path = file_path + '.tmp'
+        if compress:
+            f = gzip.open(temp_path, 'wt', encoding='utf-8-sig', newline='')
+        else:
+            f = open(temp_path, 'w', encoding='utf-8-sig', newline='')
+        count = 0
+        cancelled = False
+        try:
+            with f:
+                writer = csv.writer(f)
+                writer.writerow(EXPORT_HEADERS)
+                events = self.iter_events(start_date, end_date, student_id, event_type, rule_name)
+                try:
+                    while not cancelled:
+                        chunk = [(sid, student_names.get(sid, "未知"), event_name, f"{score_change:+d}", timestamp,
+                                  EVENT_TYPE_NAMES.get(evt_type, evt_type))
+                                 for sid, event_name, score_change, timestamp, evt_type
+                                 in itertools.islice(events, self.EXPORT_CHUNK_ROWS)]
+                        if not chunk:
+                            break
+                        writer.writerows(chunk)
+                        count += len(chunk)
+                        if progress is not None:
+                            progress(count)
+                        cancelled = cancel is not None and cancel.is_set()
+                finally:
+                    events.close()
+            if cancelled:
+                os.remove(temp_path)
+                return None
+            replace_file(temp_path, file_path)
+            return count
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    # SQLite 迁移
+    def migrate_csv_to_sqlite(self, switch_backend: bool = True) -> Dict[str, int]:
+        """
+        把数据目录下现有的CSV数据一次性迁移到 SQLite 数据库
+        目标数据库必须为空，以免重复导入；迁移完成后默认切换到 SQLite 后端
+        SQLite 的 WAL 模式依赖本机共享内存，不能在多台电脑间共用，数据目录位于网络共享盘上时拒绝迁移
+        返回: {数据类别: 迁移条数}
+        """
+        from database_sqlite import SQLiteStore, SQLITE_DB_FILE
+
+        if is_network_path(self.data_dir):
+            raise ValueError(f"数据目录 {self.data_dir} 位于网络共享盘上，不能使用 SQLite 存储，请继续使用CSV存储")
+        self._reset_storage_backend()
+        store = SQLiteStore(self.path(SQLITE_DB_FILE))
+        try:
+            if not store.is_empty():
+                raise ValueError(f"数据库 {store.db_path} 中已有数据，请先备份并删除后再迁移")
+
+            # 直接调用CSV实现，不经过后端转发
+            csv_backend = type(self)
+            score_events = list(csv_backend.iter_events.__wrapped__(self, order='asc'))  # 按时间正序写入
+            counts = store.import_all(
+                students=csv_backend.get_all_students.__wrapped__(self),
+                score_events=score_events,
+                reward_events=[(sid, name, -change, timestamp)
+                               for sid, name, change, timestamp, _ in csv_backend.get_all_reward_events.__wrapped__(self)],
+                daily_task_events=[event[:4] for event in csv_backend.get_all_daily_task_events.__wrapped__(self)],
+                rules={
+                    'score': csv_backend.get_all_score_rules.__wrapped__(self),
+                    'reward': csv_backend.get_all_reward_rules.__wrapped__(self),
+                    'daily_task': csv_backend.get_all_daily_task_rules.__wrapped__(self),
+                })
+        finally:
+            store.close()
+
+        if switch_backend:
+            self.set_setting("storage_backend", "sqlite")
+        return counts
+
+# 默认数据目录
+# 程序退出时关闭所有仍在使用的 DataStore：写完积分事件队列和设置，并同步到磁盘
+_open_stores = weakref.WeakSet()
+_default_store: Optional[DataStore] = None
+_default_store_lock = threading.Lock()
+
+def default_store() -> DataStore:
+    """程序数据目录 (get_data_dir) 上的 DataStore，首次调用时创建"""
+    global _default_store
+    store = _default_store
+    if store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = DataStore(get_data_dir())
+            store = _default_store
+    return store
+
+def _close_open_stores():
+    for store in list(_open_stores):
+        store.close()
+
+atexit.register(_close_open_stores)
+
+# 模块级函数：转发到 default_store()，界面代码通过这些函数访问数据
+def flush_score_events(timeout: Optional[float] = None) -> bool:
+    return default_store().flush_score_events(timeout)
+
+def take_write_failures() -> List[Tuple[List[Event], str]]:
+    return default_store().take_write_failures()
+
+def init_db():
+    default_store().init_db()
+
+# 学生相关函数
+def add_student(student_id: str, name: str = "") -> bool:
+    return default_store().add_student(student_id, name)
+
+def get_all_students() -> List[Tuple[str, str, int]]:
+    return default_store().get_all_students()
+
+def get_student_by_id(student_id: str) -> Optional[Tuple[str, str, int]]:
+    return default_store().get_student_by_id(student_id)
+
+def update_student_name(student_id: str, new_name: str) -> bool:
+    return default_store().update_student_name(student_id, new_name)
+
+def delete_student(student_id: str) -> bool:
+    return default_store().delete_student(student_id)
+
+def update_student_score(student_id: str, new_score: int) -> bool:
+    return default_store().update_student_score(student_id, new_score)
+
+def import_students_from_csv(csv_file_path: str) -> Tuple[int, int, List[str]]:
+    return default_store().import_students_from_csv(csv_file_path)
+
+# 积分事件相关函数
+def add_score_event(student_id: str, event_name: str, score_change: int, event_type: str = "score") -> bool:
+    return default_store().add_score_event(student_id, event_name, score_change, event_type)
+
+def add_score_events_bulk(student_ids: List[str], event_name: str, score_change: int,
+                          event_type: str = "score", timestamp: Optional[datetime] = None) -> List[Tuple[str, bool]]:
+    return default_store().add_score_events_bulk(student_ids, event_name, score_change, event_type, timestamp)
+
+def get_score_events_by_student(student_id: str) -> EventBatch:
+    return default_store().get_score_events_by_student(student_id)
+
+def compact_score_events(today: date = None) -> int:
+    return default_store().compact_score_events(today)
+
+def compact_score_events_in_background() -> threading.Thread:
+    return default_store().compact_score_events_in_background()
+
+def purge_deleted_students() -> int:
+    return default_store().purge_deleted_students()
+
+def import_score_events(rows: Iterable[Sequence], dry_run: bool = False, start: int = 1) -> Tuple[int, int, List[str]]:
+    return default_store().import_score_events(rows, dry_run, start)
+
+def import_score_events_from_csv(csv_file_path: str, dry_run: bool = False) -> Tuple[int, int, List[str]]:
+    return default_store().import_score_events_from_csv(csv_file_path, dry_run)
+
+# 规则相关函数
+def add_score_rule(rule_name: str, score_value: int) -> bool:
+    return default_store().add_score_rule(rule_name, score_value)
+
+def get_all_score_rules() -> List[Tuple[str, int]]:
+    return default_store().get_all_score_rules()
+
+def get_score_rule_by_name(rule_name: str) -> Optional[Tuple[str, int]]:
+    return default_store().get_score_rule_by_name(rule_name)
+
+def delete_score_rule(rule_name: str) -> bool:
+    return default_store().delete_score_rule(rule_name)
 
 def get_all_score_rules_names() -> List[str]:
-    """获取所有积分规则名称"""
-    rules = get_all_score_rules()
-    return [rule[0] for rule in rules]
+    return default_store().get_all_score_rules_names()
+
+def add_reward_rule(rule_name: str, score_cost: int) -> bool:
+    return default_store().add_reward_rule(rule_name, score_cost)
+
+def get_all_reward_rules() -> List[Tuple[str, int]]:
+    return default_store().get_all_reward_rules()
+
+def get_reward_rule_by_name(rule_name: str) -> Optional[Tuple[str, int]]:
+    return default_store().get_reward_rule_by_name(rule_name)
+
+def delete_reward_rule(rule_name: str) -> bool:
+    return default_store().delete_reward_rule(rule_name)
 
 def get_all_reward_rules_names() -> List[str]:
-    """获取所有兑换规则名称"""
-    rules = get_all_reward_rules()
-    return [rule[0] for rule in rules]
+    return default_store().get_all_reward_rules_names()
+
+def add_daily_task_rule(task_name: str, score_value: int) -> bool:
+    return default_store().add_daily_task_rule(task_name, score_value)
+
+def get_all_daily_task_rules() -> List[Tuple[str, int]]:
+    return default_store().get_all_daily_task_rules()
+
+def get_daily_task_rule_by_name(task_name: str) -> Optional[Tuple[str, int]]:
+    return default_store().get_daily_task_rule_by_name(task_name)
+
+def delete_daily_task_rule(task_name: str) -> bool:
+    return default_store().delete_daily_task_rule(task_name)
 
 def get_all_daily_task_rules_names() -> List[str]:
-    """获取所有每日任务规则名称"""
-    rules = get_all_daily_task_rules()
-    return [rule[0] for rule in rules]
+    return default_store().get_all_daily_task_rules_names()
 
-def search_events_by_rule_name(rule_name: str, start_date: str = None, end_date: str = None) -> List[Tuple[str, str, int, str, str]]:
-    """
-    根据规则名称搜索事件
-    """
-    all_events = get_all_events_in_date_range(start_date, end_date)
-    filtered_events = []
-    
-    for event in all_events:
-        student_id, event_name, score_change, timestamp, event_type = event
-        # 检查事件名称是否包含规则名称
-        if rule_name.lower() in event_name.lower():
-            filtered_events.append(event)
-    
-    return filtered_events
+# 设置相关函数
+def get_setting(key: str, default_value: str = "") -> str:
+    return default_store().get_setting(key, default_value)
+
+def set_setting(key: str, value: str) -> bool:
+    return default_store().set_setting(key, value)
+
+# 兑换与每日任务事件相关函数
+def add_reward_event(student_id: str, reward_name: str, score_cost: int) -> bool:
+    return default_store().add_reward_event(student_id, reward_name, score_cost)
+
+def get_all_reward_events() -> EventBatch:
+    return default_store().get_all_reward_events()
+
+def add_daily_task_event(student_id: str, task_name: str, score_change: int, timestamp: str) -> bool:
+    return default_store().add_daily_task_event(student_id, task_name, score_change, timestamp)
+
+def add_daily_task_events_bulk(student_ids: List[str], task_name: str, score_change: int,
+                               timestamp: str) -> List[Tuple[str, bool]]:
+    return default_store().add_daily_task_events_bulk(student_ids, task_name, score_change, timestamp)
+
+def get_all_daily_task_events() -> EventBatch:
+    return default_store().get_all_daily_task_events()
+
+# 历史记录查询相关函数
+def iter_events(start_date: str = None, end_date: str = None, student_id: str = None, event_type: str = None,
+                rule_name: str = None, order: str = 'desc') -> Iterator[Event]:
+    return default_store().iter_events(start_date, end_date, student_id, event_type, rule_name, order)
+
+def get_all_events_in_date_range(start_date: str = None, end_date: str = None,
+                                 student_id: str = None, event_type: str = None) -> EventBatch:
+    return default_store().get_all_events_in_date_range(start_date, end_date, student_id, event_type)
+
+def get_score_totals(start_date: str = None, end_date: str = None, event_type: str = None) -> Dict[str, int]:
+    return default_store().get_score_totals(start_date, end_date, event_type)
+
+def search_events_by_rule_name(rule_name: str, start_date: str = None, end_date: str = None,
+                               student_id: str = None, event_type: str = None) -> EventBatch:
+    return default_store().search_events_by_rule_name(rule_name, start_date, end_date, student_id, event_type)
+
+def export_events(file_path: str, start_date: str = None, end_date: str = None, student_id: str = None,
+                  event_type: str = None, rule_name: str = None, compress: Optional[bool] = None,
+                  progress=None, cancel: threading.Event = None) -> Optional[int]:
+    return default_store().export_events(file_path, start_date, end_date, student_id, event_type, rule_name,
+                                         compress, progress, cancel)
 
+# SQLite 迁移
+def migrate_csv_to_sqlite(switch_backend: bool = True) -> Dict[str, int]:
+    return default_store().migrate_csv_to_sqlite(switch_backend)
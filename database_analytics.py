@@ -0,0 +1,112 @@
+from array import array
+from datetime import date
+from typing import Dict, Iterable, List, Tuple
+
+from database_events import RAW_TIMESTAMP, EventBatch, EventColumns
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 是可选依赖，缺少时使用纯 Python 实现
+    np = None
+
+# 积分统计
+# 对 EventBatch 的原始列做分组汇总（按学号、规则/事件名称、日期、事件类型），不逐条生成 Event。
+# 安装了 NumPy 时用 bincount/unique 向量化计算，否则按列循环，两种实现的结果相同。
+
+HAS_NUMPY = np is not None
+
+GROUP_BY_KEYS = ('student', 'rule', 'day', 'type')
+
+
+def _as_batch(events: Iterable) -> EventBatch:
+    return events if isinstance(events, EventBatch) else EventBatch(events)
+
+
+def _code_column(columns: EventColumns, by: str) -> array:
+    return {'student': columns.student_codes, 'rule': columns.name_codes, 'type': columns.type_codes}[by]
+
+
+# 纯 Python 实现
+def _group_python(columns: EventColumns, by: str) -> Dict[str, Tuple[int, int]]:
+    if by == 'day':
+        day_strings = {}
+        keys = []
+        for row, seconds in enumerate(columns.times):
+            if seconds == RAW_TIMESTAMP:
+                keys.append(columns.raw_times[row][:10])
+                continue
+            day = day_strings.get(seconds // 86400)
+            if day is None:
+                day = day_strings[seconds // 86400] = date.fromordinal(seconds // 86400).isoformat()
+            keys.append(day)
+    else:
+        strings = columns.strings
+        keys = [strings[code] for code in _code_column(columns, by)]
+    groups = {}
+    for key, score_change in zip(keys, columns.score_changes):
+        total, count = groups.get(key, (0, 0))
+        groups[key] = (total + score_change, count + 1)
+    return groups
+
+
+# NumPy 实现
+def _numpy_view(values: array):
+    """不复制数据，直接把 array 的缓冲区作为 NumPy 数组使用"""
+    return np.frombuffer(values, dtype=np.dtype(f'i{values.itemsize}'))
+
+
+def _group_numpy(columns: EventColumns, by: str) -> Dict[str, Tuple[int, int]]:
+    scores = _numpy_view(columns.score_changes)
+    if by == 'day':
+        times = _numpy_view(columns.times)
+        parsed = times != RAW_TIMESTAMP
+        days, inverse = np.unique(times[parsed] // 86400, return_inverse=True)
+        sums = np.bincount(inverse, weights=scores[parsed], minlength=len(days))
+        counts = np.bincount(inverse, minlength=len(days))
+        groups = {date.fromordinal(int(day)).isoformat(): (int(round(total)), int(count))
+                  for day, total, count in zip(days, sums, counts)}
+        # 少量无法解析的时间戳按原字符串的日期部分归类
+        for row in np.nonzero(~parsed)[0]:
+            key = columns.raw_times[int(row)][:10]
+            total, count = groups.get(key, (0, 0))
+            groups[key] = (total + int(scores[row]), count + 1)
+        return groups
+
+    codes = _numpy_view(_code_column(columns, by))
+    size = len(columns.strings)
+    sums = np.bincount(codes, weights=scores, minlength=size)
+    counts = np.bincount(codes, minlength=size)
+    return {columns.strings[code]: (int(round(sums[code])), int(counts[code])) for code in np.nonzero(counts)[0]}
+
+
+# 公共函数
+def group_totals(events: Iterable, by: str) -> Dict[str, Tuple[int, int]]:
+    """
+    按 by 分组统计积分变化
+    by: 'student' 学号, 'rule' 事件名称, 'day' 日期 (YYYY-MM-DD), 'type' 事件类型
+    返回: {分组键: (积分变化合计, 事件数)}
+    """
+    if by not in GROUP_BY_KEYS:
+        raise ValueError(f"未知的分组方式: {by}")
+    batch = _as_batch(events)
+    if not len(batch):
+        return {}
+    columns = batch.columns()
+    return _group_numpy(columns, by) if HAS_NUMPY else _group_python(columns, by)
+
+
+def total_score_change(events: Iterable) -> int:
+    """所有事件的积分变化合计"""
+    scores = _as_batch(events).score_changes
+    if HAS_NUMPY and len(scores):
+        return int(_numpy_view(scores).sum())
+    return sum(scores)
+
+
+def rank_students(student_ids: List[str], totals: Dict[str, int]) -> List[Tuple[str, int]]:
+    """按积分从高到低排序，积分相同的保持 student_ids 中的顺序；没有记录的学生按0分计"""
+    scores = [totals.get(student_id, 0) for student_id in student_ids]
+    if HAS_NUMPY and scores:
+        order = np.argsort(-np.array(scores, dtype=np.int64), kind='stable')
+        return [(student_ids[i], scores[i]) for i in order.tolist()]
+    return sorted(zip(student_ids, scores), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,280 @@
+import os
+import sys
+import mmap
+import json
+import struct
+import itertools
+import threading
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from database_events import EventColumns
+from database_lock import replace_file, temp_path
+
+# 积分事件的定长二进制归档格式
+# 设置 "score_events_archive_format": "binary" 后，database.compact_score_events 把已经结束的分区
+# 按年合并为 score_events_YYYY.bin，通过内存映射读取：
+#   文件头: 8字节魔数 + 4字节JSON长度 + JSON {"rows": 行数, "strings": 字符串表相对路径, "sources": [...]}，
+#           补齐到8字节边界
+#   记录:   每条 24 字节 <q I I i I>: 时间戳秒数、学号引用、事件名称引用、积分变化、事件类型引用，按时间排序
+# 学号、名称和类型保存在各归档文件共用的字符串表 strings.tbl 中（每行一个 JSON 字符串，只追加不改写），
+# 因此扫描时只需 struct 解包定长记录，不需要逐行解码文本；按时间范围读取时先在映射上二分查找。
+
+BINLOG_SUFFIX = '.bin'
+STRING_TABLE_FILE = 'strings.tbl'
+
+_MAGIC = b'SMBIN1\0\0'
+_LENGTH = struct.Struct('<I')
+_RECORD = struct.Struct('<qIIiI')
+_TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+_EPOCH = datetime(1970, 1, 1)
+# EventBatch 时间列（日序号*86400+秒数）与归档时间戳秒数之差
+_EPOCH_TIME = _EPOCH.toordinal() * 86400
+
+# 积分事件记录: (student_id, event_name, score_change, timestamp, event_type)
+EventRecord = Tuple[str, str, int, str, str]
+
+
+def is_binlog(path: str) -> bool:
+    return path.endswith(BINLOG_SUFFIX)
+
+
+def _to_seconds(timestamp: str) -> int:
+    delta = datetime.strptime(timestamp, _TIMESTAMP_FORMAT) - _EPOCH
+    return delta.days * 86400 + delta.seconds
+
+
+def _day_seconds(day: str) -> int:
+    return (datetime.strptime(day, "%Y-%m-%d") - _EPOCH).days * 86400
+
+
+class StringTable:
+    """只追加的字符串表，编码即行号；界面、导出和后台压缩线程可以同时使用"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self.strings: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self._size = 0  # 已读取的字节数
+
+    def refresh(self):
+        """读取其他实例追加的字符串；末尾未写完的行留到下次"""
+        with self._lock:
+            try:
+                with open(self.path, 'rb') as f:
+                    f.seek(self._size)
+                    data = f.read()
+            except OSError:
+                return
+            end = data.rfind(b'\n') + 1
+            for line in data[:end].splitlines():
+                value = json.loads(line.decode('utf-8'))
+                self._codes.setdefault(value, len(self.strings))
+                self.strings.append(value)
+            self._size += end
+
+    def intern_many(self, values: Iterable[str]) -> Dict[str, int]:
+        """返回 {字符串: 编码}，新字符串追加到表末尾"""
+        with self._lock:
+            self.refresh()
+            new_values = [value for value in dict.fromkeys(values) if value not in self._codes]
+            if new_values:
+                with open(self.path, 'ab') as f:
+                    # 截掉中断时留下的半行，保证行号与编码一致
+                    f.truncate(self._size)
+                    f.write(b''.join(json.dumps(value, ensure_ascii=False).encode('utf-8') + b'\n'
+                                     for value in new_values))
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.refresh()
+            return self._codes
+
+
+_string_tables: Dict[str, StringTable] = {}
+_string_tables_lock = threading.Lock()
+
+
+def string_table(path: str) -> StringTable:
+    path = os.path.abspath(path)
+    with _string_tables_lock:
+        table = _string_tables.get(path)
+        if table is None:
+            table = _string_tables[path] = StringTable(path)
+        return table
+
+
+def _read_header(buffer) -> Tuple[dict, int]:
+    """返回 (文件头, 第一条记录的位置)"""
+    if bytes(buffer[:len(_MAGIC)]) != _MAGIC:
+        raise ValueError("不是二进制归档文件")
+    (length,) = _LENGTH.unpack_from(buffer, len(_MAGIC))
+    start = len(_MAGIC) + _LENGTH.size
+    header = json.loads(bytes(buffer[start:start + length]).decode('utf-8'))
+    data_offset = (start + length + 7) // 8 * 8
+    return header, data_offset
+
+
+def write_binlog(path: str, records: List[EventRecord], sources: List[list], table_path: str):
+    """把事件按时间排序后整体写入二进制归档文件"""
+    records = sorted(records, key=lambda record: record[3])
+    table = string_table(table_path)
+    codes = table.intern_many(value for record in records for value in (record[0], record[1], record[4]))
+    header = json.dumps({"rows": len(records), "sources": sources,
+                         "strings": os.path.relpath(table.path, os.path.dirname(os.path.abspath(path)))},
+                        ensure_ascii=False).encode('utf-8')
+    prefix = _MAGIC + _LENGTH.pack(len(header)) + header
+    prefix += b'\0' * (-len(prefix) % 8)
+
+    body = bytearray(_RECORD.size * len(records))
+    for row, (student_id, event_name, score_change, timestamp, event_type) in enumerate(records):
+        _RECORD.pack_into(body, row * _RECORD.size, _to_seconds(timestamp),
+                          codes[student_id], codes[event_name], score_change, codes[event_type])
+    tmp_path = temp_path(path)
+    with open(tmp_path, 'wb') as f:
+        f.write(prefix)
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    replace_file(tmp_path, path)
+
+
+class _MappedLog:
+    """打开并映射一个二进制归档文件，用完即关闭（Windows 下映射中的文件不能被替换）"""
+
+    def __init__(self, path: str):
+        self._file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise
+        self.header, self.data_offset = _read_header(self.map)
+        self.rows = self.header["rows"]
+        table_path = os.path.join(os.path.dirname(os.path.abspath(path)), self.header["strings"])
+        table = string_table(table_path)
+        table.refresh()
+        self.strings = table.strings
+
+    def close(self):
+        self.map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def seconds_at(self, row: int) -> int:
+        return _RECORD.unpack_from(self.map, self.data_offset + row * _RECORD.size)[0]
+
+    def bisect(self, seconds: int) -> int:
+        """第一条时间戳不早于 seconds 的记录的行号"""
+        lo, hi = 0, self.rows
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.seconds_at(mid) < seconds:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def record(self, row: int) -> EventRecord:
+        seconds, student, name, score_change, event_type = _RECORD.unpack_from(
+            self.map, self.data_offset + row * _RECORD.size)
+        strings = self.strings
+        return (strings[student], strings[name], score_change,
+                (_EPOCH + timedelta(seconds=seconds)).strftime(_TIMESTAMP_FORMAT), strings[event_type])
+
+
+def binlog_sources(path: str) -> List[list]:
+    with _MappedLog(path) as log:
+        return log.header["sources"]
+
+
+def iter_binlog(path: str, start_row: int = 0, start_date: str = None,
+                end_date: str = None) -> Iterator[Tuple[int, EventRecord]]:
+    """按时间顺序给出 (行号, 记录)；指定日期范围时先二分查找起止行，只解包范围内的记录"""
+    with _MappedLog(path) as log:
+        first, last = start_row, log.rows
+        if start_date:
+            first = max(first, log.bisect(_day_seconds(start_date)))
+        if end_date:
+            last = log.bisect(_day_seconds(end_date) + 86400)
+        if first >= last:
+            return
+        strings = log.strings
+        view = memoryview(log.map)
+        rows = _RECORD.iter_unpack(view[log.data_offset + first * _RECORD.size:
+                                         log.data_offset + last * _RECORD.size])
+        try:
+            # 同一天的日期部分只格式化一次
+            day_strings = {}
+            for row, (seconds, student, name, score_change, event_type) in enumerate(rows, first):
+                days, seconds = divmod(seconds, 86400)
+                day = day_strings.get(days)
+                if day is None:
+                    day = day_strings[days] = (_EPOCH + timedelta(days=days)).strftime("%Y-%m-%d")
+                hours, seconds = divmod(seconds, 3600)
+                minutes, seconds = divmod(seconds, 60)
+                yield row, (strings[student], strings[name], score_change,
+                            f"{day} {hours:02d}:{minutes:02d}:{seconds:02d}", strings[event_type])
+        finally:
+            # 先释放对映射的引用，映射才能关闭
+            del rows
+            view.release()
+
+
+def _descending_order(times: array) -> List[int]:
+    """按时间正序排列的行改为时间倒序、同一时间保持原顺序时的行号"""
+    order = []
+    end = len(times)
+    for length in reversed([len(list(group)) for _, group in itertools.groupby(times)]):
+        order.extend(range(end - length, end))
+        end -= length
+    return order
+
+
+def read_binlog_columns(path: str, start_date: str = None, end_date: str = None,
+                        descending: bool = False) -> EventColumns:
+    """
+    读取日期范围内的记录，直接返回 EventBatch 的列（编码为字符串表 strings 中的下标），不逐行解包和格式化
+    定长记录的各字段在映射上按步长切片后整体复制到 array；descending 时按时间倒序、同一时间保持原顺序
+    """
+    with _MappedLog(path) as log:
+        first, last = 0, log.rows
+        if start_date:
+            first = log.bisect(_day_seconds(start_date))
+        if end_date:
+            last = log.bisect(_day_seconds(end_date) + 86400)
+        last = max(first, last)
+        view = memoryview(log.map)[log.data_offset + first * _RECORD.size:log.data_offset + last * _RECORD.size]
+        # <qIIiI 每条记录为 3 个 8 字节字或 6 个 4 字节字
+        quads, words, ints = view.cast('q'), view.cast('I'), view.cast('i')
+        try:
+            columns = (array('q', quads[0::3].tobytes()), array('i', words[2::6].tobytes()),
+                       array('i', words[3::6].tobytes()), array('i', words[5::6].tobytes()),
+                       array('i', ints[4::6].tobytes()))
+        finally:
+            for buffer in (quads, words, ints, view):
+                buffer.release()
+        strings = log.strings
+    if sys.byteorder == 'big':
+        for column in columns:
+            column.byteswap()
+    seconds, students, names, types, score_changes = columns
+    score_changes = array('q', score_changes)
+    times = array('q', map(_EPOCH_TIME.__add__, seconds))
+    if descending:
+        order = _descending_order(seconds)
+        students, names, types, score_changes, times = (
+            array(column.typecode, map(column.__getitem__, order))
+            for column in (students, names, types, score_changes, times))
+    return EventColumns(strings, students, names, types, score_changes, times, {})
+
+
+def read_binlog_at(path: str, rows: Iterable[int]) -> List[EventRecord]:
+    with _MappedLog(path) as log:
+        return [log.record(row) for row in rows if 0 <= row < log.rows]
@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import threading
+from array import array
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from database_lock import replace_file, temp_path
+
+# 积分事件的列式归档格式
+# 已经结束的分区由 database.compact_score_events 按月合并为 score_events_YYYY-MM.col：
+#   第一行: SMCOL1 + 空格 + JSON 头 {"rows": 行数, "sources": [[来源分区, [大小, mtime]], ...],
+#           "dicts": {列名: [取值, ...]}}
+#   其后依次为各列的小端二进制数组: 学号、事件名称、事件类型的字典编码 (int32)，
+#   积分变化 (int64)，时间戳 (int64，1970-01-01 00:00:00 起的秒数，不涉及时区)
+# 文件只会整体改写，不会追加。分区索引中记录的"偏移"对列式文件来说就是行号。
+
+COLUMNAR_SUFFIX = '.col'
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+_MAGIC = b'SMCOL1 '
+_CODE_COLUMNS = ('student_id', 'event_name', 'event_type')
+_EPOCH = datetime(1970, 1, 1)
+
+# 积分事件记录: (student_id, event_name, score_change, timestamp, event_type)
+EventRecord = Tuple[str, str, int, str, str]
+
+
+def is_columnar(path: str) -> bool:
+    return path.endswith(COLUMNAR_SUFFIX)
+
+
+def encode_timestamp(timestamp: str) -> int:
+    """时间戳字符串转换为秒数，无法原样还原的格式抛出 ValueError"""
+    delta = datetime.strptime(timestamp, TIMESTAMP_FORMAT) - _EPOCH
+    seconds = delta.days * 86400 + delta.seconds
+    if decode_timestamp(seconds) != timestamp:
+        raise ValueError(f"时间戳格式不规范: {timestamp}")
+    return seconds
+
+
+def decode_timestamp(seconds: int) -> str:
+    return (_EPOCH + timedelta(seconds=seconds)).strftime(TIMESTAMP_FORMAT)
+
+
+def _to_little_endian(values: array) -> bytes:
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian(typecode: str, data: bytes) -> array:
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+class ColumnarPartition:
+    """一个列式分区文件的内容，各列保存为数组，只在取出记录时才解码为字符串"""
+
+    __slots__ = ('sources', 'dicts', 'codes', 'scores', 'times')
+
+    def __init__(self, sources: List[list], dicts: Dict[str, List[str]], codes: Dict[str, array],
+                 scores: array, times: array):
+        self.sources = sources
+        self.dicts = dicts
+        self.codes = codes
+        self.scores = scores
+        self.times = times
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    @classmethod
+    def load(cls, path: str) -> 'ColumnarPartition':
+        with open(path, 'rb') as f:
+            first_line = f.readline()
+            if not first_line.startswith(_MAGIC):
+                raise ValueError(f"不是列式分区文件: {path}")
+            header = json.loads(first_line[len(_MAGIC):].decode('utf-8'))
+            rows = header["rows"]
+            codes = {column: _from_little_endian('i', f.read(4 * rows)) for column in _CODE_COLUMNS}
+            scores = _from_little_endian('q', f.read(8 * rows))
+            times = _from_little_endian('q', f.read(8 * rows))
+        if len(times) != rows:
+            raise ValueError(f"列式分区文件不完整: {path}")
+        return cls(header["sources"], header["dicts"], codes, scores, times)
+
+    @classmethod
+    def from_records(cls, records: List[EventRecord], sources: List[list]) -> 'ColumnarPartition':
+        """由事件记录构建，记录按时间戳排序（时间相同的保持原顺序）"""
+        records = sorted(records, key=lambda record: record[3])
+        dicts = {column: [] for column in _CODE_COLUMNS}
+        lookups = {column: {} for column in _CODE_COLUMNS}
+        codes = {column: array('i') for column in _CODE_COLUMNS}
+        scores, times = array('q'), array('q')
+        for student_id, event_name, score_change, timestamp, event_type in records:
+            for column, value in zip(_CODE_COLUMNS, (student_id, event_name, event_type)):
+                code = lookups[column].get(value)
+                if code is None:
+                    code = lookups[column][value] = len(dicts[column])
+                    dicts[column].append(value)
+                codes[column].append(code)
+            scores.append(score_change)
+            times.append(encode_timestamp(timestamp))
+        return cls(list(sources), dicts, codes, scores, times)
+
+    def save(self, path: str):
+        header = {"rows": len(self), "sources": self.sources, "dicts": self.dicts}
+        tmp_path = temp_path(path)
+        with open(tmp_path, 'wb') as f:
+            f.write(_MAGIC + json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n')
+            for column in _CODE_COLUMNS:
+                f.write(_to_little_endian(self.codes[column]))
+            f.write(_to_little_endian(self.scores))
+            f.write(_to_little_endian(self.times))
+            f.flush()
+            os.fsync(f.fileno())
+        replace_file(tmp_path, path)
+
+    def _decoded(self, strings: Optional[Dict[str, str]]) -> List[List[str]]:
+        """各字典列的取值；给出 strings 时与其他分区共用相同的字符串对象"""
+        if strings is None:
+            return [self.dicts[column] for column in _CODE_COLUMNS]
+        return [[strings.setdefault(value, value) for value in self.dicts[column]] for column in _CODE_COLUMNS]
+
+    def records(self, start: int = 0, strings: Optional[Dict[str, str]] = None) -> Iterator[Tuple[int, EventRecord]]:
+        """按行号顺序给出 (行号, 记录)，同一文件中相同的学号、名称和类型是同一个字符串对象"""
+        students, names, types = self._decoded(strings)
+        student_codes, name_codes, type_codes = (self.codes[column] for column in _CODE_COLUMNS)
+        scores, times = self.scores, self.times
+        # 同一天的日期部分只格式化一次
+        day_strings = {}
+        for row in range(start, len(scores)):
+            days, seconds = divmod(times[row], 86400)
+            day = day_strings.get(days)
+            if day is None:
+                day = day_strings[days] = (_EPOCH + timedelta(days=days)).strftime("%Y-%m-%d")
+            hours, seconds = divmod(seconds, 3600)
+            minutes, seconds = divmod(seconds, 60)
+            yield row, (students[student_codes[row]], names[name_codes[row]], scores[row],
+                        f"{day} {hours:02d}:{minutes:02d}:{seconds:02d}", types[type_codes[row]])
+
+    def records_at(self, rows: List[int], strings: Optional[Dict[str, str]] = None) -> List[EventRecord]:
+        students, names, types = self._decoded(strings)
+        student_codes, name_codes, type_codes = (self.codes[column] for column in _CODE_COLUMNS)
+        result = []
+        for row in rows:
+            if 0 <= row < len(self.scores):
+                result.append((students[student_codes[row]], names[name_codes[row]], self.scores[row],
+                               decode_timestamp(self.times[row]), types[type_codes[row]]))
+        return result
+
+
+# 已加载的列式分区 {路径: ((大小, mtime), 内容)}，文件改写后自动重新加载
+# 界面、导出和后台压缩线程共用，读写都在 _loaded_lock 内进行（加载文件本身不持有锁）
+_loaded: Dict[str, Tuple[Tuple[int, int], ColumnarPartition]] = {}
+_loaded_lock = threading.Lock()
+_MAX_LOADED = 32
+
+
+def load_partition(path: str) -> Optional[ColumnarPartition]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    signature = (stat.st_size, stat.st_mtime_ns)
+    with _loaded_lock:
+        cached = _loaded.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+    partition = ColumnarPartition.load(path)
+    with _loaded_lock:
+        _loaded.pop(path, None)
+        while _loaded and len(_loaded) >= _MAX_LOADED:
+            _loaded.pop(next(iter(_loaded)))
+        _loaded[path] = (signature, partition)
+    return partition
@@ -0,0 +1,171 @@
+from array import array
+from itertools import compress
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Union
+
+# 事件记录与批量事件容器
+# 所有事件查询（积分事件、兑换事件、每日任务事件）都返回 Event，批量结果为 EventBatch。
+
+
+class Event(NamedTuple):
+    """单条事件记录（NamedTuple 没有实例字典），仍可以按 (学号, 名称, 积分变化, 时间, 类型) 解包"""
+    student_id: str
+    event_name: str
+    score_change: int
+    timestamp: str
+    event_type: str
+
+
+def _encode_timestamp(timestamp: str) -> Optional[int]:
+    """把 YYYY-MM-DD HH:MM:SS 转换为秒数，其他格式返回 None（按原字符串保存）"""
+    digits = (timestamp[0:4] + timestamp[5:7] + timestamp[8:10] +
+              timestamp[11:13] + timestamp[14:16] + timestamp[17:19])
+    if (len(timestamp) != 19 or timestamp[4] != '-' or timestamp[7] != '-' or timestamp[10] != ' '
+            or timestamp[13] != ':' or timestamp[16] != ':' or not (digits.isascii() and digits.isdigit())):
+        return None
+    hours, minutes, seconds = int(timestamp[11:13]), int(timestamp[14:16]), int(timestamp[17:19])
+    if hours > 23 or minutes > 59 or seconds > 59:
+        return None
+    try:
+        day = date(int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10])).toordinal()
+    except ValueError:
+        return None
+    return day * 86400 + hours * 3600 + minutes * 60 + seconds
+
+
+# 无法编码的时间戳在时间列中的占位值
+RAW_TIMESTAMP = -1
+
+
+class EventColumns(NamedTuple):
+    """
+    EventBatch 的原始列，学号、名称、类型列的编码都是 strings 中的下标
+    times 为 日序号*86400+秒数，等于 RAW_TIMESTAMP 的行的原始时间戳保存在 raw_times 中
+    """
+    strings: List[str]
+    student_codes: array
+    name_codes: array
+    type_codes: array
+    score_changes: array
+    times: array
+    raw_times: Dict[int, str]
+
+
+class EventBatch:
+    """
+    按列保存的一批事件：学号、名称、类型为字典编码 (array 'i')，积分变化和时间戳为 array 'q'，
+    只有在按下标或迭代访问时才生成 Event。可以像列表一样使用（len、下标、切片、迭代、比较）。
+    """
+
+    __slots__ = ('_strings', '_codes', '_students', '_names', '_types', '_scores', '_times',
+                 '_raw_times', '_day_strings')
+
+    def __init__(self, events: Iterable[Iterable] = ()):
+        self._strings: List[str] = []
+        self._codes: Dict[str, int] = {}
+        self._students = array('i')
+        self._names = array('i')
+        self._types = array('i')
+        self._scores = array('q')
+        self._times = array('q')
+        self._raw_times: Dict[int, str] = {}
+        self._day_strings: Dict[int, str] = {}
+        self.extend(events)
+
+    def _code(self, value: str) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self._strings)
+            self._strings.append(value)
+        return code
+
+    def append(self, event: Iterable):
+        student_id, event_name, score_change, timestamp, event_type = event
+        seconds = _encode_timestamp(timestamp)
+        if seconds is None:
+            self._raw_times[len(self._scores)] = timestamp
+            seconds = RAW_TIMESTAMP
+        self._students.append(self._code(student_id))
+        self._names.append(self._code(event_name))
+        self._types.append(self._code(event_type))
+        self._scores.append(score_change)
+        self._times.append(seconds)
+
+    def extend(self, events: Iterable[Iterable]):
+        for event in events:
+            self.append(event)
+
+    def extend_columns(self, columns: EventColumns, keep: Optional[Iterable[bool]] = None):
+        """
+        追加另一组列（编码按本批次的字符串重新映射），不逐行生成 Event
+        keep 为与各行对应的布尔序列时只追加其中为真的行
+        """
+        code_columns = (columns.student_codes, columns.name_codes, columns.type_codes)
+        score_changes, times, raw_times = columns.score_changes, columns.times, columns.raw_times
+        if keep is not None:
+            keep = list(keep)
+            code_columns = [array('i', compress(column, keep)) for column in code_columns]
+            score_changes, times = array('q', compress(score_changes, keep)), array('q', compress(times, keep))
+            if raw_times:
+                raw_times = {kept: raw_times[row] for kept, row in enumerate(compress(range(len(keep)), keep))
+                             if row in raw_times}
+        strings = columns.strings
+        base = len(self._scores)
+        for column, target in zip(code_columns, (self._students, self._names, self._types)):
+            remap = {code: self._code(strings[code]) for code in set(column)}
+            target.extend(map(remap.__getitem__, column))
+        self._scores.extend(score_changes)
+        self._times.extend(times)
+        for row, timestamp in raw_times.items():
+            self._raw_times[base + row] = timestamp
+
+    def __len__(self) -> int:
+        return len(self._scores)
+
+    def _timestamp(self, row: int) -> str:
+        seconds = self._times[row]
+        if seconds == RAW_TIMESTAMP:
+            return self._raw_times[row]
+        days, seconds = divmod(seconds, 86400)
+        day = self._day_strings.get(days)
+        if day is None:
+            day = self._day_strings[days] = date.fromordinal(days).isoformat()
+        hours, seconds = divmod(seconds, 3600)
+        minutes, seconds = divmod(seconds, 60)
+        return f"{day} {hours:02d}:{minutes:02d}:{seconds:02d}"
+
+    def _event(self, row: int) -> Event:
+        strings = self._strings
+        return Event(strings[self._students[row]], strings[self._names[row]], self._scores[row],
+                     self._timestamp(row), strings[self._types[row]])
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Event, List[Event]]:
+        if isinstance(index, slice):
+            return [self._event(row) for row in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("EventBatch index out of range")
+        return self._event(index)
+
+    def __iter__(self) -> Iterator[Event]:
+        for row in range(len(self)):
+            yield self._event(row)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (EventBatch, list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"EventBatch({list(self)!r})"
+
+    # 按列访问，不生成 Event
+    def columns(self) -> EventColumns:
+        """原始列数据，供统计计算直接使用，调用方不得修改"""
+        return EventColumns(self._strings, self._students, self._names, self._types, self._scores,
+                            self._times, self._raw_times)
+
+    @property
+    def score_changes(self) -> array:
+        return self._scores
@@ -0,0 +1,917 @@
+import os
+import re
+import csv
+import json
+import heapq
+import bisect
+import hashlib
+import calendar
+import threading
+from array import array
+from contextlib import contextmanager
+from datetime import date, timedelta
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from database_binlog import binlog_sources, is_binlog, iter_binlog, read_binlog_at
+from database_columnar import is_columnar, load_partition
+from database_lock import temp_path
+
+# 积分事件分区的二级索引
+# 每个分区（score_events 目录下的一个事件文件）对应一份摘要，例如 {学号: [字节偏移, ...]}。
+# 索引持久化为 JSON 快照 + JSON Lines 追加日志：追加事件时只写一行日志，
+# 日志过长时再合并为快照。查询前按分区文件的 (大小, mtime) 校验，
+# 文件只增长时只索引新增部分，被改写时重建该分区的摘要。
+# 共用数据目录的多个程序实例写同一份日志和快照，只能在持有数据目录写锁时写入；
+# 读取时发现的变更在拿不到写锁（其他线程或实例正在写入）时只更新内存中的摘要，读取不等待写锁。
+
+EVENT_HEADERS = ["student_id", "event_name", "score_change", "timestamp", "event_type"]
+
+# 积分事件记录: (student_id, event_name, score_change, timestamp, event_type)
+EventRecord = Tuple[str, str, int, str, str]
+
+
+def _row_parser(header: List[str],
+                strings: Optional[Dict[str, str]] = None) -> Callable[[List[str]], Optional[EventRecord]]:
+    """
+    根据标题行生成行解析函数，兼容没有 event_type 列的旧格式文件
+    学号、事件名称和事件类型通过 strings 字典去重，同一次读取中相同的字符串只保留一个对象；
+    strings 省略时每次读取使用各自的字典
+    """
+    intern = (strings if strings is not None else {}).setdefault
+    if all(h in header for h in EVENT_HEADERS):
+        sid_i, name_i, change_i, ts_i, type_i = (header.index(h) for h in EVENT_HEADERS)
+        width = max(sid_i, name_i, change_i, ts_i, type_i)
+
+        def parse(row):
+            if len(row) > width:
+                sid, name, evt_type = row[sid_i], row[name_i], row[type_i]
+                return (intern(sid, sid), intern(name, name), int(row[change_i]), row[ts_i],
+                        intern(evt_type, evt_type))
+            return None
+    else:
+        score_type = intern("score", "score")  # 默认为score类型
+
+        def parse(row):
+            if len(row) >= 4:
+                sid, name = row[0], row[1]
+                return (intern(sid, sid), intern(name, name), int(row[2]), row[3], score_type)
+            return None
+    return parse
+
+
+def iter_events_with_offsets(path: str, start_offset: int = 0,
+                             strings: Optional[Dict[str, str]] = None) -> Iterator[Tuple[int, EventRecord]]:
+    """
+    按文件顺序读取分区中的事件，同时给出每条记录在文件中的字节偏移（列式分区为行号）
+    strings 为字符串去重字典，读取多个分区时传入同一个字典可使各分区共用相同的字符串对象
+    """
+    if is_columnar(path):
+        partition = load_partition(path)
+        if partition is not None:
+            yield from partition.records(start_offset, strings)
+        return
+    if is_binlog(path):
+        yield from iter_binlog(path, start_offset)
+        return
+    with open(path, 'rb') as f:
+        position = [0]
+
+        def lines():
+            for raw in f:
+                position[0] += len(raw)
+                yield raw.decode('utf-8')
+
+        reader = csv.reader(lines())
+        header = next(reader, None)
+        if header is None:
+            return
+        parse = _row_parser(header, strings)
+        if start_offset > position[0]:
+            f.seek(start_offset)
+            position[0] = start_offset
+            reader = csv.reader(lines())
+
+        while True:
+            offset = position[0]
+            row = next(reader, None)
+            if row is None:
+                return
+            try:
+                record = parse(row)
+            except ValueError:
+                continue
+            if record is not None:
+                yield offset, record
+
+
+def read_events_at(path: str, offsets: Iterable[int], strings: Optional[Dict[str, str]] = None) -> List[EventRecord]:
+    """按字节偏移（列式分区为行号）直接读取分区中的若干条事件，不解析其他行"""
+    if is_columnar(path):
+        partition = load_partition(path)
+        return partition.records_at(list(offsets), strings) if partition is not None else []
+    if is_binlog(path):
+        return read_binlog_at(path, offsets)
+    events = []
+    with open(path, 'rb') as f:
+        header = next(csv.reader([f.readline().decode('utf-8')]), [])
+        parse = _row_parser(header, strings)
+        for offset in offsets:
+            f.seek(offset)
+            row = next(csv.reader([f.readline().decode('utf-8')]), None)
+            record = parse(row) if row else None
+            if record is not None:
+                events.append(record)
+    return events
+
+
+def iter_events_between(path: str, start_date: str = None, end_date: str = None,
+                        strings: Optional[Dict[str, str]] = None) -> Iterator[EventRecord]:
+    """
+    读取分区中可能落在日期范围内的事件：二进制归档按时间排序，先二分查找起止位置；
+    其他格式读取整个分区，由调用方逐行检查日期
+    """
+    if is_binlog(path):
+        return (record for _, record in iter_binlog(path, 0, start_date, end_date))
+    return (record for _, record in iter_events_with_offsets(path, 0, strings))
+
+
+def is_archive(path: str) -> bool:
+    """是否为压缩后的归档分区（列式或二进制），归档分区只整体改写，不追加"""
+    return is_columnar(path) or is_binlog(path)
+
+
+def archive_sources(path: str) -> List[list]:
+    """归档分区的来源分区 [[分区名, [大小, mtime]], ...]"""
+    if is_binlog(path):
+        return binlog_sources(path)
+    partition = load_partition(path)
+    return partition.sources if partition is not None else []
+
+
+class _Descending:
+    """反转比较顺序的包装，用于让 heapq 的最小堆按时间戳从新到旧弹出"""
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return self.value > other.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def merge_partitions_by_time(partitions: List[Tuple[str, str, Callable[[], List[EventRecord]]]],
+                             descending: bool = True) -> Iterator[EventRecord]:
+    """
+    按时间戳对多个分区的事件做 k 路归并
+    partitions 为 [(起始日期, 结束日期, 读取函数), ...]，按起始日期排序；读取函数返回该分区中按时间戳
+    排好序（降序时从新到旧）的事件。时间戳相同的事件按分区顺序、分区内顺序输出。
+    分区只在当前最先输出的事件落入其日期范围时才被读取，调用方提前停止迭代时剩余分区不会被读取。
+    """
+    if descending:
+        # 按结束日期从晚到早打开分区
+        pending = sorted(range(len(partitions)), key=lambda rank: partitions[rank][1], reverse=True)
+        key = _Descending
+    else:
+        pending = sorted(range(len(partitions)), key=lambda rank: partitions[rank][0])
+        key = str
+    heap = []
+    position = 0
+    while True:
+        # 下一个待打开的分区可能含有比堆顶更靠前的事件时先打开它
+        while position < len(pending):
+            rank = pending[position]
+            start, end, load = partitions[rank]
+            if heap:
+                top_day = heap[0][3][heap[0][2]][3][:10]
+                if (end < top_day) if descending else (start > top_day):
+                    break
+            position += 1
+            events = load()
+            if events:
+                heapq.heappush(heap, (key(events[0][3]), rank, 0, events))
+        if not heap:
+            return
+        _, rank, index, events = heap[0]
+        yield events[index]
+        index += 1
+        if index < len(events):
+            heapq.heapreplace(heap, (key(events[index][3]), rank, index, events))
+        else:
+            heapq.heappop(heap)
+
+
+def _signature(path: str) -> Optional[List[int]]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+@contextmanager
+def _try_dir_lock(dir_lock) -> Iterator[bool]:
+    """不等待地获取数据目录写锁 (database_lock.DataDirLock)，给出是否获得"""
+    try:
+        dir_lock.acquire(timeout=0)
+    except (TimeoutError, OSError):
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        dir_lock.release()
+
+
+def _tail_fingerprint(path: str, size: int) -> str:
+    """已索引部分最后32字节的内容，用于区分文件只是增长还是被改写后变长"""
+    with open(path, 'rb') as f:
+        f.seek(max(0, size - 32))
+        return f.read(min(size, 32)).hex()
+
+
+class PartitionIndex:
+    """
+    按分区维护的持久化摘要，可被写入线程和读取线程（例如后台导出）同时使用
+    summarize(events) 把 [(偏移, 事件记录), ...] 汇总为可 JSON 序列化的字典，
+    merge(old, new) 返回把新增部分合并进已有摘要后的新摘要，不修改 old：
+    get() 返回的摘要在锁外被读取，合并时不能原地修改。
+    dir_lock 为数据目录写锁，写日志和快照时必须持有
+    """
+
+    SNAPSHOT_INTERVAL = 500
+
+    def __init__(self, index_dir: str, name: str,
+                 summarize: Callable[[Iterable[Tuple[int, EventRecord]]], dict],
+                 merge: Callable[[dict, dict], dict], dir_lock):
+        self.snapshot_path = os.path.join(index_dir, f"{name}.json")
+        self.journal_path = os.path.join(index_dir, f"{name}.journal")
+        self._summarize = summarize
+        self._merge = merge
+        self._dir_lock = dir_lock
+        self._lock = threading.RLock()
+        # {分区名: {"sig": [大小, mtime], "tail": 末尾指纹, "data": 摘要}}
+        self._entries: Optional[Dict[str, dict]] = None
+        self._journal_lines = 0
+
+    # 持久化
+    def _load(self):
+        entries = {}
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+        lines = 0
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        continue  # 未写完的行
+                    self._apply(entries, change)
+                    lines += 1
+        except OSError:
+            pass
+        self._entries = entries
+        self._journal_lines = lines
+
+    def _apply(self, entries: Dict[str, dict], change: dict):
+        partition = change["p"]
+        if change["op"] == "drop":
+            entries.pop(partition, None)
+        elif change["op"] == "merge":
+            # 只合并到计算时所基于的摘要上；共用数据目录的另一个实例可能已经记录了同一段新增内容的合并，
+            # 基准不符时跳过，摘要停留在旧的签名上，由 get() 按文件重新补齐
+            entry = entries.get(partition)
+            if entry is not None and entry["sig"] == change.get("base"):
+                entries[partition] = {"sig": change["sig"], "tail": change["tail"],
+                                      "data": self._merge(entry["data"], change["data"])}
+        else:
+            entries[partition] = {"sig": change["sig"], "tail": change["tail"], "data": change["data"]}
+
+    def _record(self, change: dict, journal: bool = True):
+        """应用一项变更；journal 为 True 时（调用方持有数据目录写锁）同时写入日志"""
+        self._apply(self._entries, change)
+        if not journal:
+            return
+        os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(change, ensure_ascii=False, separators=(',', ':')) + '\n')
+        self._journal_lines += 1
+        if self._journal_lines >= self.SNAPSHOT_INTERVAL:
+            self.save_snapshot()
+
+    def save_snapshot(self):
+        """调用方持有数据目录写锁"""
+        with self._lock:
+            if self._entries is None:
+                return
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+            tmp_path = temp_path(self.snapshot_path)
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.snapshot_path)
+            open(self.journal_path, 'w').close()
+            self._journal_lines = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._entries = None
+            self._journal_lines = 0
+
+    def fingerprint(self) -> str:
+        """当前已加载的各分区摘要的指纹，任何分区的摘要变化都会改变指纹"""
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            digest = hashlib.sha1()
+            for partition in sorted(self._entries):
+                digest.update(f"{partition}:{self._entries[partition]['sig']}:{self._entries[partition]['tail']};"
+                              .encode('utf-8'))
+            return digest.hexdigest()
+
+    # 查询与更新
+    def get(self, partitions: Dict[str, str], prune: bool = False) -> Dict[str, dict]:
+        """
+        partitions 为 {分区名: 文件路径}，校验后返回 {分区名: 摘要}
+        prune 为 True 表示 partitions 是全部分区，同时清除已不存在的分区的摘要
+        返回的摘要不得被调用方修改
+        需要更新摘要时不等待地获取数据目录写锁，拿到时写入日志，否则只更新内存中的摘要
+        """
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            result = self._current(partitions, prune)
+            if result is not None:
+                return result
+        with _try_dir_lock(self._dir_lock) as journal, self._lock:
+            if self._entries is None:
+                self._load()
+            if prune:
+                for partition in [p for p in self._entries if p not in partitions]:
+                    self._record({"p": partition, "op": "drop"}, journal)
+
+            result = {}
+            for partition, path in partitions.items():
+                entry = self._entries.get(partition)
+                sig = _signature(path)
+                if sig is None:
+                    continue
+                if entry is not None and sig == entry["sig"]:
+                    pass
+                elif (entry is not None and sig[0] > entry["sig"][0]
+                      and _tail_fingerprint(path, entry["sig"][0]) == entry["tail"]):
+                    # 文件只是增长了（例如其他程序追加），只索引新增部分
+                    self._record({"p": partition, "op": "merge", "base": entry["sig"], "sig": sig,
+                                  "tail": _tail_fingerprint(path, sig[0]),
+                                  "data": self._summarize(iter_events_with_offsets(path, entry["sig"][0]))},
+                                 journal)
+                else:
+                    # 新分区或文件被改写，重建整个分区的摘要
+                    self._record({"p": partition, "op": "replace", "sig": sig,
+                                  "tail": _tail_fingerprint(path, sig[0]),
+                                  "data": self._summarize(iter_events_with_offsets(path))}, journal)
+                result[partition] = self._entries[partition]["data"]
+            return result
+
+    def _current(self, partitions: Dict[str, str], prune: bool) -> Optional[Dict[str, dict]]:
+        """各分区的摘要都与文件一致时返回 {分区名: 摘要}，否则返回 None"""
+        if prune and any(partition not in partitions for partition in self._entries):
+            return None
+        result = {}
+        for partition, path in partitions.items():
+            sig = _signature(path)
+            if sig is None:
+                continue
+            entry = self._entries.get(partition)
+            if entry is None or entry["sig"] != sig:
+                return None
+            result[partition] = entry["data"]
+        return result
+
+    def note_append(self, partition: str, path: str, start_offset: int, events: List[Tuple[int, EventRecord]]):
+        """追加事件后增量更新，调用方持有数据目录写锁；如果索引与文件已不同步，则留给下次 get() 处理"""
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            entry = self._entries.get(partition)
+            sig = _signature(path)
+            if sig is None:
+                return
+            if entry is None and start_offset == 0:
+                op = "replace"
+            elif entry is not None and entry["sig"][0] == start_offset:
+                op = "merge"
+            else:
+                return
+            change = {"p": partition, "op": op, "sig": sig, "tail": _tail_fingerprint(path, sig[0]),
+                      "data": self._summarize(events)}
+            if op == "merge":
+                change["base"] = entry["sig"]
+            self._record(change)
+
+
+# 各类索引的摘要函数
+def summarize_postings_by_student(events: Iterable[Tuple[int, EventRecord]]) -> Dict[str, List[int]]:
+    """{学号: [字节偏移, ...]}"""
+    postings = {}
+    for offset, record in events:
+        postings.setdefault(record[0], []).append(offset)
+    return postings
+
+
+def merge_postings(old: Dict[str, List[int]], new: Dict[str, List[int]]) -> Dict[str, List[int]]:
+    merged = dict(old)
+    for key, offsets in new.items():
+        merged[key] = merged.get(key, []) + offsets
+    return merged
+
+
+def summarize_daily_rollups(events: Iterable[Tuple[int, EventRecord]]) -> Dict[str, Dict[str, Dict[str, List[int]]]]:
+    """{日期: {学号: {事件类型: [积分变化合计, 事件数]}}}"""
+    rollups = {}
+    for _, (student_id, _, score_change, timestamp, event_type) in events:
+        totals = rollups.setdefault(timestamp[:10], {}).setdefault(student_id, {}).setdefault(event_type, [0, 0])
+        totals[0] += score_change
+        totals[1] += 1
+    return rollups
+
+
+def merge_daily_rollups(old: dict, new: dict) -> dict:
+    merged = dict(old)
+    for day, students in new.items():
+        merged_students = merged[day] = dict(merged.get(day, {}))
+        for student_id, types in students.items():
+            merged_types = merged_students[student_id] = dict(merged_students.get(student_id, {}))
+            for event_type, (net, count) in types.items():
+                old_net, old_count = merged_types.get(event_type, (0, 0))
+                merged_types[event_type] = [old_net + net, old_count + count]
+    return merged
+
+
+def name_bigrams(text: str) -> set:
+    """小写后的相邻两字符集合，不足两个字符时为空"""
+    text = text.lower()
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def summarize_name_grams(events: Iterable[Tuple[int, EventRecord]]) -> Dict[str, dict]:
+    """{"names": {事件名称: [字节偏移, ...]}, "grams": {二元字符组: [事件名称, ...]}}"""
+    names = {}
+    for offset, record in events:
+        names.setdefault(record[1], []).append(offset)
+    grams = {}
+    for name in names:
+        for gram in name_bigrams(name):
+            grams.setdefault(gram, []).append(name)
+    return {"names": names, "grams": grams}
+
+
+def merge_name_grams(old: dict, new: dict) -> dict:
+    names, grams = dict(old["names"]), dict(old["grams"])
+    for name, offsets in new["names"].items():
+        if name not in names:
+            for gram in name_bigrams(name):
+                grams[gram] = grams.get(gram, []) + [name]
+        names[name] = names.get(name, []) + offsets
+    return {"names": names, "grams": grams}
+
+
+def match_event_names(summary: dict, query: str) -> Dict[str, List[int]]:
+    """
+    在一个分区的名称索引中查找包含 query 的事件名称（不区分大小写）
+    两个字符以上的查询先求各二元字符组倒排表的交集，再对少量候选名称确认子串
+    返回 {事件名称: [字节偏移, ...]}
+    """
+    query = query.lower()
+    names = summary["names"]
+    grams = name_bigrams(query)
+    if grams:
+        candidates = None
+        for gram in sorted(grams, key=lambda g: len(summary["grams"].get(g, ()))):
+            posting = summary["grams"].get(gram)
+            if not posting:
+                return {}
+            candidates = set(posting) if candidates is None else candidates.intersection(posting)
+            if not candidates:
+                return {}
+    else:
+        candidates = names
+    return {name: names[name] for name in candidates if query in name.lower()}
+
+
+# 分区目录
+# catalog.json 记录所有积分事件分区及其覆盖的日期范围 [[相对路径, 起始日期, 结束日期], ...]，
+# 按起始日期排序，写入新分区时更新。范围查询通过二分查找直接定位相关分区，不再列目录。
+PARTITION_GRANULARITIES = ('day', 'week', 'month')
+PARTITION_LAYOUTS = ('flat', 'year_month')
+
+# .csv 为可追加的分区，.col 为已压缩的列式分区（见 database_columnar.py），
+# .bin 为按年压缩的二进制归档（见 database_binlog.py）
+_PARTITION_NAME_RE = re.compile(r'^score_events_(\d{4})-(\d{2})(?:-(\d{2}))?\.(?:csv|col)$')
+_WEEK_PARTITION_NAME_RE = re.compile(r'^score_events_(\d{4})-W(\d{2})\.(?:csv|col)$')
+_YEAR_PARTITION_NAME_RE = re.compile(r'^score_events_(\d{4})\.bin$')
+
+
+def partition_bounds(filename: str) -> Optional[Tuple[date, date]]:
+    """从分区文件名解析出其覆盖的日期范围，无法识别时返回 None"""
+    match = _WEEK_PARTITION_NAME_RE.match(filename)
+    if match:
+        monday = date.fromisocalendar(int(match.group(1)), int(match.group(2)), 1)
+        return monday, monday + timedelta(days=6)
+    match = _YEAR_PARTITION_NAME_RE.match(filename)
+    if match:
+        year = int(match.group(1))
+        return date(year, 1, 1), date(year, 12, 31)
+    match = _PARTITION_NAME_RE.match(filename)
+    if not match:
+        return None
+    year, month = int(match.group(1)), int(match.group(2))
+    if match.group(3):
+        day = date(year, month, int(match.group(3)))
+        return day, day
+    first = date(year, month, 1)
+    last = date(year, month, calendar.monthrange(year, month)[1])
+    return first, last
+
+
+def partition_name(day: date, granularity: str = 'day', layout: str = 'flat', suffix: str = '.csv') -> str:
+    """
+    某一天的事件应写入的分区（相对积分事件目录的路径，使用 / 分隔）
+    granularity 为 'year' 只用于二进制归档，year_month 布局下放在年份目录中
+    """
+    if granularity == 'year':
+        filename = f"score_events_{day.year}{suffix}"
+        return f"{day.year}/{filename}" if layout == 'year_month' else filename
+    if granularity == 'week':
+        iso_year, iso_week, _ = day.isocalendar()
+        filename = f"score_events_{iso_year}-W{iso_week:02d}{suffix}"
+        start = day - timedelta(days=day.weekday())
+    elif granularity == 'month':
+        filename = f"score_events_{day.year}-{day.month:02d}{suffix}"
+        start = day.replace(day=1)
+    else:
+        filename = f"score_events_{day.isoformat()}{suffix}"
+        start = day
+    if layout == 'year_month':
+        return f"{start.year}/{start.month:02d}/{filename}"
+    return filename
+
+
+class PartitionCatalog:
+    """
+    积分事件分区目录，文件变化（例如其他程序新建了分区）时自动重新加载；可被后台压缩线程同时修改
+    dir_lock 为数据目录写锁，登记和替换分区时调用方必须持有
+    """
+
+    def __init__(self, events_dir: str, dir_lock):
+        self.events_dir = events_dir
+        self._dir_lock = dir_lock
+        self.catalog_path = os.path.join(events_dir, 'catalog.json')
+        self._lock = threading.RLock()
+        self._signature = None
+        self._entries: List[Tuple[int, int, str]] = []  # (起始日序号, 结束日序号, 相对路径)，按起始日排序
+        self._starts: List[int] = []
+        self._names = set()
+        self._max_span = 0
+
+    def path(self, partition: str) -> str:
+        return os.path.join(self.events_dir, *partition.split('/'))
+
+    def _set_entries(self, entries: List[Tuple[int, int, str]]):
+        entries.sort()
+        self._entries = entries
+        self._starts = [start for start, _, _ in entries]
+        self._names = {partition for _, _, partition in entries}
+        self._max_span = max((end - start for start, end, _ in entries), default=0)
+
+    def _load(self):
+        signature = _signature(self.catalog_path)
+        if signature is None:
+            self.rebuild()
+            return
+        if signature == self._signature:
+            return
+        try:
+            with open(self.catalog_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            entries = [(date.fromisoformat(start).toordinal(), date.fromisoformat(end).toordinal(), partition)
+                       for partition, start, end in data["partitions"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            self.rebuild()
+            return
+        self._set_entries(entries)
+        self._signature = signature
+
+    def _save(self):
+        data = {"partitions": [[partition, date.fromordinal(start).isoformat(), date.fromordinal(end).isoformat()]
+                               for start, end, partition in self._entries]}
+        tmp_path = temp_path(self.catalog_path)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=0)
+        os.replace(tmp_path, self.catalog_path)
+        self._signature = _signature(self.catalog_path)
+
+    def rebuild(self):
+        """
+        扫描积分事件目录重建分区目录，用于首次使用或目录文件丢失时
+        读取时拿不到数据目录写锁则只更新内存，由之后的写入保存
+        """
+        with self._lock:
+            entries = []
+            if os.path.isdir(self.events_dir):
+                compacted = set()
+                for root, dirs, files in os.walk(self.events_dir):
+                    dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+                    rel_root = os.path.relpath(root, self.events_dir)
+                    for filename in files:
+                        bounds = partition_bounds(filename)
+                        if bounds is None:
+                            continue
+                        partition = filename if rel_root == '.' else '/'.join(rel_root.split(os.sep) + [filename])
+                        entries.append((bounds[0].toordinal(), bounds[1].toordinal(), partition))
+                        if is_archive(filename):
+                            compacted.update((source, tuple(sig)) for source, sig in
+                                             archive_sources(os.path.join(root, filename)))
+                # 压缩过程中断时留下的来源分区（大小和修改时间与压缩时相同），其内容已在列式分区中
+                entries = [entry for entry in entries
+                           if (entry[2], tuple(_signature(self.path(entry[2])) or ())) not in compacted]
+                self._set_entries(entries)
+                with _try_dir_lock(self._dir_lock) as locked:
+                    if locked:
+                        self._save()
+            else:
+                self._set_entries(entries)
+                self._signature = None
+
+    def register(self, partition: str):
+        """登记分区（已登记的忽略）"""
+        with self._lock:
+            self._load()
+            if partition not in self._names:
+                self.replace([], [partition])
+
+    def replace(self, removed: List[str], added: List[str]):
+        """一次性移除和登记若干分区，用于压缩时以新分区替换旧分区"""
+        with self._lock:
+            self._load()
+            removed = set(removed)
+            entries = [entry for entry in self._entries if entry[2] not in removed]
+            names = {partition for _, _, partition in entries}
+            for partition in added:
+                bounds = self.bounds(partition)
+                if bounds is not None and partition not in names:
+                    entries.append((bounds[0].toordinal(), bounds[1].toordinal(), partition))
+                    names.add(partition)
+            self._set_entries(entries)
+            self._save()
+
+    def __contains__(self, partition: str) -> bool:
+        with self._lock:
+            self._load()
+            return partition in self._names
+
+    def partitions(self, start_date: str = None, end_date: str = None) -> Dict[str, str]:
+        """
+        返回与 [start_date, end_date] 有交集的分区 {相对路径: 文件路径}，按起始日期排序
+        日期为 YYYY-MM-DD，省略表示不限
+        """
+        with self._lock:
+            self._load()
+            entries, starts, max_span = self._entries, self._starts, self._max_span
+        lo, hi = 0, len(entries)
+        start = date.fromisoformat(start_date).toordinal() if start_date else None
+        end = date.fromisoformat(end_date).toordinal() if end_date else None
+        if end is not None:
+            hi = bisect.bisect_right(starts, end)
+        if start is not None:
+            # 分区最长跨度为 max_span 天，更早开始的分区不可能覆盖 start
+            lo = bisect.bisect_left(starts, start - max_span)
+        return {partition: self.path(partition) for _, partition_end, partition in entries[lo:hi]
+                if start is None or partition_end >= start}
+
+    @staticmethod
+    def bounds(partition: str) -> Optional[Tuple[date, date]]:
+        return partition_bounds(partition.rsplit('/', 1)[-1])
+
+    def covers(self, partition: str, start_date: str = None, end_date: str = None) -> bool:
+        """分区是否完全落在日期范围内（此时无需逐行检查日期）"""
+        bounds = self.bounds(partition)
+        if bounds is None:
+            return False
+        return ((not start_date or bounds[0].isoformat() >= start_date) and
+                (not end_date or bounds[1].isoformat() <= end_date))
+
+
+# 积分前缀和索引
+# 每个学生只记录有积分变化的日期（升序日序号）和截至各日期的累计积分变化，任意日期范围内的合计
+# 只需两次二分查找，占用与有数据的天数成正比，与最早、最晚日期之间相隔多久无关。
+# 索引由每日汇总数据构建，并记录构建时汇总数据的指纹；指纹不一致（例如分区被改写）时重新构建。
+# 持久化为二进制快照 + JSON Lines 追加日志：追加事件时只在日志中写一行，日志过长时再合并为快照。
+
+class _StudentPrefixSums:
+    """一个学生有积分变化的日期（升序日序号）及截至各日期（含）的累计积分变化"""
+
+    __slots__ = ('days', 'sums')
+
+    def __init__(self, days: array = None, sums: array = None):
+        self.days = days if days is not None else array('i')
+        self.sums = sums if sums is not None else array('q')
+
+    def add(self, day: int, delta: int):
+        days, sums = self.days, self.sums
+        if days and day == days[-1]:
+            sums[-1] += delta
+        elif not days or day > days[-1]:
+            days.append(day)
+            sums.append((sums[-1] if sums else 0) + delta)
+        else:
+            # 补录的历史事件：插入日期（如需要）并更新其后的累计值
+            i = bisect.bisect_left(days, day)
+            if days[i] != day:
+                days.insert(i, day)
+                sums.insert(i, sums[i - 1] if i else 0)
+            for j in range(i, len(sums)):
+                sums[j] += delta
+
+    def upto(self, day: int) -> int:
+        """截至 day（含）的累计积分变化"""
+        i = bisect.bisect_right(self.days, day)
+        return self.sums[i - 1] if i else 0
+
+
+class ScorePrefixIndex:
+    """
+    按学生、按天的稀疏积分前缀和索引，可被写入线程和读取线程同时使用
+    dir_lock 为数据目录写锁，写日志和快照时必须持有
+    """
+
+    VERSION = 2
+    SNAPSHOT_INTERVAL = 500
+
+    def __init__(self, path: str, dir_lock):
+        self.path = path
+        self._dir_lock = dir_lock
+        self.journal_path = os.path.splitext(path)[0] + '.journal'
+        self._loaded = False
+        self._fingerprint = None
+        self._students: Dict[str, _StudentPrefixSums] = {}
+        self._journal_lines = 0
+        self._lock = threading.RLock()
+
+    def _load(self):
+        self._loaded = True
+        self._fingerprint = None
+        self._students = {}
+        self._journal_lines = 0
+        try:
+            with open(self.path, 'rb') as f:
+                header = json.loads(f.readline().decode('utf-8'))
+                if header.get("version") != self.VERSION:
+                    return
+                counts = header["students"]
+                total = sum(count for _, count in counts)
+                days, sums = array('i'), array('q')
+                days.frombytes(f.read(total * days.itemsize))
+                sums.frombytes(f.read(total * sums.itemsize))
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        if len(days) != total or len(sums) != total:
+            return
+        position = 0
+        for student_id, count in counts:
+            self._students[student_id] = _StudentPrefixSums(days[position:position + count],
+                                                            sums[position:position + count])
+            position += count
+        self._fingerprint = header["fingerprint"]
+
+        # 回放快照之后追加的变更，每项变更只在索引处于其记录的起始指纹时适用
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    self._journal_lines += 1
+                    try:
+                        change = json.loads(line)
+                    except ValueError:
+                        continue  # 未写完的行
+                    if change.get("before") == self._fingerprint:
+                        self._apply(change["updates"])
+                        self._fingerprint = change["after"]
+        except OSError:
+            pass
+
+    def _apply(self, updates: List[list]):
+        students = self._students
+        for student_id, day, delta in updates:
+            prefix_sums = students.get(student_id)
+            if prefix_sums is None:
+                prefix_sums = students[student_id] = _StudentPrefixSums()
+            prefix_sums.add(day, delta)
+
+    def save(self):
+        """把全部学生的前缀和写入快照并清空日志，调用方持有数据目录写锁"""
+        with self._lock:
+            students = list(self._students.items())
+            header = {"version": self.VERSION, "fingerprint": self._fingerprint,
+                      "students": [[student_id, len(prefix_sums.days)] for student_id, prefix_sums in students]}
+            days, sums = array('i'), array('q')
+            for _, prefix_sums in students:
+                days.extend(prefix_sums.days)
+                sums.extend(prefix_sums.sums)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = temp_path(self.path)
+            with open(tmp_path, 'wb') as f:
+                f.write(json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8') + b'\n')
+                f.write(days.tobytes())
+                f.write(sums.tobytes())
+            os.replace(tmp_path, self.path)
+            open(self.journal_path, 'w').close()
+            self._journal_lines = 0
+
+    def _rebuild(self, rollups: Dict[str, dict], fingerprint: str):
+        values: Dict[str, Dict[int, int]] = {}
+        for days in rollups.values():
+            for day, students in days.items():
+                ordinal = date.fromisoformat(day).toordinal()
+                for student_id, types in students.items():
+                    net = sum(totals[0] for totals in types.values())
+                    per_day = values.setdefault(student_id, {})
+                    per_day[ordinal] = per_day.get(ordinal, 0) + net
+
+        self._students = {}
+        for student_id, per_day in values.items():
+            prefix_sums = self._students[student_id] = _StudentPrefixSums()
+            total = 0
+            for ordinal in sorted(per_day):
+                total += per_day[ordinal]
+                prefix_sums.days.append(ordinal)
+                prefix_sums.sums.append(total)
+        self._fingerprint = fingerprint
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded = False
+            self._fingerprint = None
+            self._students = {}
+            self._journal_lines = 0
+
+    def note_append(self, fingerprint_before: str, fingerprint_after: str, events: Iterable[Tuple[int, EventRecord]]):
+        """
+        追加事件后更新相应学生的前缀和并写入一行日志，调用方持有数据目录写锁；
+        索引本来就过期时留到下次查询重建
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            if self._fingerprint is None or self._fingerprint != fingerprint_before:
+                return
+            deltas: Dict[Tuple[str, int], int] = {}
+            for _, (student_id, _, score_change, timestamp, _) in events:
+                key = (student_id, date.fromisoformat(timestamp[:10]).toordinal())
+                deltas[key] = deltas.get(key, 0) + score_change
+            updates = [[student_id, day, delta] for (student_id, day), delta in deltas.items()]
+            self._apply(updates)
+            self._fingerprint = fingerprint_after
+
+            change = {"before": fingerprint_before, "after": fingerprint_after, "updates": updates}
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(change, ensure_ascii=False, separators=(',', ':')) + '\n')
+            self._journal_lines += 1
+            if self._journal_lines >= self.SNAPSHOT_INTERVAL:
+                self.save()
+
+    def totals(self, rollups: Dict[str, dict], fingerprint: str,
+               start_date: str = None, end_date: str = None) -> Dict[str, int]:
+        """
+        rollups 为全部分区的每日汇总，fingerprint 为其指纹
+        返回 {学号: 积分变化合计}，合计为0的学生不出现在结果中
+        索引过期时在内存中重建，能不等待地拿到数据目录写锁时同时写入快照
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            if self._fingerprint != fingerprint:
+                self._rebuild(rollups, fingerprint)
+                with _try_dir_lock(self._dir_lock) as locked:
+                    if locked:
+                        self.save()
+
+            lo = date.fromisoformat(start_date).toordinal() - 1 if start_date else None
+            hi = date.fromisoformat(end_date).toordinal() if end_date else None
+            if lo is not None and hi is not None and lo >= hi:
+                return {}
+            totals = {}
+            for student_id, prefix_sums in self._students.items():
+                if not prefix_sums.sums:
+                    continue
+                end_total = prefix_sums.upto(hi) if hi is not None else prefix_sums.sums[-1]
+                total = end_total - (prefix_sums.upto(lo) if lo is not None else 0)
+                if total:
+                    totals[student_id] = total
+            return totals
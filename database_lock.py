@@ -0,0 +1,189 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+# 网络文件系统 (/proc/mounts 中的类型)
+NETWORK_FILESYSTEMS = {'nfs', 'nfs4', 'cifs', 'smb3', 'smbfs', 'afs', 'ncpfs', 'fuse.sshfs', 'ceph', 'glusterfs',
+                       'fuse.glusterfs', '9p', 'davfs', 'fuse.davfs2'}
+
+# 数据目录的跨进程写锁
+# 教师机和讲台电脑上的两个程序实例可能共用同一个 data 目录（例如共享盘）。所有修改都在 DataDirLock
+# 的写锁内进行（Windows 用 msvcrt.locking，其他系统用 fcntl.lockf，程序退出或崩溃后由系统自动释放）；
+# 读取不加锁，由各文件的原子替换保证读到的总是完整的文件。
+# 目录中的 .generation 记录修改次数，持有写锁的实例据此判断内存中的缓存是否已经被其他实例的修改淘汰。
+
+LOCK_FILE = '.lock'
+GENERATION_FILE = '.generation'
+
+
+class DataDirLock:
+    """一个数据目录的写锁和版本号，同一进程内可重入"""
+
+    TIMEOUT = 30.0
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, data_dir: str):
+        self.data_dir = data_dir
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+        self._generation: Optional[int] = None  # 本进程缓存对应的版本号，None 表示未知
+
+    def _try_lock(self, f) -> bool:
+        try:
+            if os.name == 'nt':
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.lockf(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _unlock(self, f):
+        if os.name == 'nt':
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.lockf(f.fileno(), fcntl.LOCK_UN)
+
+    def acquire(self, timeout: Optional[float] = None):
+        """获取写锁，超过 timeout 秒（默认 TIMEOUT）仍被其他实例占用时抛出 TimeoutError"""
+        timeout = self.TIMEOUT if timeout is None else timeout
+        if not self._thread_lock.acquire(timeout=timeout):
+            raise TimeoutError("等待数据目录写锁超时")
+        if self._depth == 0:
+            try:
+                f = open(os.path.join(self.data_dir, LOCK_FILE), 'a+b')
+                deadline = time.monotonic() + timeout
+                while not self._try_lock(f):
+                    if time.monotonic() >= deadline:
+                        f.close()
+                        raise TimeoutError("数据目录正被其他程序实例修改，请稍后重试")
+                    time.sleep(self.POLL_INTERVAL)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+            self._file = f
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            f, self._file = self._file, None
+            try:
+                self._unlock(f)
+            finally:
+                f.close()
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def _read_generation(self) -> Optional[int]:
+        try:
+            with open(os.path.join(self.data_dir, GENERATION_FILE), 'rb') as f:
+                return int(f.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError):
+            return None
+
+    def _write_generation(self, generation: int):
+        with open(os.path.join(self.data_dir, GENERATION_FILE), 'wb') as f:
+            f.write(str(generation).encode('ascii'))
+
+    @contextmanager
+    def update(self, on_stale: Callable[[], None]):
+        """
+        在写锁内修改数据
+        进入时如果版本号与本进程上次修改后的不同（其他实例修改过，或本进程还没有修改过），先调用 on_stale
+        丢弃缓存，使修改基于最新的文件内容；退出时（包括出错时，文件可能已部分修改）版本号加一。
+        嵌套调用时只有最外层检查和更新版本号
+        """
+        with self:
+            if self._depth > 1:
+                yield
+                return
+            generation = self._read_generation()
+            if generation is None or generation != self._generation:
+                on_stale()
+            try:
+                yield
+            finally:
+                self._generation = (generation or 0) + 1
+                self._write_generation(self._generation)
+
+
+_locks: Dict[str, DataDirLock] = {}
+_locks_guard = threading.Lock()
+
+
+def data_dir_lock(data_dir: str) -> DataDirLock:
+    """同一目录在进程内共用一个 DataDirLock"""
+    data_dir = os.path.abspath(data_dir)
+    with _locks_guard:
+        lock = _locks.get(data_dir)
+        if lock is None:
+            lock = _locks[data_dir] = DataDirLock(data_dir)
+        return lock
+
+
+def temp_path(path: str) -> str:
+    """替换 path 前写入的临时文件，按进程和线程区分，同时保存的两个线程或程序实例不会互相覆盖"""
+    return f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+
+
+def replace_file(src: str, dst: str, attempts: int = 20, delay: float = 0.05):
+    """
+    os.replace，目标文件正被其他实例读取时（Windows 上会拒绝替换）稍后重试，
+    读取方因此不需要等待写锁
+    """
+    for attempt in range(attempts):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(delay)
+
+
+def is_network_path(path: str) -> bool:
+    """
+    path 是否位于网络共享盘上: Windows 上为UNC路径或网络驱动器，Linux 上按 /proc/mounts 中所在挂载点的文件系统类型判断
+    无法判断时返回 False
+    """
+    path = os.path.abspath(path)
+    if os.name == 'nt':
+        if path.startswith('\\\\'):
+            return True
+        try:
+            import ctypes
+            return ctypes.windll.kernel32.GetDriveTypeW(os.path.splitdrive(path)[0] + '\\') == 4  # DRIVE_REMOTE
+        except (ImportError, AttributeError, OSError):
+            return False
+
+    path = os.path.realpath(path)
+    try:
+        with open('/proc/mounts', encoding='utf-8', errors='replace') as f:
+            mounts = [line.split()[1:3] for line in f if len(line.split()) >= 3]
+    except OSError:
+        return False
+    best, fs_type = '', ''
+    for mount_point, mount_type in mounts:
+        mount_point = mount_point.replace('\\040', ' ').replace('\\011', '\t').replace('\\134', '\\')
+        if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) and len(mount_point) >= len(best):
+            best, fs_type = mount_point, mount_type
+    return fs_type in NETWORK_FILESYSTEMS
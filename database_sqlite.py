@@ -0,0 +1,370 @@
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Iterator, List, Dict, Optional, Tuple
+
+from database_events import Event, EventBatch
+
+# SQLite 存储后端
+# 在 settings.json 中设置 "storage_backend": "sqlite" 后，database.py 的公共函数会转发到这里。
+# 所有SQL均为固定语句加参数绑定，由 sqlite3 的语句缓存复用预编译结果。
+
+SQLITE_DB_FILE = 'score_manager.db'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    student_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL DEFAULT '',
+    current_score INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS score_events (
+    id INTEGER PRIMARY KEY,
+    student_id TEXT NOT NULL,
+    event_name TEXT NOT NULL,
+    score_change INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    event_type TEXT NOT NULL DEFAULT 'score'
+);
+CREATE INDEX IF NOT EXISTS idx_score_events_student ON score_events (student_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_score_events_type ON score_events (event_type, timestamp);
+CREATE INDEX IF NOT EXISTS idx_score_events_timestamp ON score_events (timestamp);
+CREATE TABLE IF NOT EXISTS reward_events (
+    id INTEGER PRIMARY KEY,
+    student_id TEXT NOT NULL,
+    reward_name TEXT NOT NULL,
+    score_cost INTEGER NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS daily_task_events (
+    id INTEGER PRIMARY KEY,
+    student_id TEXT NOT NULL,
+    task_name TEXT NOT NULL,
+    score_change INTEGER NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS score_rules (
+    rule_name TEXT PRIMARY KEY,
+    score_value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reward_rules (
+    rule_name TEXT PRIMARY KEY,
+    score_cost INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS daily_task_rules (
+    task_name TEXT PRIMARY KEY,
+    score_value INTEGER NOT NULL
+);
+"""
+
+# 规则表: 函数名后缀 -> (表名, 名称列, 数值列)
+RULE_TABLES = {
+    'score': ('score_rules', 'rule_name', 'score_value'),
+    'reward': ('reward_rules', 'rule_name', 'score_cost'),
+    'daily_task': ('daily_task_rules', 'task_name', 'score_value'),
+}
+
+
+def _date_range_conditions(start_date: str = None, end_date: str = None) -> Tuple[List[str], List[str]]:
+    """把 YYYY-MM-DD 日期范围转换为 timestamp 列上的半开区间条件，可以直接使用时间索引"""
+    conditions, params = [], []
+    if start_date:
+        conditions.append("timestamp >= ?")
+        params.append(start_date)
+    if end_date:
+        conditions.append("timestamp < ?")
+        params.append((datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d"))
+    return conditions, params
+
+
+def _event_filters(start_date: str = None, end_date: str = None, student_id: str = None,
+                   event_type: str = None, rule_name: str = None) -> Tuple[str, tuple]:
+    """积分事件查询的 WHERE 子句及参数"""
+    conditions, params = _date_range_conditions(start_date, end_date)
+    if student_id:
+        conditions.append("student_id = ?")
+        params.append(student_id)
+    if event_type:
+        conditions.append("event_type = ?")
+        params.append(event_type)
+    if rule_name is not None:
+        conditions.append("instr(lower(event_name), ?) > 0")
+        params.append(rule_name.lower())
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    return where, tuple(params)
+
+
+class SQLiteStore:
+    """以 SQLite (WAL 模式) 实现 database.py 的公共函数"""
+
+    # iter_events 每次从游标取出的行数
+    FETCH_SIZE = 500
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, cached_statements=256)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def is_empty(self) -> bool:
+        """数据库中是否还没有任何学生、规则或事件"""
+        for table in ('students', 'score_events', 'reward_events', 'daily_task_events',
+                      'score_rules', 'reward_rules', 'daily_task_rules'):
+            if self._query(f"SELECT 1 FROM {table} LIMIT 1"):
+                return False
+        return True
+
+    # 学生相关函数
+    def add_student(self, student_id: str, name: str = "") -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO students (student_id, name, current_score) VALUES (?, ?, 0)",
+                (student_id, name))
+            return cursor.rowcount > 0
+
+    def get_all_students(self) -> List[Tuple[str, str, int]]:
+        return self._query("SELECT student_id, name, current_score FROM students ORDER BY rowid")
+
+    def get_student_by_id(self, student_id: str) -> Optional[Tuple[str, str, int]]:
+        rows = self._query("SELECT student_id, name, current_score FROM students WHERE student_id = ?",
+                           (student_id,))
+        return rows[0] if rows else None
+
+    def update_student_name(self, student_id: str, new_name: str) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute("UPDATE students SET name = ? WHERE student_id = ?",
+                                        (new_name, student_id))
+            return cursor.rowcount > 0
+
+    def update_student_score(self, student_id: str, new_score: int) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute("UPDATE students SET current_score = ? WHERE student_id = ?",
+                                        (new_score, student_id))
+            return cursor.rowcount > 0
+
+    def delete_student(self, student_id: str) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM students WHERE student_id = ?", (student_id,))
+            if cursor.rowcount == 0:
+                return False
+            # 同时删除该学生的所有积分记录
+            self._conn.execute("DELETE FROM score_events WHERE student_id = ?", (student_id,))
+            return True
+
+    # 积分事件相关函数
+    def add_score_events_bulk(self, student_ids: List[str], event_name: str, score_change: int,
+                              event_type: str = "score", timestamp: Optional[datetime] = None) -> List[Tuple[str, bool]]:
+        with self._lock, self._conn:
+            return self._insert_score_events(student_ids, event_name, score_change, event_type, timestamp)
+
+    def _insert_score_events(self, student_ids: List[str], event_name: str, score_change: int,
+                             event_type: str, timestamp: Optional[datetime]) -> List[Tuple[str, bool]]:
+        """写入积分事件并更新积分，由调用方负责加锁和提交事务"""
+        if timestamp is None:
+            timestamp = datetime.now()
+        timestamp_str = timestamp.strftime("%Y-%m-%d %H:%M:%S")
+        known = {student_id for student_id in set(student_ids)
+                 if self._conn.execute("SELECT 1 FROM students WHERE student_id = ?", (student_id,)).fetchone()}
+        results = [(student_id, student_id in known) for student_id in student_ids]
+        valid_ids = [student_id for student_id, ok in results if ok]
+        self._conn.executemany(
+            "INSERT INTO score_events (student_id, event_name, score_change, timestamp, event_type) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(student_id, event_name, score_change, timestamp_str, event_type) for student_id in valid_ids])
+        self._conn.executemany(
+            "UPDATE students SET current_score = current_score + ? WHERE student_id = ?",
+            [(score_change, student_id) for student_id in valid_ids])
+        return results
+
+    def append_score_events(self, rows: List[list], deltas: Dict[str, int]):
+        """写入已经校验过的积分事件行，并按 {学号: 积分变化} 更新积分（导入历史积分事件时使用）"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO score_events (student_id, event_name, score_change, timestamp, event_type) "
+                "VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.executemany(
+                "UPDATE students SET current_score = current_score + ? WHERE student_id = ?",
+                [(delta, student_id) for student_id, delta in deltas.items()])
+
+    def get_score_events_by_student(self, student_id: str) -> EventBatch:
+        return EventBatch(self._query(
+            "SELECT student_id, event_name, score_change, timestamp, event_type FROM score_events "
+            "WHERE student_id = ? ORDER BY timestamp, id", (student_id,)))
+
+    def iter_events(self, start_date: str = None, end_date: str = None, student_id: str = None,
+                    event_type: str = None, rule_name: str = None,
+                    order: str = 'desc') -> Iterator[Event]:
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"未知的排序方式: {order}")
+        where, params = _event_filters(start_date, end_date, student_id, event_type, rule_name)
+        direction = " DESC" if order == 'desc' else ""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT student_id, event_name, score_change, timestamp, event_type FROM score_events "
+                f"{where}ORDER BY timestamp{direction}, id", params)
+        # 相同的学号、名称和类型只保留一个字符串对象
+        intern = {}.setdefault
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(self.FETCH_SIZE)
+            if not rows:
+                return
+            for sid, event_name, score_change, timestamp, evt_type in rows:
+                yield Event(intern(sid, sid), intern(event_name, event_name), score_change, timestamp,
+                            intern(evt_type, evt_type))
+
+    def get_all_events_in_date_range(self, start_date: str = None, end_date: str = None,
+                                     student_id: str = None, event_type: str = None) -> EventBatch:
+        return EventBatch(self.iter_events(start_date, end_date, student_id, event_type))
+
+    def search_events_by_rule_name(self, rule_name: str, start_date: str = None, end_date: str = None,
+                                   student_id: str = None, event_type: str = None) -> EventBatch:
+        return EventBatch(self.iter_events(start_date, end_date, student_id, event_type, rule_name))
+
+    def get_score_totals(self, start_date: str = None, end_date: str = None,
+                         event_type: str = None) -> Dict[str, int]:
+        conditions, params = _date_range_conditions(start_date, end_date)
+        if event_type:
+            conditions.append("event_type = ?")
+            params.append(event_type)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        return dict(self._query(
+            f"SELECT student_id, SUM(score_change) FROM score_events {where}GROUP BY student_id", tuple(params)))
+
+    # 兑换事件相关函数
+    def add_reward_event(self, student_id: str, reward_name: str, score_cost: int) -> bool:
+        now = datetime.now()
+        with self._lock, self._conn:
+            # 同时记录到总积分事件中，类型为'reward'，积分在此一并扣除
+            results = self._insert_score_events([student_id], f"兑换: {reward_name}", -score_cost, "reward", now)
+            if not results[0][1]:
+                return False
+            self._conn.execute(
+                "INSERT INTO reward_events (student_id, reward_name, score_cost, timestamp) VALUES (?, ?, ?, ?)",
+                (student_id, reward_name, score_cost, now.strftime("%Y-%m-%d %H:%M:%S")))
+            return True
+
+    def get_all_reward_events(self) -> EventBatch:
+        return EventBatch(self._query(
+            "SELECT student_id, reward_name, -score_cost, timestamp, 'reward' FROM reward_events ORDER BY id"))
+
+    # 每日任务事件相关函数
+    def add_daily_task_events_bulk(self, student_ids: List[str], task_name: str, score_change: int,
+                                   timestamp: str) -> List[Tuple[str, bool]]:
+        with self._lock, self._conn:
+            # 同时记录到总积分事件中，类型为'daily_task'
+            results = self._insert_score_events(student_ids, f"每日任务: {task_name}", score_change,
+                                                "daily_task", None)
+            self._conn.executemany(
+                "INSERT INTO daily_task_events (student_id, task_name, score_change, timestamp) VALUES (?, ?, ?, ?)",
+                [(student_id, task_name, score_change, timestamp) for student_id, ok in results if ok])
+            return results
+
+    def get_all_daily_task_events(self) -> EventBatch:
+        return EventBatch(self._query(
+            "SELECT student_id, task_name, score_change, timestamp, 'daily_task' FROM daily_task_events ORDER BY id"))
+
+    # 规则相关函数 (积分、兑换、每日任务三类规则结构相同)
+    def _add_rule(self, kind: str, name: str, value: int) -> bool:
+        table, name_col, value_col = RULE_TABLES[kind]
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                f"INSERT OR IGNORE INTO {table} ({name_col}, {value_col}) VALUES (?, ?)", (name, value))
+            return cursor.rowcount > 0
+
+    def _get_all_rules(self, kind: str) -> List[Tuple[str, int]]:
+        table, name_col, value_col = RULE_TABLES[kind]
+        return self._query(f"SELECT {name_col}, {value_col} FROM {table} ORDER BY rowid")
+
+    def _get_rule_by_name(self, kind: str, name: str) -> Optional[Tuple[str, int]]:
+        table, name_col, value_col = RULE_TABLES[kind]
+        rows = self._query(f"SELECT {name_col}, {value_col} FROM {table} WHERE {name_col} = ?", (name,))
+        return rows[0] if rows else None
+
+    def _delete_rule(self, kind: str, name: str) -> bool:
+        table, name_col, _ = RULE_TABLES[kind]
+        with self._lock, self._conn:
+            cursor = self._conn.execute(f"DELETE FROM {table} WHERE {name_col} = ?", (name,))
+            return cursor.rowcount > 0
+
+    def add_score_rule(self, rule_name: str, score_value: int) -> bool:
+        return self._add_rule('score', rule_name, score_value)
+
+    def get_all_score_rules(self) -> List[Tuple[str, int]]:
+        return self._get_all_rules('score')
+
+    def get_score_rule_by_name(self, rule_name: str) -> Optional[Tuple[str, int]]:
+        return self._get_rule_by_name('score', rule_name)
+
+    def delete_score_rule(self, rule_name: str) -> bool:
+        return self._delete_rule('score', rule_name)
+
+    def add_reward_rule(self, rule_name: str, score_cost: int) -> bool:
+        return self._add_rule('reward', rule_name, score_cost)
+
+    def get_all_reward_rules(self) -> List[Tuple[str, int]]:
+        return self._get_all_rules('reward')
+
+    def get_reward_rule_by_name(self, rule_name: str) -> Optional[Tuple[str, int]]:
+        return self._get_rule_by_name('reward', rule_name)
+
+    def delete_reward_rule(self, rule_name: str) -> bool:
+        return self._delete_rule('reward', rule_name)
+
+    def add_daily_task_rule(self, task_name: str, score_value: int) -> bool:
+        return self._add_rule('daily_task', task_name, score_value)
+
+    def get_all_daily_task_rules(self) -> List[Tuple[str, int]]:
+        return self._get_all_rules('daily_task')
+
+    def get_daily_task_rule_by_name(self, task_name: str) -> Optional[Tuple[str, int]]:
+        return self._get_rule_by_name('daily_task', task_name)
+
+    def delete_daily_task_rule(self, task_name: str) -> bool:
+        return self._delete_rule('daily_task', task_name)
+
+    # CSV迁移
+    def import_all(self, students: List[Tuple[str, str, int]],
+                   score_events: List[Tuple[str, str, int, str, str]],
+                   reward_events: List[Tuple[str, str, int, str]],
+                   daily_task_events: List[Tuple[str, str, int, str]],
+                   rules: Dict[str, List[Tuple[str, int]]]) -> Dict[str, int]:
+        """在一个事务中写入全部数据，学生积分按原值保存，不会根据事件重新计算"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO students (student_id, name, current_score) VALUES (?, ?, ?)", students)
+            self._conn.executemany(
+                "INSERT INTO score_events (student_id, event_name, score_change, timestamp, event_type) "
+                "VALUES (?, ?, ?, ?, ?)", score_events)
+            self._conn.executemany(
+                "INSERT INTO reward_events (student_id, reward_name, score_cost, timestamp) VALUES (?, ?, ?, ?)",
+                reward_events)
+            self._conn.executemany(
+                "INSERT INTO daily_task_events (student_id, task_name, score_change, timestamp) VALUES (?, ?, ?, ?)",
+                daily_task_events)
+            for kind, kind_rules in rules.items():
+                table, name_col, value_col = RULE_TABLES[kind]
+                self._conn.executemany(
+                    f"INSERT OR IGNORE INTO {table} ({name_col}, {value_col}) VALUES (?, ?)", kind_rules)
+
+        counts = {'students': len(students), 'score_events': len(score_events),
+                  'reward_events': len(reward_events), 'daily_task_events': len(daily_task_events)}
+        for kind, kind_rules in rules.items():
+            counts[f'{kind}_rules'] = len(kind_rules)
+        return counts
+
+
+if __name__ == '__main__':
+    # 一次性迁移: python database_sqlite.py
+    import database
+    print(database.migrate_csv_to_sqlite())
@@ -1,9 +1,10 @@
 import sys
 import os
-from PySide6.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QPushButton, QStackedWidget, QHBoxLayout
-from PySide6.QtCore import Qt
+from PySide6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QPushButton, QStackedWidget, QHBoxLayout,
+                               QMessageBox)
+from PySide6.QtCore import Qt, QTimer
 
-from database import init_db
+from database import init_db, compact_score_events_in_background, take_write_failures
 from ui_main_page import MainPage
 from ui_settings import SettingsPage
 from ui_scoring import ScoringPage
@@ -26,6 +27,11 @@ class ScoreManagerApp(QMainWindow):
         self.init_db_connection()
         self.init_ui()
 
+        # 积分事件在后台写入，定期检查是否有记录写入失败
+        self.write_failure_timer = QTimer(self)
+        self.write_failure_timer.timeout.connect(self.check_write_failures)
+        self.write_failure_timer.start(1000)
+
     def init_ui(self):
         # 导航按钮区域
         nav_layout = QVBoxLayout()
@@ -97,9 +103,26 @@ class ScoreManagerApp(QMainWindow):
         try:
             init_db()
             print("数据库初始化成功")
+            # 把已经结束的积分事件分区压缩为列式文件
+            compact_score_events_in_background()
         except Exception as e:
             print(f"数据库初始化失败: {e}")
 
+    def check_write_failures(self):
+        """提示后台写入失败、没有保存的积分记录，并刷新当前页面"""
+        failures = take_write_failures()
+        if not failures:
+            return
+        events = [event for failed_events, _ in failures for event in failed_events]
+        lines = [f"{event.student_id} {event.event_name} {event.score_change:+d} ({event.timestamp})"
+                 for event in events[:10]]
+        if len(events) > 10:
+            lines.append(f"... 共 {len(events)} 条")
+        QMessageBox.critical(self, "保存失败",
+                             "以下记录没有保存，请稍后重新操作：\n" + "\n".join(lines) +
+                             f"\n\n错误信息：{failures[-1][1]}")
+        self.switch_page(self.stacked_widget.currentIndex())
+
     def switch_page(self, index):
         """切换页面"""
         self.stacked_widget.setCurrentIndex(index)
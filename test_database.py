@@ -0,0 +1,1246 @@
+import sys
+import os
+import csv
+import gzip
+import json
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from datetime import date, datetime
+from unittest.mock import mock_open, patch
+
+# 确保可以导入database模块
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), ".")))
+
+import database
+import database_binlog
+import database_analytics
+import database_columnar
+import database_lock
+from database_events import Event, EventBatch
+from database import init_db, add_student, get_all_students, get_student_by_id, update_student_name, \
+                     update_student_score, delete_student, add_score_events_bulk, add_daily_task_events_bulk, \
+                     get_score_events_by_student, get_all_daily_task_events, add_score_event, add_reward_event, \
+                     add_score_rule, get_all_score_rules, get_all_events_in_date_range, search_events_by_rule_name, \
+                     set_setting, migrate_csv_to_sqlite, get_score_totals, iter_events, \
+                     compact_score_events, purge_deleted_students
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """在临时数据目录中运行的测试基类，不会触碰程序目录下的data文件夹"""
+
+    def setUp(self):
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir, ignore_errors=True)
+        self.open_store()
+        init_db()
+
+    def open_store(self):
+        """在测试目录上打开新的 DataStore 并作为默认实例；再次调用相当于程序重新启动"""
+        self.store = database.DataStore(self.data_dir)
+        self.addCleanup(self.store.close)
+        patcher = patch('database._default_store', self.store)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def restart(self):
+        self.store.close()
+        self.open_store()
+
+    def read_csv(self, *parts):
+        database.flush_score_events()
+        with open(os.path.join(self.data_dir, *parts), 'r', newline='', encoding='utf-8') as f:
+            return list(csv.reader(f))
+
+
+class TestRosterCache(DatabaseTestCase):
+
+    def test_lookup_uses_cache(self):
+        add_student('S001', '张三')
+        add_student('S002', '李四')
+        with patch.object(database._RosterCache, '_load') as mock_load:
+            self.assertEqual(get_student_by_id('S002'), ('S002', '李四', 0))
+            self.assertIsNone(get_student_by_id('S999'))
+            mock_load.assert_not_called()
+
+    def test_mutations_keep_cache_and_file_in_sync(self):
+        add_student('S001', '张三')
+        add_student('S002', '李四')
+        update_student_name('S001', '张小三')
+        update_student_score('S002', 7)
+        delete_student('S001')
+        self.assertEqual(get_all_students(), [('S002', '李四', 7)])
+
+        self.store._roster_cache.invalidate()
+        self.assertEqual(get_all_students(), [('S002', '李四', 7)])
+
+    def test_external_edit_is_detected(self):
+        add_student('S001', '张三')
+        path = os.path.join(self.data_dir, database.STUDENTS_FILE)
+        with open(path, 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow(['S002', '外部添加'])
+        self.assertEqual(get_student_by_id('S002'), ('S002', '外部添加', 0))
+
+
+class TestStudentImport(DatabaseTestCase):
+
+    def write_source(self, text, encoding):
+        path = os.path.join(self.data_dir, 'import.csv')
+        with open(path, 'w', newline='', encoding=encoding) as f:
+            f.write(text)
+        return path
+
+    def test_gbk_export_with_duplicates(self):
+        add_student('S001', '张三')
+        path = self.write_source('学号,姓名\r\nS001,张三\r\nS002,李四\r\n,无学号\r\nS003,王五\r\nS002,李四\r\n', 'gbk')
+        with patch.object(self.store, '_append_students', wraps=self.store._append_students) as mock_append:
+            result = database.import_students_from_csv(path)
+        self.assertEqual(mock_append.call_count, 1)
+        self.assertEqual(result, (2, 2, ['第2行: 学号 S001 已存在，跳过', '第4行: 学号不能为空',
+                                         '第6行: 学号 S002 已存在，跳过']))
+        self.assertEqual(self.read_csv(database.STUDENTS_FILE)[1:], [['S001', '张三'], ['S002', '李四'], ['S003', '王五']])
+
+    def test_utf8_bom_without_header(self):
+        path = self.write_source('S001,张三\nS002\n', 'utf-8-sig')
+        self.assertEqual(database.import_students_from_csv(path), (2, 0, []))
+        self.assertEqual(get_all_students(), [('S001', '张三', 0), ('S002', '', 0)])
+        self.assertEqual(database.import_students_from_csv(self.write_source('', 'utf-8')), (0, 0, ['CSV文件为空']))
+
+    def test_rows_are_streamed_from_source(self):
+        path = self.write_source('学号,姓名\n' + ''.join(f'S{i:04d},学生{i}\n' for i in range(2000)), 'gbk')
+        sources = []
+        open_csv_source = database._open_csv_source
+
+        def open_source(source_path):
+            sources.append(open_csv_source(source_path))
+            return sources[-1]
+
+        with patch.object(database, '_open_csv_source', open_source):
+            self.assertEqual(database.import_students_from_csv(path), (2000, 0, []))
+        self.assertTrue(sources[0].closed)
+        self.assertEqual(get_student_by_id('S1999'), ('S1999', '学生1999', 0))
+        missing = database.import_students_from_csv(os.path.join(self.data_dir, 'missing.csv'))
+        self.assertEqual(missing[:2], (0, 0))
+        self.assertTrue(missing[2][0].startswith('读取CSV文件失败'))
+
+    def test_reimported_students_drop_deleted_history(self):
+        add_student('S001', '张三')
+        add_score_event('S001', '做操+1', 1)
+        delete_student('S001')
+        self.assertEqual(database.import_students_from_csv(self.write_source('student_id,name\nS001,张三\n', 'utf-8')),
+                         (1, 0, []))
+        self.assertEqual(get_score_events_by_student('S001'), [])
+        self.assertEqual(get_student_by_id('S001'), ('S001', '张三', 0))
+
+
+class TestBalanceStore(DatabaseTestCase):
+
+    def test_score_change_does_not_rewrite_roster(self):
+        add_student('S001', '张三')
+        with patch.object(self.store, '_save_all_students') as mock_save:
+            add_score_event('S001', '做操+1', 1)
+            update_student_score('S001', 10)
+            mock_save.assert_not_called()
+        self.assertEqual(self.read_csv(database.STUDENTS_FILE), [['student_id', 'name'], ['S001', '张三']])
+
+        self.store._balance_store.invalidate()
+        self.assertEqual(get_student_by_id('S001'), ('S001', '张三', 10))
+
+    def test_checkpoint_truncates_journal(self):
+        add_student('S001', '张三')
+        with patch.object(database._BalanceStore, 'CHECKPOINT_INTERVAL', 3):
+            for _ in range(4):
+                add_score_event('S001', '做操+1', 1)
+                database.flush_score_events()  # 每次单独写入，不合并为一批
+        self.assertEqual(self.read_csv(database.BALANCES_FILE), [['student_id', 'current_score'], ['S001', '3']])
+        self.store._balance_store.invalidate()
+        self.assertEqual(get_student_by_id('S001')[2], 4)
+
+    def test_torn_journal_line_is_ignored(self):
+        add_student('S001', '张三')
+        update_student_score('S001', 5)
+        with open(os.path.join(self.data_dir, database.BALANCES_JOURNAL_FILE), 'ab') as f:
+            f.write(b'S001,9')
+        self.store._balance_store.invalidate()
+        self.assertEqual(get_student_by_id('S001')[2], 5)
+        update_student_score('S001', 6)
+        self.store._balance_store.invalidate()
+        self.assertEqual(get_student_by_id('S001')[2], 6)
+
+    def test_legacy_roster_is_migrated(self):
+        with open(os.path.join(self.data_dir, database.STUDENTS_FILE), 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([['student_id', 'name', 'current_score'], ['S001', '张三', '12']])
+        self.store._roster_cache.invalidate()
+        init_db()
+        self.assertEqual(self.read_csv(database.STUDENTS_FILE), [['student_id', 'name'], ['S001', '张三']])
+        self.assertEqual(get_all_students(), [('S001', '张三', 12)])
+
+
+class TestBulkEvents(DatabaseTestCase):
+
+    def test_bulk_score_reports_per_student_result(self):
+        add_student('S001', '张三')
+        add_student('S002', '李四')
+        with patch.object(self.store._balance_store, 'set_many', wraps=self.store._balance_store.set_many) as mock_set:
+            results = add_score_events_bulk(['S001', 'S999', 'S002', 'S001'], '做操+1', 1)
+            database.flush_score_events()
+            self.assertEqual(mock_set.call_count, 1)
+        self.assertEqual(results, [('S001', True), ('S999', False), ('S002', True), ('S001', True)])
+        self.assertEqual(get_student_by_id('S001')[2], 2)
+        self.assertEqual(get_student_by_id('S002')[2], 1)
+        self.assertEqual(len(get_score_events_by_student('S001')), 2)
+
+    def test_bulk_daily_task(self):
+        add_student('S001', '张三')
+        results = add_daily_task_events_bulk(['S001', 'S999'], '背单词', 3, '2024-03-01 08:00:00')
+        self.assertEqual(results, [('S001', True), ('S999', False)])
+        self.assertEqual(get_all_daily_task_events(), [('S001', '背单词', 3, '2024-03-01 08:00:00', 'daily_task')])
+        events = get_score_events_by_student('S001')
+        self.assertEqual([(e[1], e[2], e[4]) for e in events], [('每日任务: 背单词', 3, 'daily_task')])
+
+
+class TestStudentEventIndex(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        add_student('S001', '张三')
+        add_student('S002', '李四')
+
+    def test_lookup_reads_only_indexed_rows(self):
+        add_score_events_bulk(['S001', 'S002'], '做操+1', 1, timestamp=datetime(2024, 3, 1, 8))
+        add_score_events_bulk(['S002'], '迟到-2', -2, timestamp=datetime(2024, 3, 2, 8))
+        add_score_events_bulk(['S001'], '发言+2', 2, timestamp=datetime(2024, 3, 2, 9))
+        with patch('database_index.iter_events_with_offsets') as mock_scan:
+            events = get_score_events_by_student('S001')
+            mock_scan.assert_not_called()
+        self.assertEqual(events, [('S001', '做操+1', 1, '2024-03-01 08:00:00', 'score'),
+                                  ('S001', '发言+2', 2, '2024-03-02 09:00:00', 'score')])
+
+    def test_index_survives_restart_and_external_changes(self):
+        add_score_events_bulk(['S001'], '做操+1', 1, timestamp=datetime(2024, 3, 1, 8))
+        database.flush_score_events()
+        path = os.path.join(self.data_dir, database.SCORE_EVENTS_DIR, 'score_events_2024-03-01.csv')
+        with open(path, 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow(['S001', '外部追加', 5, '2024-03-01 09:00:00', 'score'])
+        self.restart()
+        self.assertEqual([e[1] for e in get_score_events_by_student('S001')], ['做操+1', '外部追加'])
+
+        # 改写整个文件（即使变长）后重建该分区的索引
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([database.EVENT_HEADERS] +
+                                    [['S002', f'改写{i}', 1, '2024-03-01 10:00:00', 'score'] for i in range(3)])
+        self.assertEqual(get_score_events_by_student('S001'), [])
+        self.assertEqual([e[1] for e in get_score_events_by_student('S002')], ['改写0', '改写1', '改写2'])
+
+
+    def test_readers_and_writer_share_index(self):
+        errors = []
+        stop = threading.Event()
+
+        def read():
+            while not stop.is_set():
+                try:
+                    list(iter_events(student_id='S001'))
+                    self.store._event_indexes['student'].save_snapshot()
+                    get_score_totals()
+                except Exception as e:
+                    errors.append(e)
+
+        with patch.object(database.PartitionIndex, 'SNAPSHOT_INTERVAL', 1), \
+                patch.object(database.ScorePrefixIndex, 'SNAPSHOT_INTERVAL', 1):
+            readers = [threading.Thread(target=read) for _ in range(3)]
+            for reader in readers:
+                reader.start()
+            for i in range(100):
+                add_score_events_bulk(['S001', 'S002'], '做操+1', 1, timestamp=datetime(2024, 3, 1, 8, 0, i % 60))
+            self.assertTrue(database.flush_score_events())
+            stop.set()
+            for reader in readers:
+                reader.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(database.take_write_failures(), [])
+        self.restart()
+        self.assertEqual(len(get_score_events_by_student('S001')), 100)
+        self.assertEqual(get_score_totals(), {'S001': 100, 'S002': 100})
+
+
+class TestPartitionCatalog(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        add_student('S001', '张三')
+
+    def add_on(self, day, name='做操+1', change=1):
+        add_score_events_bulk(['S001'], name, change, timestamp=datetime.fromisoformat(f'{day} 08:00:00'))
+        database.flush_score_events()
+
+    def test_range_query_uses_catalog(self):
+        for day in ['2024-02-28', '2024-03-01', '2024-03-02', '2024-03-05']:
+            self.add_on(day)
+        with patch('os.listdir') as mock_listdir:
+            events = get_all_events_in_date_range('2024-03-01', '2024-03-02')
+            mock_listdir.assert_not_called()
+        self.assertEqual([e[3][:10] for e in events], ['2024-03-02', '2024-03-01'])
+
+    def test_catalog_is_rebuilt_from_existing_files(self):
+        self.add_on('2024-03-01')
+        os.remove(os.path.join(self.data_dir, database.SCORE_EVENTS_DIR, 'catalog.json'))
+        self.restart()
+        self.assertEqual(len(get_all_events_in_date_range('2024-03-01', '2024-03-01')), 1)
+
+    def test_monthly_partitions_in_year_month_directories(self):
+        set_setting('score_events_partition', 'month')
+        set_setting('score_events_layout', 'year_month')
+        for day in ['2024-02-28', '2024-03-01', '2024-03-20']:
+            self.add_on(day)
+        self.assertTrue(os.path.exists(os.path.join(
+            self.data_dir, database.SCORE_EVENTS_DIR, '2024', '03', 'score_events_2024-03.csv')))
+        self.assertEqual([e[3][:10] for e in get_all_events_in_date_range('2024-02-28', '2024-03-10')],
+                         ['2024-03-01', '2024-02-28'])
+        self.assertEqual(len(get_score_events_by_student('S001')), 3)
+
+    def test_weekly_partitions(self):
+        set_setting('score_events_partition', 'week')
+        self.add_on('2024-03-03')  # 周日，属于第9周
+        self.add_on('2024-03-04')  # 周一，属于第10周
+        events_dir = os.path.join(self.data_dir, database.SCORE_EVENTS_DIR)
+        self.assertTrue(os.path.exists(os.path.join(events_dir, 'score_events_2024-W09.csv')))
+        self.assertTrue(os.path.exists(os.path.join(events_dir, 'score_events_2024-W10.csv')))
+        self.assertEqual(len(get_all_events_in_date_range('2024-03-04', '2024-03-04')), 1)
+
+
+class TestScoreTotals(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        add_student('S001', '张三')
+        add_student('S002', '李四')
+        add_score_events_bulk(['S001', 'S002'], '做操+1', 1, timestamp=datetime(2024, 3, 1, 8))
+        add_score_events_bulk(['S001'], '迟到-2', -2, timestamp=datetime(2024, 3, 2, 8))
+        add_score_events_bulk(['S002'], '兑换: 铅笔', -5, 'reward', timestamp=datetime(2024, 3, 3, 8))
+
+    def test_totals_match_raw_events(self):
+        for start, end in [(None, None), ('2024-03-02', None), ('2024-03-01', '2024-03-02')]:
+            expected = {}
+            for sid, _, change, _, _ in get_all_events_in_date_range(start, end):
+                expected[sid] = expected.get(sid, 0) + change
+            self.assertEqual(get_score_totals(start, end), expected)
+        self.assertEqual(get_score_totals(event_type='reward'), {'S002': -5})
+
+    def test_totals_do_not_scan_events(self):
+        get_score_totals()
+        with patch('database_index.iter_events_with_offsets') as mock_scan:
+            self.assertEqual(get_score_totals('2024-03-01', '2024-03-03'), {'S001': -1, 'S002': -4})
+            mock_scan.assert_not_called()
+
+    def test_backdated_events_update_prefix_sums(self):
+        self.assertEqual(get_score_totals('2024-03-02', '2024-03-03'), {'S001': -2, 'S002': -5})
+        # 补录事件（包括早于最早日期的）只更新相应学生的前缀和，不重建索引
+        with patch.object(database.ScorePrefixIndex, '_rebuild') as mock_rebuild:
+            add_score_events_bulk(['S001'], '补录', 3, timestamp=datetime(2024, 3, 2, 12))
+            add_score_events_bulk(['S002'], '补录', 4, timestamp=datetime(2024, 2, 20, 12))
+            self.assertEqual(get_score_totals('2024-03-02', '2024-03-03'), {'S001': 1, 'S002': -5})
+            mock_rebuild.assert_not_called()
+        self.assertEqual(get_score_totals(None, '2024-02-29'), {'S002': 4})
+        self.assertEqual(get_score_totals(), {'S001': 2})
+
+    def test_prefix_sums_persist_and_follow_external_rewrites(self):
+        get_score_totals()
+        self.restart()
+        with patch.object(database.ScorePrefixIndex, '_rebuild') as mock_rebuild:
+            self.assertEqual(get_score_totals('2024-03-01', '2024-03-01'), {'S001': 1, 'S002': 1})
+            mock_rebuild.assert_not_called()
+
+        path = os.path.join(self.data_dir, database.SCORE_EVENTS_DIR, 'score_events_2024-03-01.csv')
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([database.EVENT_HEADERS, ['S002', '改写', 7, '2024-03-01 10:00:00', 'score']])
+        self.assertEqual(get_score_totals('2024-03-01', '2024-03-01'), {'S002': 7})
+
+
+    def test_prefix_sums_are_sparse_and_appended_incrementally(self):
+        add_student('S003', '王五')
+        add_score_events_bulk(['S003'], '补录', 1, timestamp=datetime(1990, 9, 1, 8))
+        self.assertEqual(get_score_totals(None, '1999-12-31'), {'S003': 1})
+        index_dir = os.path.join(self.data_dir, database.SCORE_EVENTS_DIR, database.SCORE_EVENTS_INDEX_DIR)
+        snapshot_path = os.path.join(index_dir, 'score_prefix.bin')
+        self.assertLess(os.path.getsize(snapshot_path), 1024)
+
+        # 之后的追加只写日志，不改写快照
+        with patch.object(database.ScorePrefixIndex, 'save') as mock_save:
+            add_score_events_bulk(['S001'], '做操+1', 1, timestamp=datetime(2024, 3, 5, 8))
+            self.assertEqual(get_score_totals('2024-03-05', '2024-03-05'), {'S001': 1})
+            mock_save.assert_not_called()
+        self.restart()
+        with patch.object(database.ScorePrefixIndex, '_rebuild') as mock_rebuild:
+            self.assertEqual(get_score_totals('2024-03-02', '2024-03-05'), {'S001': -1, 'S002': -5})
+            self.assertEqual(get_score_totals('1990-01-01', '1990-12-31'), {'S003': 1})
+            mock_rebuild.assert_not_called()
+
+
+class TestNameSearch(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        add_student('S001', '张三')
+        add_student('S002', '李四')
+        add_score_events_bulk(['S001', 'S002'], '做操+1', 1, timestamp=datetime(2024, 3, 1, 8))
+        add_daily_task_events_bulk(['S001'], '背单词', 2, '2024-03-01 09:00:00')
+        add_score_events_bulk(['S002'], '兑换: 铅笔', -5, 'reward', timestamp=datetime(2024, 3, 2, 8))
+        add_score_events_bulk(['S001'], 'English Speech', 3, timestamp=datetime(2024, 3, 3, 8))
+
+    def test_matches_substring_scan(self):
+        all_events = get_all_events_in_date_range()
+        for query in ['单词', '任务: 背', '做', 'english sp', '铅笔盒', '']:
+            expected = [e for e in all_events if query.lower() in e[1].lower()]
+            self.assertEqual(search_events_by_rule_name(query), expected)
+
+    def test_filters_and_index_lookup(self):
+        search_events_by_rule_name('做操')
+        with patch('database_index.iter_events_with_offsets') as mock_scan:
+            self.assertEqual(search_events_by_rule_name('做操', '2024-03-01', '2024-03-01', student_id='S002'),
+                             [('S002', '做操+1', 1, '2024-03-01 08:00:00', 'score')])
+            self.assertEqual(search_events_by_rule_name('铅笔', event_type='score'), [])
+            mock_scan.assert_not_called()
+        add_score_events_bulk(['S002'], '做操+1', 1, timestamp=datetime(2024, 3, 1, 10))
+        self.assertEqual(len(search_events_by_rule_name('操+', '2024-03-01', '2024-03-01')), 3)
+
+
+class TestIterEvents(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        add_student('S001', '张三')
+        add_student('S002', '李四')
+        for day in range(1, 6):
+            add_score_events_bulk(['S001', 'S002'], f'第{day}天', day, timestamp=datetime(2024, 3, day, 8))
+        # 补录的事件写在文件末尾，但时间更早
+        add_score_events_bulk(['S002'], '补录', 9, timestamp=datetime(2024, 3, 3, 7))
+        # 改为按月分区后的事件与已有的按天分区重叠
+        set_setting('score_events_partition', 'month')
+        add_score_events_bulk(['S001'], '按月', 1, timestamp=datetime(2024, 3, 3, 12))
+
+    def test_order_matches_full_sort(self):
+        events = get_all_events_in_date_range()
+        self.assertEqual(len(events), 12)
+        self.assertEqual(list(iter_events()), events)
+        self.assertEqual(list(iter_events(order='asc')), sorted(events, key=lambda e: e[3]))
+        self.assertEqual([e[1] for e in iter_events('2024-03-03', '2024-03-03', student_id='S002', order='asc')],
+                         ['补录', '第3天'])
+        self.assertEqual([e[1] for e in iter_events(rule_name='按', event_type='score')], ['按月'])
+        with self.assertRaises(ValueError):
+            next(iter_events(order='random'))
+
+    def test_strings_are_shared_across_partitions(self):
+        compact_score_events(today=date(2024, 3, 3))
+        events = get_all_events_in_date_range(student_id='S001')
+        self.assertEqual(len({id(e[0]) for e in events}), 1)
+        self.assertEqual(len({id(e[4]) for e in events}), 1)
+        by_student = get_score_events_by_student('S002')
+        self.assertEqual(len({id(e[0]) for e in by_student}), 1)
+
+    def test_stops_early_without_reading_older_partitions(self):
+        with patch('database.iter_events_between', wraps=database.iter_events_between) as mock_scan:
+            first = next(iter_events())
+        self.assertEqual(first[1], '第5天')
+        self.assertEqual(mock_scan.call_count, 2)  # 3月5日的分区和3月的按月分区
+
+
+class TestCompaction(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        add_student('S001', '张三')
+        add_student('S002', '李四')
+        for day in (date(2024, 3, 30), date(2024, 3, 31), date(2024, 4, 1), date(2024, 4, 2)):
+            add_score_events_bulk(['S001', 'S002'], f'{day.day}日做操', day.day,
+                                  timestamp=datetime(day.year, day.month, day.day, 8))
+        add_score_events_bulk(['S002'], '兑换: 铅笔', -5, 'reward', timestamp=datetime(2024, 3, 31, 9))
+        database.flush_score_events()
+        self.events_dir = os.path.join(self.data_dir, database.SCORE_EVENTS_DIR)
+
+    def snapshot(self):
+        return (get_all_events_in_date_range(), get_score_events_by_student('S002'),
+                search_events_by_rule_name('铅笔'), get_score_totals('2024-03-31', '2024-04-01'))
+
+    def test_reads_are_unchanged(self):
+        before = self.snapshot()
+        self.assertEqual(compact_score_events(today=date(2024, 4, 2)), 3)
+        self.assertEqual(sorted(os.listdir(self.events_dir)),
+                         ['.index', 'catalog.json', 'score_events_2024-03.col', 'score_events_2024-04-02.csv',
+                          'score_events_2024-04.col'])
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(compact_score_events(today=date(2024, 4, 2)), 0)
+
+    def test_backdated_events_merge_into_existing_file(self):
+        compact_score_events(today=date(2024, 4, 2))
+        add_score_events_bulk(['S001'], '补录', 7, timestamp=datetime(2024, 3, 15, 8))
+        database.flush_score_events()
+        self.assertIn('score_events_2024-03-15.csv', os.listdir(self.events_dir))
+        self.assertEqual(compact_score_events(today=date(2024, 4, 2)), 1)
+        self.assertNotIn('score_events_2024-03-15.csv', os.listdir(self.events_dir))
+        self.assertEqual([e[1] for e in get_score_events_by_student('S001')][:2], ['补录', '30日做操'])
+
+        self.assertTrue(delete_student('S001'))
+        self.assertEqual(get_score_events_by_student('S001'), [])
+        self.assertEqual(len(get_all_events_in_date_range()), 5)
+
+    def test_catalog_rebuild_skips_leftover_sources(self):
+        source = os.path.join(self.events_dir, 'score_events_2024-03-30.csv')
+        backup = os.path.join(self.data_dir, 'backup.csv')
+        shutil.copy2(source, backup)
+        compact_score_events(today=date(2024, 4, 2))
+        # 模拟删除来源文件之前程序中断，且分区目录丢失
+        shutil.copy2(backup, source)
+        os.remove(os.path.join(self.events_dir, 'catalog.json'))
+        self.restart()
+        self.assertEqual(len(get_all_events_in_date_range('2024-03-30', '2024-03-30')), 2)
+
+    def test_loaded_partitions_are_shared_between_threads(self):
+        paths = []
+        for month in range(1, 13):
+            path = os.path.join(self.data_dir, f'score_events_2023-{month:02d}.col')
+            database_columnar.ColumnarPartition.from_records(
+                [('S001', '做操+1', month, f'2023-{month:02d}-01 08:00:00', 'score')], []).save(path)
+            paths.append(path)
+        errors = []
+
+        def load_all():
+            try:
+                for _ in range(50):
+                    for month, path in enumerate(paths, 1):
+                        self.assertEqual(database_columnar.load_partition(path).scores[0], month)
+            except Exception as e:
+                errors.append(e)
+
+        with patch.object(database_columnar, '_MAX_LOADED', 3), patch.dict(database_columnar._loaded, clear=True):
+            threads = [threading.Thread(target=load_all) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertLessEqual(len(database_columnar._loaded), 3)
+        self.assertEqual(errors, [])
+        self.assertEqual([name for name in os.listdir(self.data_dir) if name.endswith('.tmp')], [])
+
+
+class TestBinaryArchive(TestCompaction):
+    """以二进制归档格式重复列式压缩的全部测试"""
+
+    def setUp(self):
+        super().setUp()
+        set_setting('score_events_archive_format', 'binary')
+
+    def test_reads_are_unchanged(self):
+        before = self.snapshot()
+        self.assertEqual(compact_score_events(today=date(2024, 4, 2)), 3)
+        self.assertEqual(sorted(os.listdir(self.events_dir)),
+                         ['.index', 'catalog.json', 'score_events_2024-04-02.csv', 'score_events_2024.bin',
+                          'strings.tbl'])
+        self.assertEqual(self.snapshot(), before)
+
+    def test_columnar_files_are_folded_in_and_range_scans_bisect(self):
+        set_setting('score_events_archive_format', 'columnar')
+        compact_score_events(today=date(2024, 4, 1))
+        set_setting('score_events_archive_format', 'binary')
+        self.assertEqual(compact_score_events(today=date(2024, 4, 2)), 2)
+        self.assertEqual(len([name for name in os.listdir(self.events_dir) if name.endswith('.col')]), 0)
+
+        events = list(database_binlog.iter_binlog(os.path.join(self.events_dir, 'score_events_2024.bin'),
+                                                  start_date='2024-03-31', end_date='2024-03-31'))
+        self.assertEqual([row for row, _ in events], [2, 3, 4])
+        self.assertEqual(next(iter_events('2024-03-31', '2024-04-01', order='asc'))[1], '31日做操')
+
+    def test_range_reads_copy_columns(self):
+        compact_score_events(today=date(2024, 4, 2))
+        add_score_events_bulk(['S001', 'S002'], '4日做操', 4, timestamp=datetime(2024, 4, 4, 8))
+        database.flush_score_events()
+        ranges = [(None, None, None), ('2024-03-31', '2024-04-04', None), (None, None, 'reward'),
+                  ('2024-03-31', '2024-03-31', 'score'), ('2024-05-01', None, None)]
+        expected = [list(iter_events(start, end, event_type=event_type)) for start, end, event_type in ranges]
+        with patch.object(database_binlog, 'iter_binlog') as mock_iter, \
+                patch.object(database, 'merge_partitions_by_time') as mock_merge, \
+                patch.object(database, 'read_binlog_columns', wraps=database.read_binlog_columns) as mock_columns:
+            for (start, end, event_type), events in zip(ranges, expected):
+                self.assertEqual(get_all_events_in_date_range(start, end, event_type=event_type), events)
+            mock_iter.assert_not_called()
+            mock_merge.assert_not_called()
+            self.assertEqual(mock_columns.call_count, len(ranges))
+        self.assertEqual([e[1] for e in expected[0]][:4], ['4日做操', '4日做操', '2日做操', '2日做操'])
+
+        # 补录的记录落在归档的时间范围内，按时间归并
+        add_score_events_bulk(['S001'], '补录', 7, timestamp=datetime(2024, 3, 31, 8, 30))
+        database.flush_score_events()
+        events = get_all_events_in_date_range()
+        self.assertEqual(events, list(iter_events()))
+        self.assertEqual([e[1] for e in events][-6:],
+                         ['兑换: 铅笔', '补录', '31日做操', '31日做操', '30日做操', '30日做操'])
+
+        self.assertTrue(delete_student('S002'))
+        self.assertEqual(get_all_events_in_date_range(), list(iter_events()))
+        self.assertEqual({e.student_id for e in get_all_events_in_date_range()}, {'S001'})
+
+    def test_string_table_is_shared_between_threads(self):
+        path = os.path.join(self.data_dir, 'strings.tbl')
+        database_binlog.StringTable(path).intern_many(f'学生{i}' for i in range(2000))
+        for _ in range(20):
+            table = database_binlog.StringTable(path)
+            start = threading.Barrier(4)
+
+            def refresh():
+                start.wait()
+                table.refresh()
+
+            threads = [threading.Thread(target=refresh) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(table.strings), 2000)
+            codes = table.intern_many(['学生1999', '新名称'])
+            self.assertEqual((codes['学生1999'], codes['新名称']), (1999, 2000))
+            self.assertEqual(len(table.strings), 2001)
+            with open(path, 'rb') as f:
+                self.assertNotIn(b'\0', f.read())
+            # 还原为 2000 个字符串
+            with open(path, 'r+b') as f:
+                f.truncate(os.path.getsize(path) - len('"新名称"\n'.encode('utf-8')))
+
+
+class TestEventRecords(DatabaseTestCase):
+
+    def test_event_batch_round_trip(self):
+        events = [('S001', '做操+1', 1, '2024-03-01 08:00:00', 'score'),
+                  ('S002', '做操+1', -3, '2024/3/1 8:00', 'score'),  # 不规范的时间戳原样保留
+                  ('S001', '兑换: 铅笔', -2, '1999-12-31 23:59:59', 'reward')]
+        batch = EventBatch(events)
+        self.assertEqual(batch, events)
+        self.assertEqual(len(batch), 3)
+        self.assertEqual(batch[-1].event_type, 'reward')
+        self.assertEqual(batch[1:], events[1:])
+        self.assertEqual(list(batch.score_changes), [1, -3, -2])
+        columns = batch.columns()
+        self.assertEqual([columns.strings[code] for code in columns.student_codes], ['S001', 'S002', 'S001'])
+        with self.assertRaises(IndexError):
+            batch[3]
+
+    def test_all_event_queries_share_one_shape(self):
+        add_student('S001', '张三')
+        add_reward_event('S001', '铅笔', 2)
+        add_daily_task_events_bulk(['S001'], '背单词', 3, '2024-03-01 08:00:00')
+        reward = database.get_all_reward_events()[0]
+        self.assertEqual((reward.event_name, reward.score_change, reward.event_type), ('铅笔', -2, 'reward'))
+        self.assertEqual(get_all_daily_task_events()[0].event_type, 'daily_task')
+        for event in get_score_events_by_student('S001'):
+            self.assertIsInstance(event, Event)
+            self.assertEqual(len(event), 5)
+
+
+class TestAnalytics(unittest.TestCase):
+
+    EVENTS = [('S001', '做操+1', 1, '2024-03-01 08:00:00', 'score'),
+              ('S002', '做操+1', 1, '2024-03-01 08:05:00', 'score'),
+              ('S001', '迟到-2', -2, '2024-03-02 08:00:00', 'score'),
+              ('S002', '铅笔', -5, '2024/3/2 9:00', 'reward'),
+              ('S003', '背单词', 3, '2024-03-02 18:00:00', 'daily_task')]
+
+    EXPECTED = {
+        'student': {'S001': (-1, 2), 'S002': (-4, 2), 'S003': (3, 1)},
+        'rule': {'做操+1': (2, 2), '迟到-2': (-2, 1), '铅笔': (-5, 1), '背单词': (3, 1)},
+        'day': {'2024-03-01': (2, 2), '2024-03-02': (1, 2), '2024/3/2 9': (-5, 1)},
+        'type': {'score': (0, 3), 'reward': (-5, 1), 'daily_task': (3, 1)},
+    }
+
+    def check(self):
+        batch = EventBatch(self.EVENTS)
+        for by, expected in self.EXPECTED.items():
+            self.assertEqual(database_analytics.group_totals(batch, by), expected, by)
+        self.assertEqual(database_analytics.group_totals(EventBatch(), 'student'), {})
+        self.assertEqual(database_analytics.total_score_change(batch), -2)
+        self.assertEqual(database_analytics.total_score_change(self.EVENTS), -2)
+        self.assertEqual(database_analytics.rank_students(['S001', 'S002', 'S003', 'S004'], {'S001': 2, 'S003': 2, 'S002': 5}),
+                         [('S002', 5), ('S001', 2), ('S003', 2), ('S004', 0)])
+        with self.assertRaises(ValueError):
+            database_analytics.group_totals(batch, 'month')
+
+    def test_python_fallback(self):
+        with patch.object(database_analytics, 'HAS_NUMPY', False):
+            self.check()
+
+    @unittest.skipUnless(database_analytics.HAS_NUMPY, "未安装 NumPy")
+    def test_numpy(self):
+        self.check()
+
+
+class TestWriteQueue(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        add_student('S001', '张三')
+
+    def test_rapid_appends_are_coalesced(self):
+        with patch.object(self.store, '_append_score_event_rows', wraps=self.store._append_score_event_rows) as mock_append:
+            # 写入线程被占用时，后续的事件在队列中合并
+            with self.store._score_events_lock:
+                add_score_event('S001', '做操+1', 1)
+                for _ in range(20):
+                    add_score_event('S001', '发言+2', 2)
+            self.assertTrue(database.flush_score_events())
+        self.assertLessEqual(mock_append.call_count, 2)
+        self.assertEqual(len(get_score_events_by_student('S001')), 21)
+        self.assertEqual(get_student_by_id('S001')[2], 41)
+
+    def test_fsync_policy(self):
+        for policy, synced in (('never', False), ('batch', True)):
+            set_setting('score_events_fsync', policy)
+            with patch('database.os.fsync') as mock_fsync:
+                add_score_event('S001', '做操+1', 1)
+                database.flush_score_events()
+            self.assertEqual(mock_fsync.called, synced, policy)
+
+    def test_future_reports_write_failure(self):
+        future = self.store._score_event_writer.submit([['S001', '做操+1', 1, '2024-03-01 08:00:00', 'score']],
+                                                     {'S001': 1})
+        self.assertTrue(future.result(timeout=5))
+        with patch.object(self.store, '_append_score_event_rows', side_effect=OSError("磁盘已满")):
+            future = self.store._score_event_writer.submit([['S001', '做操+1', 1, '2024-03-01 09:00:00', 'score']],
+                                                         {'S001': 1})
+            self.assertFalse(database.flush_score_events())
+        self.assertIsInstance(future.exception(), OSError)
+        self.assertTrue(database.flush_score_events())
+        self.assertEqual(get_student_by_id('S001')[2], 1)
+
+    def test_balance_reads_do_not_wait_for_writer(self):
+        with self.store._score_events_lock:  # 写入线程被占用
+            add_score_event('S001', '做操+1', 1)
+            add_score_event('S001', '发言+2', 2)
+            with patch.object(self.store._score_event_writer, 'flush', side_effect=AssertionError("不应等待写入线程")):
+                self.assertEqual(get_student_by_id('S001')[2], 3)
+                self.assertEqual(get_all_students(), [('S001', '张三', 3)])
+        self.assertTrue(database.flush_score_events())
+        self.assertEqual(get_student_by_id('S001')[2], 3)
+        self.restart()
+        self.assertEqual(get_student_by_id('S001')[2], 3)
+
+    def test_event_reads_do_not_wait_for_fsync(self):
+        release = threading.Event()
+        with patch('database.os.fsync', side_effect=lambda fd: release.wait(10)):
+            add_score_event('S001', '做操+1', 1)
+            started = time.monotonic()
+            self.assertEqual(len(get_score_events_by_student('S001')), 1)
+            self.assertLess(time.monotonic() - started, 5)
+            release.set()
+            self.assertTrue(database.flush_score_events())
+
+    def test_failed_writes_are_reported(self):
+        with patch.object(self.store, '_append_score_event_rows', side_effect=TimeoutError("数据目录正被其他程序实例修改")):
+            self.assertTrue(add_score_event('S001', '做操+1', 1))
+            self.assertTrue(add_reward_event('S001', '铅笔', 2))
+            self.assertFalse(database.flush_score_events())
+        failures = database.take_write_failures()
+        self.assertEqual(sorted(event.event_name for events, _ in failures for event in events), ['做操+1', '兑换: 铅笔'])
+        self.assertIn('其他程序实例', failures[0][1])
+        self.assertEqual(database.take_write_failures(), [])
+        self.assertEqual(get_student_by_id('S001')[2], 0)
+        # 没有扣分的兑换不能留下兑换记录
+        self.assertEqual(self.read_csv(database.REWARD_EVENTS_FILE)[1:], [])
+
+    def test_side_rows_are_flushed_under_data_dir_lock(self):
+        handles = self.store._append_handles
+        lock_depths = []
+        original_flush = handles.flush
+
+        def flush(*args):
+            if any(entry[2] for entry in handles._handles.values()):  # 只记录有未刷新数据时的刷新
+                lock_depths.append(self.store._dir_lock._depth)
+            original_flush(*args)
+
+        with patch.object(handles, 'flush', side_effect=flush):
+            _, future = self.store._queue_score_events(
+                ['S001'], '兑换: 铅笔', -2, 'reward', '2024-03-01 08:00:00',
+                [(self.store.path(database.REWARD_EVENTS_FILE), ['S001', '铅笔', 2, '2024-03-01 08:00:00'])])
+            self.assertTrue(future.result(timeout=5))
+        self.assertTrue(lock_depths)
+        self.assertNotIn(0, lock_depths)
+        with open(self.store.path(database.REWARD_EVENTS_FILE), 'r', newline='', encoding='utf-8') as f:
+            self.assertEqual(list(csv.reader(f))[1:], [['S001', '铅笔', '2', '2024-03-01 08:00:00']])
+
+    def test_append_handles_are_reused_and_rotated(self):
+        reward_path = os.path.join(self.data_dir, database.REWARD_EVENTS_FILE)
+
+        class Day(date):
+            today = classmethod(lambda cls: date(2024, 3, 1))
+
+        with patch('database.date', Day), patch('database.open', wraps=open, create=True) as mock_open:
+            for _ in range(3):
+                add_reward_event('S001', '铅笔', 1)
+                database.flush_score_events()
+            opened = [call.args[0] for call in mock_open.call_args_list]
+            self.assertEqual(opened.count(reward_path), 1)
+            handle = self.store._append_handles._handles[reward_path][0]
+
+            # 文件被外部改写后重新打开
+            with open(reward_path, 'w', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerow(['student_id', 'reward_name', 'score_cost', 'timestamp'])
+            add_reward_event('S001', '橡皮', 2)
+            database.flush_score_events()
+            self.assertIsNot(self.store._append_handles._handles[reward_path][0], handle)
+            self.assertEqual([row[1] for row in self.read_csv(database.REWARD_EVENTS_FILE)[1:]], ['橡皮'])
+
+            # 跨过午夜后关闭前一天的句柄
+            Day.today = classmethod(lambda cls: date(2024, 3, 2))
+            add_score_events_bulk(['S001'], '做操+1', 1, timestamp=datetime(2024, 3, 2, 8))
+            database.flush_score_events()
+            self.assertNotIn(reward_path, self.store._append_handles._handles)
+        self.assertEqual(len(get_score_events_by_student('S001')), 5)
+
+
+class TestSharedDataDir(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        add_student('S001', '张三')
+        add_student('S002', '李四')
+
+    def other_instance_writes(self, rows):
+        """模拟另一个程序实例改写名册：大小和mtime都不变，只有版本号增加"""
+        path = os.path.join(self.data_dir, database.STUDENTS_FILE)
+        stat = os.stat(path)
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([['student_id', 'name']] + rows)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        lock = database_lock.data_dir_lock(self.data_dir)
+        with lock:
+            lock._write_generation(lock._read_generation() + 1)
+
+    def test_stale_cache_is_reloaded_before_writing(self):
+        self.other_instance_writes([['S001', '王五'], ['S002', '李四']])
+        self.assertTrue(update_student_name('S002', '赵六'))
+        self.assertEqual(self.read_csv(database.STUDENTS_FILE)[1:], [['S001', '王五'], ['S002', '赵六']])
+
+    def open_other_store(self):
+        other = database.DataStore(self.data_dir)
+        self.addCleanup(other.close)
+        return other
+
+    def test_tail_merges_from_both_instances_are_applied_once(self):
+        other = self.open_other_store()
+        timestamp = datetime(2024, 3, 1, 8)
+        add_score_events_bulk(['S001'], '做操+2', 2, timestamp=timestamp)
+        database.flush_score_events()
+        self.assertEqual(other.get_score_totals(event_type='score'), {'S001': 2})
+        for _ in range(2):
+            add_score_events_bulk(['S001'], '做操+2', 2, timestamp=timestamp)
+            database.flush_score_events()
+            # 两个实例都为同一段新增内容记录了合并
+            self.assertEqual(other.get_score_totals(event_type='score'), get_score_totals(event_type='score'))
+        self.assertEqual(other.get_score_totals(event_type='score'), {'S001': 6})
+        self.assertEqual(len(other.get_score_events_by_student('S001')), 3)
+
+        other.close()
+        self.restart()
+        self.assertEqual(get_score_totals(event_type='score'), {'S001': 6})
+        self.assertEqual(get_score_totals(), {'S001': 6})
+        self.assertEqual(len(get_score_events_by_student('S001')), 3)
+
+    def index_files(self):
+        index_dir = os.path.join(self.data_dir, database.SCORE_EVENTS_DIR, database.SCORE_EVENTS_INDEX_DIR)
+        contents = {}
+        for name in os.listdir(index_dir):
+            with open(os.path.join(index_dir, name), 'rb') as f:
+                contents[name] = f.read()
+        return contents
+
+    def test_both_instances_read_and_write(self):
+        other = self.open_other_store()
+        timestamp = datetime(2024, 3, 1, 8)
+        add_score_events_bulk(['S001'], '做操+2', 2, timestamp=timestamp)
+        database.flush_score_events()
+        self.assertEqual(other.get_score_totals(), {'S001': 2})
+        add_score_events_bulk(['S002'], '发言+1', 1, timestamp=timestamp)
+        database.flush_score_events()
+
+        # 数据目录正被写入时，读取发现的新增内容只更新内存中的索引，不写索引文件
+        locked, release = threading.Event(), threading.Event()
+
+        def hold_lock():
+            with database_lock.data_dir_lock(self.data_dir):
+                locked.set()
+                release.wait()
+
+        holder = threading.Thread(target=hold_lock)
+        holder.start()
+        try:
+            locked.wait()
+            before = self.index_files()
+            self.assertEqual(other.get_score_totals(), {'S001': 2, 'S002': 1})
+            self.assertEqual(other.get_score_totals(event_type='score'), {'S001': 2, 'S002': 1})
+            self.assertEqual([e[1] for e in other.search_events_by_rule_name('发言')], ['发言+1'])
+            self.assertEqual(self.index_files(), before)
+        finally:
+            release.set()
+            holder.join()
+
+        for _ in range(3):
+            other.add_score_events_bulk(['S001'], '做操+2', 2, timestamp=timestamp)
+            other.flush_score_events()
+            self.assertEqual(get_score_totals(event_type='score'), other.get_score_totals(event_type='score'))
+            add_score_events_bulk(['S002'], '发言+1', 1, timestamp=timestamp)
+            database.flush_score_events()
+            self.assertEqual(other.get_score_totals(), get_score_totals())
+        expected = {'S001': 8, 'S002': 4}
+        self.assertEqual(other.get_score_totals(event_type='score'), expected)
+        self.assertEqual(len(other.get_score_events_by_student('S002')), 4)
+
+        other.close()
+        self.restart()
+        self.assertEqual(get_score_totals(), expected)
+        self.assertEqual(get_score_totals(event_type='score'), expected)
+        self.assertEqual(len(get_score_events_by_student('S001')), 4)
+        self.assertEqual(len(search_events_by_rule_name('发言')), 4)
+
+    def test_writers_wait_for_other_process(self):
+        script = ("import sys, time; sys.path.insert(0, sys.argv[1]); import database_lock; "
+                  "lock = database_lock.DataDirLock(sys.argv[2]); lock.acquire(); print('locked', flush=True); "
+                  "time.sleep(30)")
+        holder = subprocess.Popen([sys.executable, '-c', script, os.path.dirname(os.path.abspath(__file__)),
+                                   self.data_dir], stdout=subprocess.PIPE, text=True)
+        self.addCleanup(holder.wait)
+        self.addCleanup(holder.kill)
+        self.assertEqual(holder.stdout.readline().strip(), 'locked')
+
+        with patch.object(database_lock.DataDirLock, 'TIMEOUT', 0.2):
+            self.assertFalse(update_student_name('S001', '王五'))
+        # 读取不需要等待写锁
+        self.assertEqual(get_student_by_id('S001')[1], '张三')
+
+        holder.kill()
+        holder.wait()
+        self.assertTrue(update_student_name('S001', '王五'))
+
+
+class TestStudentDeletion(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for student_id in ('S001', 'S002', 'S003'):
+            add_student(student_id)
+        for day in (1, 2, 3):
+            add_score_events_bulk(['S001', 'S002'], '做操+1', 1, timestamp=datetime(2024, 3, day, 8))
+        add_score_events_bulk(['S003'], '发言+2', 2, timestamp=datetime(2024, 3, 4, 8))
+        self.events_dir = os.path.join(self.data_dir, database.SCORE_EVENTS_DIR)
+
+    def test_deletion_only_records_tombstone(self):
+        with patch('database._atomic_write_csv', wraps=database._atomic_write_csv) as mock_write:
+            self.assertTrue(delete_student('S001'))
+            self.assertTrue(delete_student('S002'))
+        rewritten = [call.args[0] for call in mock_write.call_args_list]
+        self.assertFalse([path for path in rewritten if path.startswith(self.events_dir)])
+
+        self.assertEqual(get_score_events_by_student('S001'), [])
+        self.assertEqual([e.student_id for e in get_all_events_in_date_range()], ['S003'])
+        self.assertEqual(get_score_totals(), {'S003': 2})
+        self.assertEqual(get_score_totals(event_type='score'), {'S003': 2})
+        self.assertEqual(len(search_events_by_rule_name('做操')), 0)
+
+    def test_purge_rewrites_each_affected_partition_once(self):
+        delete_student('S001')
+        delete_student('S002')
+        with patch('database._atomic_write_csv', wraps=database._atomic_write_csv) as mock_write:
+            self.assertEqual(purge_deleted_students(), 3)
+        rewritten = sorted(os.path.basename(call.args[0]) for call in mock_write.call_args_list)
+        self.assertEqual(rewritten, [f'score_events_2024-03-0{day}.csv' for day in (1, 2, 3)])
+        self.assertEqual(self.read_csv(database.SCORE_EVENTS_DIR, 'score_events_2024-03-01.csv'),
+                         [database.EVENT_HEADERS])
+        self.assertEqual(purge_deleted_students(), 0)
+        self.assertEqual([e.student_id for e in get_all_events_in_date_range()], ['S003'])
+
+    def test_readding_student_purges_old_events(self):
+        delete_student('S001')
+        self.assertTrue(add_student('S001', '张三'))
+        add_score_event('S001', '发言+2', 2)
+        self.assertEqual([e.event_name for e in get_score_events_by_student('S001')], ['发言+2'])
+
+
+class TestRuleCatalog(DatabaseTestCase):
+
+    def test_lookups_are_served_from_memory(self):
+        self.assertTrue(add_score_rule('做操', 1))
+        self.assertFalse(add_score_rule('做操', 2))
+        self.assertTrue(database.add_reward_rule('铅笔', 2))
+        with patch.object(database.RuleCatalog, '_load', wraps=database.RuleCatalog._load) as mock_load:
+            for _ in range(3):
+                self.assertEqual(database.get_score_rule_by_name('做操'), ('做操', 1))
+                self.assertEqual(database.get_all_reward_rules_names(), ['铅笔'])
+                self.assertIsNone(database.get_daily_task_rule_by_name('背单词'))
+        self.assertEqual(mock_load.call_count, 1)  # 只有从未读取过的每日任务规则需要读取文件
+        self.assertTrue(database.delete_score_rule('做操'))
+        self.assertFalse(database.delete_score_rule('做操'))
+        self.assertEqual(self.read_csv(database.SCORE_RULES_FILE), [['rule_name', 'score_value']])
+
+    def test_external_edit_is_picked_up(self):
+        add_score_rule('做操', 1)
+        self.assertEqual(get_all_score_rules(), [('做操', 1)])
+        with open(os.path.join(self.data_dir, database.SCORE_RULES_FILE), 'a', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerow(['发言', 2])
+        self.assertEqual(get_all_score_rules(), [('做操', 1), ('发言', 2)])
+
+
+class TestSettings(DatabaseTestCase):
+
+    def read_settings(self):
+        with open(os.path.join(self.data_dir, database.SETTINGS_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_writes_are_coalesced(self):
+        with patch.object(database, 'replace_file', wraps=database.replace_file) as mock_replace:
+            set_setting('score_events_partition', 'month')
+            set_setting('theme', 'dark')
+            set_setting('theme', 'light')
+            self.assertEqual(database.get_setting('theme'), 'light')
+            self.assertEqual(self.read_settings(), {})  # init_db 创建的空文件
+            self.store._settings.flush()
+        self.assertEqual(mock_replace.call_count, 1)
+        self.assertEqual(self.read_settings(), {'score_events_partition': 'month', 'theme': 'light'})
+        self.assertEqual(os.listdir(self.data_dir).count(database.SETTINGS_FILE + '.tmp'), 0)
+
+    def test_reads_are_served_from_memory(self):
+        set_setting('theme', 'dark')
+        self.store._settings.flush()
+        with patch.object(database._SettingsStore, '_read', wraps=database._SettingsStore._read) as mock_read:
+            for _ in range(3):
+                self.assertEqual(database.get_setting('theme'), 'dark')
+                self.assertEqual(database.get_setting('missing', 'x'), 'x')
+        self.assertEqual(mock_read.call_count, 0)
+
+    def test_external_edit_is_picked_up(self):
+        set_setting('theme', 'dark')
+        self.store._settings.flush()
+        path = os.path.join(self.data_dir, database.SETTINGS_FILE)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'theme': 'light', 'language': 'zh'}, f)
+        os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+        self.assertEqual(database.get_setting('theme'), 'light')
+        # 尚未写入的修改与其他实例写入的设置合并
+        set_setting('font', 'large')
+        self.store._settings.flush()
+        self.assertEqual(self.read_settings(), {'theme': 'light', 'language': 'zh', 'font': 'large'})
+
+    def test_pending_changes_are_written_after_delay(self):
+        with patch.object(database._SettingsStore, 'WRITE_DELAY', 0.01):
+            set_setting('theme', 'dark')
+            deadline = time.monotonic() + 5
+            while self.read_settings() != {'theme': 'dark'}:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+
+
+class TestDataStore(DatabaseTestCase):
+
+    def test_stores_are_isolated(self):
+        other_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, other_dir, ignore_errors=True)
+        other = database.DataStore(other_dir)
+        self.addCleanup(other.close)
+        other.init_db()
+        with patch('database.get_data_dir') as mock_get_data_dir:
+            add_student('S001', '张三')
+            add_score_event('S001', '做操+1', 1)
+            self.assertTrue(other.add_student('S001', '李四'))
+            other.add_score_events_bulk(['S001'], '发言+2', 2)
+            self.assertEqual(get_all_students(), [('S001', '张三', 1)])
+            self.assertEqual(other.get_all_students(), [('S001', '李四', 2)])
+            self.assertEqual([e.event_name for e in other.get_score_events_by_student('S001')], ['发言+2'])
+            mock_get_data_dir.assert_not_called()
+
+    def test_default_store_resolves_data_dir_once(self):
+        with patch('database._default_store', None), \
+                patch('database.get_data_dir', return_value=self.data_dir) as mock_get_data_dir:
+            store = database.default_store()
+            self.addCleanup(store.close)
+            self.assertIs(database.default_store(), store)
+            self.assertEqual(database.get_file_path(database.STUDENTS_FILE),
+                             os.path.join(self.data_dir, database.STUDENTS_FILE))
+            self.assertEqual(get_all_students(), [])
+        self.assertEqual(mock_get_data_dir.call_count, 1)
+
+    def test_close_stops_writer_thread(self):
+        add_student('S001', '张三')
+        add_score_event('S001', '做操+1', 1)
+        thread = self.store._score_event_writer._thread
+        self.store.close()
+        thread.join(timeout=5)
+        self.assertFalse(thread.is_alive())
+        # 关闭后仍可继续使用，写入线程按需重新启动
+        add_score_event('S001', '做操+1', 1)
+        self.assertEqual(get_student_by_id('S001')[2], 2)
+
+
+class TestScoreEventImport(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        add_student('S001', '张三')
+        add_student('S002', '李四')
+        self.csv_path = os.path.join(self.data_dir, 'history.csv')
+        with open(self.csv_path, 'w', newline='', encoding='gbk') as f:
+            writer = csv.writer(f)
+            writer.writerow(['学号', '事件名称', '积分变化', '时间', '事件类型'])
+            writer.writerow(['S001', '做操+1', '1', '2023-09-01 08:00:00', 'score'])
+            writer.writerow(['S002', '发言+2', '2', '2023-09-02 09:00:00', ''])
+            writer.writerow(['S003', '做操+1', '1', '2023-09-01 08:00:00', 'score'])
+            writer.writerow(['S001', '兑换铅笔', '-2', '2023-09-03 10:00:00', 'reward'])
+            writer.writerow(['S001', '做操+1', 'x', '2023-09-01 08:00:00', 'score'])
+            writer.writerow(['S001', '做操+1', '1', '2023-09-31 08:00:00', 'score'])
+            writer.writerow(['S002', '发言+2', '2', '2023-09-01 10:00:00', 'unknown'])
+
+    def test_dry_run_reports_errors_without_writing(self):
+        imported, skipped, errors = database.import_score_events_from_csv(self.csv_path, dry_run=True)
+        self.assertEqual((imported, skipped), (3, 4))
+        self.assertEqual([error.split(':')[0] for error in errors], ['第4行', '第6行', '第7行', '第8行'])
+        self.assertIn('S003', errors[0])
+        self.assertEqual(get_all_events_in_date_range(), [])
+        self.assertEqual(get_student_by_id('S001')[2], 0)
+
+    def test_events_are_written_to_their_own_partitions(self):
+        with patch.object(self.store._balance_store, 'set_many',
+                          wraps=self.store._balance_store.set_many) as mock_set_many:
+            imported, skipped, _ = database.import_score_events_from_csv(self.csv_path)
+        self.assertEqual((imported, skipped), (3, 4))
+        self.assertEqual(mock_set_many.call_count, 1)
+        partitions = [name for name in os.listdir(os.path.join(self.data_dir, database.SCORE_EVENTS_DIR))
+                      if name.endswith('.csv')]
+        self.assertEqual(sorted(partitions), [f'score_events_2023-09-0{day}.csv' for day in (1, 2, 3)])
+        self.assertEqual(self.read_csv(database.SCORE_EVENTS_DIR, 'score_events_2023-09-02.csv')[1],
+                         ['S002', '发言+2', '2', '2023-09-02 09:00:00', 'score'])
+        self.assertEqual(get_student_by_id('S001')[2], -1)
+        self.assertEqual(get_student_by_id('S002')[2], 2)
+        self.assertEqual(get_score_totals('2023-09-01', '2023-09-02'), {'S001': 1, 'S002': 2})
+        self.restart()
+        self.assertEqual(get_student_by_id('S001')[2], -1)
+        self.assertEqual(len(get_all_events_in_date_range('2023-09-01', '2023-09-30')), 3)
+
+    def test_encoding_is_detected_from_whole_file(self):
+        # GBK 文件的开头超过 64KB 都是ASCII，中文只出现在末尾
+        path = os.path.join(self.data_dir, 'late_gbk.csv')
+        with open(path, 'w', newline='', encoding='gbk') as f:
+            writer = csv.writer(f)
+            for i in range(3000):
+                writer.writerow(['S001', 'late', '1', f'2023-10-01 08:{i // 60 % 60:02d}:{i % 60:02d}', 'score'])
+            writer.writerow(['S002', '发言+2', '2', '2023-10-02 08:00:00', 'score'])
+        self.assertGreater(os.path.getsize(path), 1 << 16)
+        with patch.object(database.DataStore, 'IMPORT_BATCH_ROWS', 1000):
+            self.assertEqual(database.import_score_events_from_csv(path), (3001, 0, []))
+        self.assertEqual([e.event_name for e in get_score_events_by_student('S002')], ['发言+2'])
+        self.assertEqual(get_student_by_id('S001')[2], 3000)
+
+    def test_import_rows_in_batches(self):
+        rows = [('S001', '做操+1', 1, f'2023-10-{day:02d} 08:00:00') for day in range(1, 11)]
+        with patch.object(database.DataStore, 'IMPORT_BATCH_ROWS', 3), \
+                patch.object(self.store, '_append_score_event_rows',
+                             wraps=self.store._append_score_event_rows) as mock_append:
+            self.assertEqual(database.import_score_events(rows), (10, 0, []))
+        self.assertEqual(mock_append.call_count, 4)
+        self.assertEqual(get_student_by_id('S001')[2], 10)
+        self.assertEqual(get_score_totals('2023-10-01', '2023-10-31'), {'S001': 10})
+
+
+class TestEventExport(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        add_student('S001', '张三')
+        add_student('S002')
+        rows = [(('S001', 'S002')[day % 2], '做操+1', 1, f'2024-01-{day:02d} 08:00:00') for day in range(1, 31)]
+        database.import_score_events(rows)
+        add_reward_event('S001', '铅笔', 2)
+
+    def test_export_streams_filtered_events(self):
+        path = os.path.join(self.data_dir, 'export.csv')
+        progress = []
+        with patch.object(database.DataStore, 'EXPORT_CHUNK_ROWS', 4):
+            count = database.export_events(path, '2024-01-01', '2024-01-10', student_id='S001',
+                                           progress=progress.append)
+        self.assertEqual(count, 5)
+        self.assertEqual(progress, [4, 5])
+        with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], database.EXPORT_HEADERS)
+        self.assertEqual(rows[1], ['S001', '张三', '做操+1', '+1', '2024-01-10 08:00:00', '积分记录'])
+        self.assertEqual([row[4][:10] for row in rows[1:]], [f'2024-01-{day:02d}' for day in (10, 8, 6, 4, 2)])
+        self.assertFalse(os.path.exists(path + '.tmp'))
+
+    def test_compressed_export(self):
+        path = os.path.join(self.data_dir, 'export.csv.gz')
+        self.assertEqual(database.export_events(path, event_type='reward'), 1)
+        with gzip.open(path, 'rt', newline='', encoding='utf-8-sig') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[1][1:4], ['张三', '兑换: 铅笔', '-2'])
+        self.assertEqual(rows[1][5], '兑换记录')
+
+    def test_cancel_removes_partial_file(self):
+        path = os.path.join(self.data_dir, 'export.csv')
+        cancel = threading.Event()
+        with patch.object(database.DataStore, 'EXPORT_CHUNK_ROWS', 4):
+            self.assertIsNone(database.export_events(path, progress=lambda count: cancel.set(), cancel=cancel))
+        self.assertEqual([name for name in os.listdir(self.data_dir) if name.startswith('export')], [])
+
+
+class TestSQLiteBackend(DatabaseTestCase):
+
+    def test_migrate_keeps_history(self):
+        add_student('S001', '张三')
+        add_student('S002', '李四')
+        add_score_rule('做操+1', 1)
+        add_score_event('S001', '做操+1', 1)
+        add_reward_event('S002', '铅笔', 2)
+        csv_events = get_all_events_in_date_range()
+
+        counts = migrate_csv_to_sqlite()
+        self.assertIsNotNone(self.store._get_sqlite_store())
+        self.assertEqual(counts['students'], 2)
+        self.assertEqual(counts['score_events'], 2)
+        self.assertEqual(get_all_students(), [('S001', '张三', 1), ('S002', '李四', -2)])
+        self.assertEqual(get_all_score_rules(), [('做操+1', 1)])
+        self.assertEqual(sorted(get_all_events_in_date_range()), sorted(csv_events))
+        with self.assertRaises(ValueError):
+            migrate_csv_to_sqlite()
+
+    def test_migrate_refuses_network_data_dir(self):
+        add_student('S001', '张三')
+        with patch.object(database, 'is_network_path', return_value=True):
+            with self.assertRaises(ValueError):
+                migrate_csv_to_sqlite()
+        self.assertFalse(os.path.exists(os.path.join(self.data_dir, 'score_manager.db')))
+        self.assertIsNone(self.store._get_sqlite_store())
+
+    def test_network_path_detection(self):
+        mounts = ('/dev/sda1 / ext4 rw 0 0\n'
+                  '//server/share /mnt/class\\040data cifs rw 0 0\n'
+                  'server:/export /mnt/nfs nfs4 rw 0 0\n')
+        realpath = patch.object(database_lock.os.path, 'realpath', lambda path: path)
+        with patch('builtins.open', mock_open(read_data=mounts)), realpath:
+            self.assertTrue(database_lock.is_network_path('/mnt/class data/data'))
+            self.assertTrue(database_lock.is_network_path('/mnt/nfs'))
+            self.assertFalse(database_lock.is_network_path('/mnt/nfs2'))
+            self.assertFalse(database_lock.is_network_path('/home/teacher/data'))
+
+    def test_sqlite_api(self):
+        set_setting('storage_backend', 'sqlite')
+        self.assertTrue(add_student('S001', '张三'))
+        self.assertFalse(add_student('S001', '张三'))
+        add_score_events_bulk(['S001', 'S999'], '做操+1', 1, timestamp=datetime(2024, 3, 1, 8))
+        add_daily_task_events_bulk(['S001'], '背单词', 3, '2024-03-02 08:00:00')
+        self.assertEqual(get_student_by_id('S001'), ('S001', '张三', 4))
+        self.assertEqual(len(get_all_events_in_date_range('2024-03-01', '2024-03-01')), 1)
+        self.assertEqual([e[1] for e in search_events_by_rule_name('单词')], ['每日任务: 背单词'])
+        self.assertEqual([e[1] for e in iter_events(order='asc')], ['做操+1', '每日任务: 背单词'])
+        self.assertEqual(get_score_totals('2024-03-01', '2024-03-01'), {'S001': 1})
+        self.assertTrue(delete_student('S001'))
+        self.assertEqual(get_score_events_by_student('S001'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
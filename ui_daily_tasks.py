@@ -3,7 +3,7 @@ from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineE
                              QHeaderView, QDateEdit, QListWidget, QCheckBox, QScrollArea, QFrame)
 from PySide6.QtCore import Qt, QDate
 from datetime import datetime
-from database import (get_all_students, get_all_daily_task_rules, add_daily_task_event, 
+from database import (get_all_students, get_all_daily_task_rules, add_daily_task_events_bulk, 
                      get_all_daily_task_events)
 
 class DailyTasksPage(QWidget):
@@ -181,18 +181,9 @@ class DailyTasksPage(QWidget):
             return
 
         # 批量记分
-        success_count = 0
-        failed_students = []
-
-        for student_id in selected_students:
-            try:
-                if add_daily_task_event(student_id, task_name, score_value, timestamp):
-                    success_count += 1
-                else:
-                    failed_students.append(student_id)
-            except Exception as e:
-                failed_students.append(student_id)
-                print(f"为学生 {student_id} 记分失败: {e}")
+        results = add_daily_task_events_bulk(selected_students, task_name, score_value, timestamp)
+        success_count = sum(1 for _, ok in results if ok)
+        failed_students = [student_id for student_id, ok in results if not ok]
 
         # 显示结果
         if success_count > 0:
@@ -223,14 +214,14 @@ class DailyTasksPage(QWidget):
 
         # 获取所有每日任务事件，然后筛选指定学生
         all_tasks = get_all_daily_task_events()
-        student_tasks = [t for t in all_tasks if t[0] == student_id]
+        student_tasks = [t for t in all_tasks if t.student_id == student_id]
         
         self.history_table.setRowCount(len(student_tasks))
         for i, task in enumerate(student_tasks):
-            self.history_table.setItem(i, 0, QTableWidgetItem(task[0]))  # 学号
-            self.history_table.setItem(i, 1, QTableWidgetItem(task[1]))  # 任务名称
-            self.history_table.setItem(i, 2, QTableWidgetItem(f"+{task[2]}"))  # 积分奖励
-            self.history_table.setItem(i, 3, QTableWidgetItem(task[3]))  # 时间
+            self.history_table.setItem(i, 0, QTableWidgetItem(task.student_id))  # 学号
+            self.history_table.setItem(i, 1, QTableWidgetItem(task.event_name))  # 任务名称
+            self.history_table.setItem(i, 2, QTableWidgetItem(f"+{task.score_change}"))  # 积分奖励
+            self.history_table.setItem(i, 3, QTableWidgetItem(task.timestamp))  # 时间
 
     def load_all_task_history(self):
         """加载所有每日任务历史"""
@@ -240,8 +231,8 @@ class DailyTasksPage(QWidget):
         tasks = get_all_daily_task_events()
         self.history_table.setRowCount(len(tasks))
         for i, task in enumerate(tasks):
-            self.history_table.setItem(i, 0, QTableWidgetItem(task[0]))  # 学号
-            self.history_table.setItem(i, 1, QTableWidgetItem(task[1]))  # 任务名称
-            self.history_table.setItem(i, 2, QTableWidgetItem(f"+{task[2]}"))  # 积分奖励
-            self.history_table.setItem(i, 3, QTableWidgetItem(task[3]))  # 时间
+            self.history_table.setItem(i, 0, QTableWidgetItem(task.student_id))  # 学号
+            self.history_table.setItem(i, 1, QTableWidgetItem(task.event_name))  # 任务名称
+            self.history_table.setItem(i, 2, QTableWidgetItem(f"+{task.score_change}"))  # 积分奖励
+            self.history_table.setItem(i, 3, QTableWidgetItem(task.timestamp))  # 时间
 
@@ -1,10 +1,21 @@
 from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineEdit, 
                              QPushButton, QComboBox, QMessageBox, QTableWidget, QTableWidgetItem, 
-                             QHeaderView, QDateEdit, QCheckBox, QGroupBox, QFormLayout)
-from PySide6.QtCore import Qt, QDate
+                             QHeaderView, QDateEdit, QCheckBox, QGroupBox, QFormLayout, QFileDialog,
+                             QProgressDialog)
+from PySide6.QtCore import Qt, QDate, QObject, Signal
 from datetime import datetime, timedelta
+import threading
 from database import (get_all_students, get_all_events_in_date_range, search_events_by_rule_name,
-                     get_all_score_rules_names, get_all_reward_rules_names, get_all_daily_task_rules_names)
+                     get_all_score_rules_names, get_all_reward_rules_names, get_all_daily_task_rules_names,
+                     export_events, EVENT_TYPE_NAMES)
+from database_analytics import total_score_change
+
+
+class ExportSignals(QObject):
+    """后台导出线程通知界面的信号，跨线程发出时由Qt排队到界面线程处理"""
+    progress = Signal(int)  # 已导出条数
+    finished = Signal(object, str)  # 导出条数（取消时为 None），错误信息
+
 
 class HistoryPage(QWidget):
     def __init__(self):
@@ -149,38 +160,36 @@ class HistoryPage(QWidget):
         for rule in task_rules:
             self.rule_combo.addItem(f"[任务] {rule}", rule)
 
+    def current_filters(self):
+        """当前的筛选条件: (start_date, end_date, student_id, event_type, rule_name)"""
+        start_date = self.start_date_edit.date().toString("yyyy-MM-dd")
+        end_date = self.end_date_edit.date().toString("yyyy-MM-dd")
+
+        student_id = None
+        if self.student_filter_checkbox.isChecked():
+            student_id = self.student_combo.currentData()
+
+        event_type = None
+        if self.event_type_filter_checkbox.isChecked():
+            event_type = self.event_type_combo.currentData()
+
+        rule_name = None
+        if self.rule_filter_checkbox.isChecked():
+            rule_name = self.rule_combo.currentText()
+            if rule_name.startswith("["):
+                # 移除前缀
+                rule_name = rule_name.split("] ", 1)[1] if "] " in rule_name else rule_name
+        return start_date, end_date, student_id, event_type, rule_name
+
     def search_history(self):
         """执行历史记录查询"""
         try:
             # 获取筛选条件
-            start_date = self.start_date_edit.date().toString("yyyy-MM-dd")
-            end_date = self.end_date_edit.date().toString("yyyy-MM-dd")
-            
-            student_id = None
-            if self.student_filter_checkbox.isChecked():
-                student_id = self.student_combo.currentData()
-            
-            event_type = None
-            if self.event_type_filter_checkbox.isChecked():
-                event_type = self.event_type_combo.currentData()
+            start_date, end_date, student_id, event_type, rule_name = self.current_filters()
             
             # 执行查询
-            if self.rule_filter_checkbox.isChecked():
-                rule_name = self.rule_combo.currentText()
-                if rule_name.startswith("["):
-                    # 移除前缀
-                    rule_name = rule_name.split("] ", 1)[1] if "] " in rule_name else rule_name
-                events = search_events_by_rule_name(rule_name, start_date, end_date)
-                # 如果还有其他筛选条件，进一步过滤
-                if student_id or event_type:
-                    filtered_events = []
-                    for event in events:
-                        if student_id and event[0] != student_id:
-                            continue
-                        if event_type and event[4] != event_type:
-                            continue
-                        filtered_events.append(event)
-                    events = filtered_events
+            if rule_name is not None:
+                events = search_events_by_rule_name(rule_name, start_date, end_date, student_id, event_type)
             else:
                 events = get_all_events_in_date_range(start_date, end_date, student_id, event_type)
             
@@ -199,13 +208,6 @@ class HistoryPage(QWidget):
         students = get_all_students()
         student_names = {sid: name for sid, name, _ in students}
         
-        # 事件类型映射
-        event_type_map = {
-            "score": "积分记录",
-            "reward": "兑换记录", 
-            "daily_task": "每日任务"
-        }
-        
         for i, event in enumerate(events):
             student_id, event_name, score_change, timestamp, event_type = event
             
@@ -232,13 +234,13 @@ class HistoryPage(QWidget):
             self.result_table.setItem(i, 4, QTableWidgetItem(timestamp))
             
             # 事件类型
-            type_text = event_type_map.get(event_type, event_type)
+            type_text = EVENT_TYPE_NAMES.get(event_type, event_type)
             self.result_table.setItem(i, 5, QTableWidgetItem(type_text))
         
         # 更新统计信息
         total_records = len(events)
-        total_score_change = sum(event[2] for event in events)
-        self.result_stats_label.setText(f"查询结果: {total_records} 条记录，总积分变化: {total_score_change:+d}")
+        score_total = total_score_change(events)
+        self.result_stats_label.setText(f"查询结果: {total_records} 条记录，总积分变化: {score_total:+d}")
 
     def reset_filters(self):
         """重置筛选条件"""
@@ -260,42 +262,56 @@ class HistoryPage(QWidget):
         self.search_history()
 
     def export_results(self):
-        """导出查询结果"""
-        try:
-            from PySide6.QtWidgets import QFileDialog
-            import csv
-            
-            # 选择保存文件
-            file_path, _ = QFileDialog.getSaveFileName(
-                self, 
-                "导出查询结果", 
-                f"历史记录_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                "CSV文件 (*.csv);;所有文件 (*)"
-            )
-            
-            if not file_path:
-                return
-            
-            # 导出数据
-            with open(file_path, 'w', newline='', encoding='utf-8-sig') as f:
-                writer = csv.writer(f)
-                
-                # 写入标题行
-                headers = ["学号", "学生姓名", "事件名称", "积分变化", "时间", "事件类型"]
-                writer.writerow(headers)
-                
-                # 写入数据行
-                for row in range(self.result_table.rowCount()):
-                    row_data = []
-                    for col in range(self.result_table.columnCount()):
-                        item = self.result_table.item(row, col)
-                        row_data.append(item.text() if item else "")
-                    writer.writerow(row_data)
-            
-            QMessageBox.information(self, "导出成功", f"查询结果已导出到：\n{file_path}")
-            
-        except Exception as e:
-            QMessageBox.critical(self, "导出错误", f"导出查询结果时发生错误：\n{str(e)}")
+        """
+        按当前筛选条件导出历史记录
+        在后台线程中直接从数据层分块读取并写出，不经过结果表格，导出期间界面保持响应，可随时取消
+        """
+        # 选择保存文件
+        file_path, selected_filter = QFileDialog.getSaveFileName(
+            self, 
+            "导出查询结果", 
+            f"历史记录_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+            "CSV文件 (*.csv);;压缩CSV文件 (*.csv.gz);;所有文件 (*)"
+        )
+        
+        if not file_path:
+            return
+        if selected_filter.startswith("压缩") and not file_path.lower().endswith(".gz"):
+            file_path += ".gz"
+
+        start_date, end_date, student_id, event_type, rule_name = self.current_filters()
+        cancel = threading.Event()
+
+        self.export_dialog = QProgressDialog("正在导出历史记录...", "取消", 0, 0, self)
+        self.export_dialog.setWindowTitle("导出查询结果")
+        self.export_dialog.setWindowModality(Qt.WindowModal)
+        self.export_dialog.setMinimumDuration(0)
+        self.export_dialog.canceled.connect(cancel.set)
+
+        self.export_signals = ExportSignals()
+        self.export_signals.progress.connect(
+            lambda count: self.export_dialog.setLabelText(f"正在导出历史记录... 已导出 {count} 条"))
+        self.export_signals.finished.connect(lambda count, error: self.export_finished(file_path, count, error))
+        self.export_btn.setEnabled(False)
+
+        def run():
+            try:
+                count = export_events(file_path, start_date, end_date, student_id, event_type, rule_name,
+                                      progress=self.export_signals.progress.emit, cancel=cancel)
+                self.export_signals.finished.emit(count, "")
+            except Exception as e:
+                self.export_signals.finished.emit(None, str(e))
+
+        threading.Thread(target=run, name="history-export", daemon=True).start()
+
+    def export_finished(self, file_path, count, error):
+        """后台导出结束（完成、取消或出错）后在界面线程中调用"""
+        self.export_dialog.reset()
+        self.export_btn.setEnabled(True)
+        if error:
+            QMessageBox.critical(self, "导出错误", f"导出查询结果时发生错误：\n{error}")
+        elif count is not None:
+            QMessageBox.information(self, "导出成功", f"已导出 {count} 条记录到：\n{file_path}")
 
     def load_data(self):
         """刷新数据"""
@@ -1,7 +1,8 @@
 from PySide6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QTableWidget, QTableWidgetItem, QHeaderView, QDateEdit, QPushButton
 from PySide6.QtCore import Qt, QDate
 from datetime import datetime, timedelta
-from database import get_all_students, get_all_events_in_date_range
+from database import get_all_students, get_score_totals
+from database_analytics import rank_students
 
 class MainPage(QWidget):
     def __init__(self):
@@ -78,28 +79,20 @@ class MainPage(QWidget):
 
         # 获取所有学生
         students = get_all_students()
-        student_info = {sid: {"name": name, "current_score": score} for sid, name, score in students}
         
-        # 获取指定时间范围内的所有事件
-        events = get_all_events_in_date_range(start_date, end_date)
-        
-        # 计算每个学生在指定时间范围内的积分变化
-        student_scores = {}
+        # 获取每个学生在指定时间范围内的积分变化合计
+        totals = get_score_totals(start_date, end_date)
+        student_names = {}
         for student_id, name, current_score in students:
-            student_scores[student_id] = {"name": name, "score": 0}
-        
-        # 累计积分变化
-        for event in events:
-            student_id, event_name, score_change, timestamp, event_type = event
-            if student_id in student_scores:
-                student_scores[student_id]["score"] += score_change
+            student_names[student_id] = name
 
         # 根据积分排序（从高到低）
-        sorted_students = sorted(student_scores.items(), key=lambda item: item[1]["score"], reverse=True)
+        sorted_students = rank_students(list(student_names), totals)
 
         # 设置表格行数
         self.ranking_table.setRowCount(len(sorted_students))
-        for i, (student_id, data) in enumerate(sorted_students):
+        for i, (student_id, score) in enumerate(sorted_students):
+            data = {"name": student_names[student_id], "score": score}
             # 排名
             rank_item = QTableWidgetItem(str(i + 1))
             rank_item.setTextAlignment(Qt.AlignCenter)
@@ -140,14 +140,14 @@ class RewardsPage(QWidget):
 
         # 获取所有兑换事件，然后筛选指定学生
         all_rewards = get_all_reward_events()
-        student_rewards = [r for r in all_rewards if r[0] == student_id]
+        student_rewards = [r for r in all_rewards if r.student_id == student_id]
         
         self.history_table.setRowCount(len(student_rewards))
         for i, reward in enumerate(student_rewards):
-            self.history_table.setItem(i, 0, QTableWidgetItem(reward[0]))  # 学号
-            self.history_table.setItem(i, 1, QTableWidgetItem(reward[1]))  # 兑换项目
-            self.history_table.setItem(i, 2, QTableWidgetItem(f"{reward[2]}"))  # 积分消耗
-            self.history_table.setItem(i, 3, QTableWidgetItem(reward[3]))  # 时间
+            self.history_table.setItem(i, 0, QTableWidgetItem(reward.student_id))  # 学号
+            self.history_table.setItem(i, 1, QTableWidgetItem(reward.event_name))  # 兑换项目
+            self.history_table.setItem(i, 2, QTableWidgetItem(f"{-reward.score_change}"))  # 积分消耗
+            self.history_table.setItem(i, 3, QTableWidgetItem(reward.timestamp))  # 时间
 
     def load_all_reward_history(self):
         """加载所有兑换历史"""
@@ -157,7 +157,7 @@ class RewardsPage(QWidget):
         rewards = get_all_reward_events()
         self.history_table.setRowCount(len(rewards))
         for i, reward in enumerate(rewards):
-            self.history_table.setItem(i, 0, QTableWidgetItem(reward[0]))  # 学号
-            self.history_table.setItem(i, 1, QTableWidgetItem(reward[1]))  # 兑换项目
-            self.history_table.setItem(i, 2, QTableWidgetItem(f"{reward[2]}"))  # 积分消耗
-            self.history_table.setItem(i, 3, QTableWidgetItem(reward[3]))  # 时间
\ No newline at end of file
+            self.history_table.setItem(i, 0, QTableWidgetItem(reward.student_id))  # 学号
+            self.history_table.setItem(i, 1, QTableWidgetItem(reward.event_name))  # 兑换项目
+            self.history_table.setItem(i, 2, QTableWidgetItem(f"{-reward.score_change}"))  # 积分消耗
+            self.history_table.setItem(i, 3, QTableWidgetItem(reward.timestamp))  # 时间
\ No newline at end of file
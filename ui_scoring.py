@@ -2,7 +2,7 @@ from PySide6.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, QLineE
                              QPushButton, QComboBox, QTextEdit, QMessageBox, QTableWidget, 
                              QTableWidgetItem, QHeaderView, QCheckBox, QScrollArea)
 from PySide6.QtCore import Qt
-from database import get_all_students, get_all_score_rules, add_score_event, get_score_events_by_student
+from database import get_all_students, get_all_score_rules, add_score_event, add_score_events_bulk, get_score_events_by_student
 
 class ScoringPage(QWidget):
     def __init__(self):
@@ -235,17 +235,9 @@ class ScoringPage(QWidget):
         if reply != QMessageBox.Yes:
             return
 
-        success_count = 0
-        failed_students = []
-        
-        for student_id in selected_students:
-            try:
-                if add_score_event(student_id, rule_name, score_value):
-                    success_count += 1
-                else:
-                    failed_students.append(student_id)
-            except Exception:
-                failed_students.append(student_id)
+        results = add_score_events_bulk(selected_students, rule_name, score_value)
+        success_count = sum(1 for _, ok in results if ok)
+        failed_students = [student_id for student_id, ok in results if not ok]
         
         # 显示结果
         if success_count > 0:
@@ -272,16 +264,9 @@ class ScoringPage(QWidget):
 
         rule_name, score_value = selected_rule_data
 
-        success_count = 0
-        failed_students = []
-        for student_id in student_ids:
-            try:
-                if add_score_event(student_id, rule_name, score_value):
-                    success_count += 1
-                else:
-                    failed_students.append(student_id)
-            except Exception:
-                failed_students.append(student_id)
+        results = add_score_events_bulk(student_ids, rule_name, score_value)
+        success_count = sum(1 for _, ok in results if ok)
+        failed_students = [student_id for student_id, ok in results if not ok]
         
         if success_count > 0:
             QMessageBox.information(self, "成功", f"成功为 {success_count} 名学生记分！")
@@ -305,8 +290,8 @@ class ScoringPage(QWidget):
 
         events = get_score_events_by_student(student_id)
         self.history_table.setRowCount(len(events))
-        for i, (sid, event_name, score_change, timestamp) in enumerate(events):
-            self.history_table.setItem(i, 0, QTableWidgetItem(event_name))
-            self.history_table.setItem(i, 1, QTableWidgetItem(f"{score_change:+d}"))
-            self.history_table.setItem(i, 2, QTableWidgetItem(timestamp))
+        for i, event in enumerate(events):
+            self.history_table.setItem(i, 0, QTableWidgetItem(event.event_name))
+            self.history_table.setItem(i, 1, QTableWidgetItem(f"{event.score_change:+d}"))
+            self.history_table.setItem(i, 2, QTableWidgetItem(event.timestamp))
 